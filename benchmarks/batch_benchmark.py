@@ -0,0 +1,85 @@
+"""
+Benchmark the row and the columnar batch (ETL_BATCH_TRANSFORM) transform paths of the stream loaders.
+
+Both paths transform and serialize the same --rows synthetic Indeed API results with the text (TSV) and the binary
+(PGCOPY) stream loaders. The COPY input stream is drained without loading it, so only the transform and the
+serialization are timed.
+
+    python benchmarks/batch_benchmark.py --rows 1000000
+"""
+import sys
+import time
+import argparse
+
+sys.path.insert(0, '.')
+
+from etl import config
+from etl.common.stream_loader import StreamLoader, BinaryStreamLoader
+from etl.indeed.indeed_transformer import IndeedTransformer
+
+# Read size used to drain the stream, same as psycopg2 copy_expert
+COPY_READ_SIZE = 8192
+
+
+class SyntheticExtractor:
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def extract(self):
+        for i in range(self.rows):
+            yield {
+                'jobkey': 'key_{:024d}'.format(i),
+                'query': 'python developer',
+                'jobtitle': 'Senior "Python" Developer {}'.format(i % 1000),
+                'company': 'Company {}'.format(i % 5000),
+                'city': 'Charlotte',
+                'state': 'NC',
+                'country': 'US',
+                'latitude': 35.2271 + i % 100 / 1000,
+                'longitude': -80.8431 - i % 100 / 1000,
+                'language': 'en',
+                'formattedLocation': 'Charlotte, NC',
+                'source': 'Indeed',
+                'date': 'Mon, {:02d} Apr 2019 {:02d}:33:51 GMT'.format(1 + i % 28, i % 24),
+                'url': 'http://www.indeed.com/viewjob?jk={:016x}&qd=abcdefghijklmnopqrstuvwxyz'.format(i),
+                'onmousedown': "indeed_clk(this,'{}');".format(i % 10000),
+                'sponsored': i % 10 == 0,
+                'expired': False,
+                'indeedApply': i % 2 == 0,
+                'formattedLocationFull': 'Charlotte, NC 28202',
+                'formattedRelativeTime': '{} days ago'.format(i % 30),
+                'stations': None,
+            }
+
+
+def _serialize(loader_class, rows, batch_transform):
+    """
+    Drain the COPY input stream without loading it
+    """
+    config.ETL_BATCH_TRANSFORM = batch_transform
+    loader = loader_class(SyntheticExtractor(rows), IndeedTransformer())
+
+    started_at = time.time()
+    with loader.open_stream() as upload_file:
+        while upload_file.read(COPY_READ_SIZE):
+            pass
+        size = upload_file.tell()
+
+    return loader.processed_rows_count, size, time.time() - started_at
+
+
+def main(rows):
+    for loader_class in (StreamLoader, BinaryStreamLoader):
+        for batch_transform in (False, True):
+            loaded_rows, size, duration = _serialize(loader_class, rows, batch_transform)
+            print('{} {}: {} rows, {:.1f} MB in {:.2f}s ({:.0f} rows/s)'.format(
+                loader_class.__name__, 'batch' if batch_transform else 'row', loaded_rows, size / 1024 / 1024,
+                duration, loaded_rows / duration))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark row and batch transform')
+    parser.add_argument('--rows', type=int, default=1000000, help='synthetic API results')
+    cmd_args = parser.parse_args()
+    main(cmd_args.rows)
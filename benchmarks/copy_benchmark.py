@@ -0,0 +1,116 @@
+"""
+Benchmark the text (TSV) and the binary (PGCOPY) stage COPY on synthetic Indeed stage rows.
+
+Both formats serialize the same --rows fact rows with the stream loaders, once without loading them and once
+into a temporary copy of the stage table, so the serialization and the server side parsing are timed apart.
+
+    python benchmarks/copy_benchmark.py --rows 1000000
+"""
+import sys
+import time
+import argparse
+from datetime import date, time as dt_time
+
+sys.path.insert(0, '.')
+
+from etl.common.db import get_postgres
+from etl.common.stream_loader import StreamLoader, BinaryStreamLoader
+from etl.indeed.indeed_transformer import IndeedTransformer, STAGE_TABLE_DDL, STAGE_TABLE_NAME
+
+BENCH_TABLE_NAME = 'bench_stage_jobs'
+# Read size used to drain the stream, same as psycopg2 copy_expert
+COPY_READ_SIZE = 8192
+
+
+class FactRowTransformer(IndeedTransformer):
+    """
+    Pass synthetic fact rows through unchanged, so only the serialization is measured
+    """
+
+    def transform(self, doc):
+        yield doc
+
+
+class SyntheticExtractor:
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def extract(self):
+        for i in range(self.rows):
+            yield {
+                'jobkey': 'key_{:024d}'.format(i),
+                'jobquery': 'python developer',
+                'jobtitle': 'Senior Python Developer {}'.format(i % 1000),
+                'company': 'Company {}'.format(i % 5000),
+                'city': 'Charlotte',
+                'state': 'NC',
+                'country': 'US',
+                'latitude': 35.2271 + i % 100 / 1000,
+                'longitude': -80.8431 - i % 100 / 1000,
+                'language': 'en',
+                'formattedlocation': 'Charlotte, NC',
+                'jobsource': 'Indeed',
+                'jobdate': 'Mon, 15 Apr 2019 18:33:51 GMT',
+                'url': 'http://www.indeed.com/viewjob?jk={:016x}&qd=abcdefghijklmnopqrstuvwxyz'.format(i),
+                'onmousedown': "indeed_clk(this,'{}');".format(i % 10000),
+                'sponsored': i % 10 == 0,
+                'expired': False,
+                'indeedapply': i % 2 == 0,
+                'formattedlocationfull': 'Charlotte, NC 28202',
+                'formattedrelativetime': '{} days ago'.format(i % 30),
+                'stations': None,
+                'job_date': date(2019, 4, 1 + i % 28),
+                'job_time': dt_time(i % 24, i % 60, i % 60),
+                'day_num': i % 7 + 1,
+                'zip': '28202',
+            }
+
+
+def _make_loader(loader_class, rows):
+    return loader_class(SyntheticExtractor(rows), FactRowTransformer())
+
+
+def _serialize(loader_class, rows):
+    """
+    Drain the COPY input stream without loading it
+    """
+    started_at = time.time()
+    with _make_loader(loader_class, rows).open_stream() as upload_file:
+        while upload_file.read(COPY_READ_SIZE):
+            pass
+    return time.time() - started_at
+
+
+def _copy(loader_class, rows):
+    loader = _make_loader(loader_class, rows)
+
+    started_at = time.time()
+    with get_postgres() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('drop table if exists {}'.format(BENCH_TABLE_NAME))
+            cursor.execute(STAGE_TABLE_DDL.replace(
+                'create table {}'.format(STAGE_TABLE_NAME), 'create temp table {}'.format(BENCH_TABLE_NAME)))
+            with loader.open_stream() as upload_file:
+                cursor.copy_expert('COPY {} from stdin with {}'.format(BENCH_TABLE_NAME, loader.copy_options),
+                                   upload_file)
+                loaded_rows, size = cursor.rowcount, upload_file.tell()
+        conn.rollback()
+
+    return loaded_rows, size, time.time() - started_at
+
+
+def main(rows):
+    for loader_class in (StreamLoader, BinaryStreamLoader):
+        serialize_duration = _serialize(loader_class, rows)
+        loaded_rows, size, duration = _copy(loader_class, rows)
+        print('{}: {} rows, {:.1f} MB, serialization only {:.2f}s, serialization and COPY {:.2f}s ({:.0f} rows/s), '
+              'COPY share {:.2f}s'.format(loader_class.__name__, loaded_rows, size / 1024 / 1024, serialize_duration,
+                                          duration, loaded_rows / duration, duration - serialize_duration))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark text and binary stage COPY')
+    parser.add_argument('--rows', type=int, default=1000000, help='synthetic stage rows')
+    cmd_args = parser.parse_args()
+    main(cmd_args.rows)
@@ -0,0 +1,113 @@
+"""
+Benchmark the NOT IN anti-join inserts replaced by INSERT ... ON CONFLICT merges.
+
+Temporary copies of indeed_jobs, indeed_queries and indeed_jobs_duration are filled with --rows existing rows.
+A stage of --stage-rows rows, half of them new, is then merged with both statements. The indeed_jobs_duration
+merge is run from all the indeed_jobs keys, from the stage keys only and from the stage keys plus a backfill of
+the keys missing from the target. Every statement runs under a savepoint which is rolled back, so all of them see
+the same data.
+
+    python benchmarks/merge_benchmark.py --rows 1000000 --stage-rows 10000
+"""
+import sys
+import time
+import argparse
+
+import psycopg2
+
+sys.path.insert(0, '.')
+
+from etl.common.db import get_postgres
+from etl.sql.merge import build_merge_query
+
+# <editor-fold desc='Benchmark tables DDL'>
+SETUP_QUERIES = (
+    """
+    create temp table bench_jobs (job_key varchar(30) primary key, job_title varchar(200))
+    """,
+    """
+    insert into bench_jobs
+    select 'key_' || i, 'title ' || i from generate_series(1, %(rows)s) i
+    """,
+    """
+    create temp table bench_stage_jobs as
+    select 'key_' || (%(rows)s - %(stage_rows)s / 2 + i) jobkey, 'title' jobtitle, 'query' jobquery
+    from generate_series(1, %(stage_rows)s) i
+    """,
+    """
+    create temp table bench_queries (job_key varchar(30), job_query varchar(50), primary key (job_key, job_query))
+    """,
+    """
+    insert into bench_queries select job_key, 'query' from bench_jobs
+    """,
+    """
+    create temp table bench_jobs_duration (job_key varchar(30) primary key)
+    """,
+    """
+    insert into bench_jobs_duration select job_key from bench_jobs
+    """,
+    'analyze bench_jobs',
+    'analyze bench_stage_jobs',
+    'analyze bench_queries',
+    'analyze bench_jobs_duration',
+)
+# </editor-fold>
+
+JOBS_SELECT = 'select distinct jobkey, jobtitle from bench_stage_jobs'
+QUERIES_SELECT = 'select distinct jobkey, jobquery from bench_stage_jobs'
+DURATION_SELECT = 'select distinct j.job_key from bench_jobs j'
+DURATION_STAGE_SELECT = DURATION_SELECT + """
+    join (select distinct jobkey from bench_stage_jobs) sj on j.job_key = sj.jobkey"""
+DURATION_BACKFILL_SELECT = DURATION_STAGE_SELECT + """
+    union select j.job_key from bench_jobs j
+    where not exists (select 1 from bench_jobs_duration d where d.job_key = j.job_key)"""
+
+STATEMENTS = (
+    ('indeed_jobs NOT IN', 'insert into bench_jobs {} where jobkey not in (select job_key from bench_jobs)'
+     .format(JOBS_SELECT)),
+    ('indeed_jobs ON CONFLICT', build_merge_query('bench_jobs', JOBS_SELECT, ['job_key'])),
+    ('indeed_queries NOT IN (concatenated key)',
+     'insert into bench_queries {} where jobkey||jobquery not in (select job_key||job_query from bench_queries)'
+     .format(QUERIES_SELECT)),
+    ('indeed_queries ON CONFLICT', build_merge_query('bench_queries', QUERIES_SELECT, ['job_key', 'job_query'])),
+    ('indeed_jobs_duration ON CONFLICT, all indeed_jobs keys',
+     build_merge_query('bench_jobs_duration', DURATION_SELECT, ['job_key'])),
+    ('indeed_jobs_duration ON CONFLICT, stage keys only',
+     build_merge_query('bench_jobs_duration', DURATION_STAGE_SELECT, ['job_key'])),
+    ('indeed_jobs_duration ON CONFLICT, stage keys and missing keys backfill',
+     build_merge_query('bench_jobs_duration', DURATION_BACKFILL_SELECT, ['job_key'])),
+)
+
+
+def _time_statement(cursor, sql_query, timeout):
+    cursor.execute('savepoint bench')
+    cursor.execute('set local statement_timeout = %s', (timeout * 1000, ))
+    started_at = time.time()
+    try:
+        cursor.execute(sql_query)
+        result = '{:.3f}s, {} rows'.format(time.time() - started_at, cursor.rowcount)
+    except psycopg2.extensions.QueryCanceledError:
+        result = 'over {}s, cancelled'.format(timeout)
+    cursor.execute('rollback to savepoint bench')
+    return result
+
+
+def main(rows, stage_rows, timeout):
+    with get_postgres() as conn:
+        with conn.cursor() as cursor:
+            print('creating {} existing rows and {} stage rows'.format(rows, stage_rows))
+            for sql_query in SETUP_QUERIES:
+                cursor.execute(sql_query, {'rows': rows, 'stage_rows': stage_rows})
+
+            for name, sql_query in STATEMENTS:
+                print('{}: {}'.format(name, _time_statement(cursor, sql_query, timeout)))
+        conn.rollback()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark NOT IN inserts against ON CONFLICT merges')
+    parser.add_argument('--rows', type=int, default=1000000, help='existing target rows')
+    parser.add_argument('--stage-rows', type=int, default=10000, help='stage rows, half of them new')
+    parser.add_argument('--timeout', type=int, default=300, help='statement timeout in seconds')
+    cmd_args = parser.parse_args()
+    main(cmd_args.rows, cmd_args.stage_rows, cmd_args.timeout)
@@ -3,8 +3,24 @@ Base ETL context class.
 """
 from datetime import datetime
 
+import pyarrow
+
 from etl import constants
 
+# Arrow types of stage column types
+ARROW_TYPES = {
+    'varchar': pyarrow.string(),
+    'text': pyarrow.string(),
+    'float8': pyarrow.float64(),
+    'int4': pyarrow.int32(),
+    'bool': pyarrow.bool_(),
+    'date': pyarrow.date32(),
+    'time': pyarrow.time64('us'),
+}
+
+# Errors of a batch with values not matching the column types
+TRANSFORM_BATCH_ERRORS = (pyarrow.ArrowException, TypeError, ValueError, AttributeError)
+
 
 class BaseTransformer:
     """
@@ -14,6 +30,7 @@ class BaseTransformer:
     _stage_table_name = None
     _stage_table_ddl = None
     _tsv_fields = None
+    _column_types = None
 
     @staticmethod
     def _make_tsv_file_name(name):
@@ -51,6 +68,29 @@ class BaseTransformer:
 
         raise NotImplementedError('The get_tsv_fields() method must be implemented')
 
+    def get_column_types(self):
+        """
+        Get stage column types, a dict {field name: Postgres type name}
+        """
+        if self._column_types:
+            return self._column_types
+
+        raise NotImplementedError('The get_column_types() method must be implemented')
+
+    def get_arrow_schema(self):
+        """
+        Get Arrow schema of transformed batches, fields in the TSV fields order
+        """
+        column_types = self.get_column_types()
+        return pyarrow.schema([
+            pyarrow.field(field, ARROW_TYPES[column_types[field]]) for field in self.get_tsv_fields()])
+
+    def transform_batch(self, docs):
+        """
+        Transform a list of extracted items into an Arrow table with get_arrow_schema() columns
+        """
+        raise NotImplementedError('The transform_batch() method must be implemented')
+
     def get_tsv_file(self):
         """
         Get output TSV file name
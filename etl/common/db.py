@@ -1,24 +1,65 @@
 """
 PostGresDB related utilities
 """
-import sys
-from time import sleep
+import time
+import uuid
+import threading
 from functools import wraps
 from contextlib import contextmanager
 
 import psycopg2
+import psycopg2.extras
 import psycopg2.extensions as extensions
 
 from etl import config
 
 
+class DbPoolError(Exception):
+    """
+    Base DB connection pool error
+    """
+
+
+class DbConnectError(DbPoolError):
+    """
+    Raised when a DB connection can't be established after all retries
+    """
+
+
+class DbPoolTimeout(DbPoolError):
+    """
+    Raised when no connection is released back into an exhausted pool in time
+    """
+
+
 class DbConn:
     """
-    Safely obtain a DB connection and cache it for future uses. Thread safe.
+    Bounded pool of DB connections. Thread safe.
+
+    Up to max_size connections are opened, further checkouts block until a connection is released
+    or the timeout expires. Idle connections are checked for liveness before reuse.
     """
 
-    def __init__(self):
+    def __init__(self, min_size=None, max_size=None, timeout=None):
+        self._min_size = config.ETL_DB_POOL_MIN if min_size is None else min_size
+        self._max_size = max(config.ETL_DB_POOL_MAX if max_size is None else max_size, self._min_size, 1)
+        self._timeout = config.ETL_DB_POOL_TIMEOUT if timeout is None else timeout
+
+        # Idle connections with the time they were released
         self._pool = []
+        # Amount of open connections, both idle and checked out
+        self._size = 0
+        self._warmed_up = False
+        self._lock = threading.Condition(threading.Lock())
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'connects': 0,
+            'reconnects': 0,
+            'discarded': 0,
+        }
 
         self._db_user = config.PG_DB_USER
         self._db_pass = config.PG_DB_PASS
@@ -27,41 +68,167 @@ class DbConn:
         self._db_name = config.PG_DB_NAME
 
     def _connect(self):
+        options = None
+        if config.ETL_DB_STATEMENT_TIMEOUT > 0:
+            options = '-c statement_timeout={}'.format(config.ETL_DB_STATEMENT_TIMEOUT * 1000)
+
         retries = config.ETL_DB_RETRIES
-        while retries > 0:
+        while True:
             retries -= 1
             try:
-                return psycopg2.connect(
+                conn = psycopg2.connect(
                     host=self._db_host,
                     port=self._db_port,
                     dbname=self._db_name,
                     user=self._db_user,
                     password=self._db_pass,
+                    options=options,
                 )
-            except psycopg2.OperationalError:
-                if retries == 0:
-                    sys.exit(1)
+                with self._lock:
+                    self._stats['connects'] += 1
+                return conn
+            except psycopg2.OperationalError as ex:
+                if retries <= 0:
+                    raise DbConnectError('Unable to connect to PostgreSQL: {}'.format(ex)) from ex
 
                 # Get some extra progressive sleep
-                sleep(config.ETL_DB_TIMEOUT * (config.ETL_DB_RETRIES - retries))
+                sleep_time = config.ETL_DB_TIMEOUT * (config.ETL_DB_RETRIES - retries)
+                time.sleep(sleep_time)
+
+    @staticmethod
+    def _is_alive(conn, released_at):
+        if conn.closed:
+            return False
+
+        if time.monotonic() - released_at < config.ETL_DB_CHECK_INTERVAL:
+            return True
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('select 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def _release_slot(self):
+        with self._lock:
+            self._size -= 1
+            self._lock.notify()
+
+    def _warm_up(self):
+        conns = []
+        try:
+            for _ in range(self._min_size):
+                conns.append(self._checkout())
+        finally:
+            for conn in conns:
+                self.put_conn(conn)
 
     def get_conn(self):
+        with self._lock:
+            is_warm_up = not self._warmed_up
+            self._warmed_up = True
+            self._stats['checkouts'] += 1
+
+        if is_warm_up:
+            self._warm_up()
+
+        return self._checkout()
+
+    def _checkout(self):
+        deadline = time.monotonic() + self._timeout
+        wait_started_at = None
+        with self._lock:
+            while not self._pool and self._size >= self._max_size:
+                now = time.monotonic()
+                if wait_started_at is None:
+                    wait_started_at = now
+                    self._stats['waits'] += 1
+
+                if now >= deadline:
+                    self._stats['wait_time'] += now - wait_started_at
+                    raise DbPoolTimeout('No DB connection available in {}s, pool size {}'.format(
+                        self._timeout, self._max_size))
+
+                self._lock.wait(deadline - now)
+
+            if wait_started_at is not None:
+                self._stats['wait_time'] += time.monotonic() - wait_started_at
+
+            if self._pool:
+                conn, released_at = self._pool.pop()
+            else:
+                conn, released_at = None, None
+                self._size += 1
+
+        if conn is not None:
+            if self._is_alive(conn, released_at):
+                return conn
+
+            self._close(conn)
+            with self._lock:
+                self._stats['discarded'] += 1
+                self._stats['reconnects'] += 1
+
         try:
-            return self._pool.pop()
-        except IndexError:
             return self._connect()
+        except Exception:
+            self._release_slot()
+            raise
 
     def put_conn(self, conn):
         # Put back into the pool only good connections
         if not conn.closed:
             status = conn.get_transaction_status()
-            if status != extensions.TRANSACTION_STATUS_UNKNOWN and status == extensions.TRANSACTION_STATUS_IDLE:
-                self._pool.append(conn)
+            if status in (extensions.TRANSACTION_STATUS_INTRANS, extensions.TRANSACTION_STATUS_INERROR):
+                # Uncommitted work is dropped the same way closing the connection would
+                try:
+                    conn.rollback()
+                    status = conn.get_transaction_status()
+                except psycopg2.Error:
+                    status = extensions.TRANSACTION_STATUS_UNKNOWN
+
+            if status == extensions.TRANSACTION_STATUS_IDLE:
+                with self._lock:
+                    self._pool.append((conn, time.monotonic()))
+                    self._lock.notify()
+                return
+
+        self._close(conn)
+        with self._lock:
+            self._stats['discarded'] += 1
+        self._release_slot()
+
+    def get_stats(self):
+        """
+        Get pool counters: checkouts, waits, wait time, connects, reconnects, discarded connections
+        and current open/idle connections amount
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._pool)
+            return stats
 
 
 _DB_CONN = DbConn()
 
 
+def get_pool_stats():
+    """
+    Get DB connection pool counters
+    """
+    return _DB_CONN.get_stats()
+
+
 @contextmanager
 def get_postgres():
     """
@@ -74,6 +241,30 @@ def get_postgres():
         _DB_CONN.put_conn(conn)
 
 
+def iter_query(sql_query, params=None, itersize=None, cursor_factory=psycopg2.extras.RealDictCursor):
+    """
+    Stream query results through a named server-side cursor, itersize rows per round-trip.
+
+    The cursor is declared WITH HOLD in autocommit mode: the server runs the whole query and materializes the
+    result set when the declaring statement commits, before the first row is fetched. The first row thus comes
+    no sooner than with fetchall(), only the client memory stays bounded. In exchange no transaction stays open
+    while the caller processes rows (for ex. waits for HTTP responses), so vacuum isn't blocked.
+    """
+    with get_postgres() as conn:
+        conn.autocommit = True
+        cursor = conn.cursor(name='etl_{}'.format(uuid.uuid4().hex), cursor_factory=cursor_factory, withhold=True)
+        cursor.itersize = itersize or config.ETL_DB_ITERSIZE
+        try:
+            cursor.execute(sql_query, params)
+            for row in cursor:
+                yield row
+        finally:
+            try:
+                cursor.close()
+            finally:
+                conn.autocommit = False
+
+
 def handle_error(func):
     """
     Handle Postgres errors
@@ -0,0 +1,246 @@
+"""
+PGCOPY binary format writer.
+
+Rows are encoded with the stage column types so Postgres doesn't have to parse text values
+and values with tabs, quotes or backslashes don't need any escaping.
+https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+"""
+import struct
+from datetime import date, time
+
+import numpy
+
+from etl.constants import TRUE_VALUES
+from etl.base.transformer import ARROW_TYPES
+
+COPY_OPTIONS = '(format binary)'
+
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('!h', -1)
+PG_EPOCH = date(2000, 1, 1)
+
+_NULL = struct.pack('!i', -1)
+_FLOAT8 = struct.Struct('!id')
+_INT4 = struct.Struct('!ii')
+_INT8 = struct.Struct('!iq')
+_BOOL_TRUE = struct.pack('!ib', 1, 1)
+_BOOL_FALSE = struct.pack('!ib', 1, 0)
+# Days from the Unix epoch of Arrow dates to the Postgres epoch
+_PG_EPOCH_DAYS = (PG_EPOCH - date(1970, 1, 1)).days
+
+
+def _encode_text(value):
+    data = str(value).encode('utf-8')
+    return struct.pack('!i', len(data)) + data
+
+
+def _encode_float8(value):
+    return _FLOAT8.pack(8, float(value))
+
+
+def _encode_int4(value):
+    return _INT4.pack(4, int(value))
+
+
+def _encode_bool(value):
+    if isinstance(value, str):
+        value = value.lower() in TRUE_VALUES
+    return _BOOL_TRUE if value else _BOOL_FALSE
+
+
+def _encode_date(value):
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return _INT4.pack(4, (value - PG_EPOCH).days)
+
+
+def _encode_time(value):
+    if isinstance(value, str):
+        value = time.fromisoformat(value)
+    microseconds = ((value.hour * 60 + value.minute) * 60 + value.second) * 1000000 + value.microsecond
+    return _INT8.pack(8, microseconds)
+
+
+ENCODERS = {
+    'varchar': _encode_text,
+    'text': _encode_text,
+    'float8': _encode_float8,
+    'int4': _encode_int4,
+    'bool': _encode_bool,
+    'date': _encode_date,
+    'time': _encode_time,
+}
+
+
+class PgBinaryWriter:
+    """
+    Encode dict rows into PGCOPY binary tuples driven by a field list and column types
+    """
+
+    def __init__(self, fields, column_types):
+        try:
+            self._encoders = [(field, ENCODERS[column_types[field]]) for field in fields]
+        except KeyError as ex:
+            raise ValueError('No binary encoder for stage field {}'.format(ex)) from ex
+        self._column_types = [column_types[field] for field in fields]
+
+        self._tuple_header = struct.pack('!h', len(self._encoders))
+
+    @staticmethod
+    def get_header():
+        return PGCOPY_HEADER
+
+    @staticmethod
+    def get_trailer():
+        return PGCOPY_TRAILER
+
+    def encode_row(self, row):
+        """
+        Encode a single row
+
+        :raise ValueError, TypeError: if a value doesn't match its column type
+        """
+        encoded = [self._tuple_header]
+        for field, encoder in self._encoders:
+            value = row.get(field)
+            encoded.append(_NULL if value is None else encoder(value))
+
+        return b''.join(encoded)
+
+    def encode_table(self, table):
+        """
+        Encode an Arrow table with the writer fields as columns, see _encode_batch()
+
+        :return: list of encoded rows
+        :raise TypeError: if a column doesn't have the Arrow type of its column type
+        """
+        if list(table.schema.names) != [field for field, _ in self._encoders]:
+            raise TypeError('Table columns {} do not match the writer fields'.format(table.schema.names))
+
+        records = []
+        for batch in table.to_batches():
+            records.extend(self._encode_batch(batch))
+
+        return records
+
+    def _encode_batch(self, batch):
+        """
+        Encode an Arrow record batch from the column buffers: every column is written into one byte array with
+        numpy, without converting values to Python objects
+        """
+        rows = batch.num_rows
+        if not rows:
+            return []
+
+        columns = [_encode_column(column_type, batch.column(i))
+                   for i, column_type in enumerate(self._column_types)]
+        row_sizes = numpy.full(rows, 2, dtype=numpy.int64)
+        for sizes, _ in columns:
+            row_sizes += sizes
+        row_ends = numpy.cumsum(row_sizes)
+        row_starts = row_ends - row_sizes
+
+        data = numpy.empty(int(row_ends[-1]), dtype=numpy.uint8)
+        _put(data, row_starts, numpy.frombuffer(self._tuple_header, dtype=numpy.uint8)[None, :])
+        positions = row_starts + 2
+        for sizes, write in columns:
+            write(data, positions)
+            positions = positions + sizes
+
+        data = data.tobytes()
+        return [data[start:end] for start, end in zip(row_starts.tolist(), row_ends.tolist())]
+
+
+def _put(data, positions, values):
+    """
+    Write rows of a 2D byte array at positions of data
+    """
+    data[positions[:, None] + numpy.arange(values.shape[1])] = values
+
+
+def _get_nulls(array):
+    """
+    Get a bool numpy array, True for null values of an Arrow array
+    """
+    validity = array.buffers()[0]
+    if validity is None or array.null_count == 0:
+        return numpy.zeros(len(array), dtype=bool)
+
+    bits = numpy.unpackbits(numpy.frombuffer(validity, dtype=numpy.uint8), bitorder='little')
+    return bits[array.offset:array.offset + len(array)] == 0
+
+
+def _get_lengths(nulls, lengths):
+    """
+    Get big-endian value length fields, -1 for nulls
+    """
+    return numpy.where(nulls, -1, lengths).astype('>i4').view(numpy.uint8).reshape(-1, 4)
+
+
+def _encode_fixed_column(nulls, values):
+    """
+    Encode a fixed width column
+
+    :param values: big-endian numpy values
+    :return: tuple (field sizes, writer function)
+    """
+    width = values.dtype.itemsize
+    sizes = numpy.where(nulls, 4, 4 + width)
+    values = values.view(numpy.uint8).reshape(-1, width)
+
+    def write(data, positions):
+        _put(data, positions, _get_lengths(nulls, width))
+        _put(data, positions[~nulls] + 4, values[~nulls])
+
+    return sizes, write
+
+
+def _encode_text_column(array, nulls):
+    """
+    Encode a string column, Arrow strings are already utf-8 encoded
+    """
+    _, offsets, chars = array.buffers()
+    offsets = numpy.frombuffer(offsets, dtype=numpy.int32)[array.offset:array.offset + len(array) + 1]
+    lengths = numpy.where(nulls, 0, numpy.diff(offsets))
+    sizes = 4 + lengths
+    chars = numpy.frombuffer(chars, dtype=numpy.uint8) if chars is not None else numpy.empty(0, numpy.uint8)
+
+    def write(data, positions):
+        _put(data, positions, _get_lengths(nulls, lengths))
+        # Index of every char within its value
+        char_index = numpy.arange(int(lengths.sum())) - numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+        data[numpy.repeat(positions + 4, lengths) + char_index] = chars[numpy.repeat(offsets[:-1], lengths) +
+                                                                        char_index]
+
+    return sizes, write
+
+
+def _get_fixed_values(array, dtype):
+    return numpy.frombuffer(array.buffers()[1], dtype=dtype)[array.offset:array.offset + len(array)]
+
+
+def _encode_column(column_type, array):
+    """
+    :return: tuple (field sizes, writer function) of an Arrow array of a column type
+    :raise TypeError: if the array doesn't have the Arrow type of the column type
+    """
+    if array.type != ARROW_TYPES[column_type]:
+        raise TypeError('Expected an Arrow {} array for {}, got {}'.format(
+            ARROW_TYPES[column_type], column_type, array.type))
+
+    nulls = _get_nulls(array)
+    if column_type in ('varchar', 'text'):
+        return _encode_text_column(array, nulls)
+    if column_type == 'float8':
+        values = _get_fixed_values(array, numpy.float64).astype('>f8')
+    elif column_type == 'int4':
+        values = _get_fixed_values(array, numpy.int32).astype('>i4')
+    elif column_type == 'date':
+        values = (_get_fixed_values(array, numpy.int32) - _PG_EPOCH_DAYS).astype('>i4')
+    elif column_type == 'time':
+        values = _get_fixed_values(array, numpy.int64).astype('>i8')
+    else:
+        bits = numpy.unpackbits(numpy.frombuffer(array.buffers()[1], dtype=numpy.uint8), bitorder='little')
+        values = bits[array.offset:array.offset + len(array)].astype(numpy.uint8)
+
+    return _encode_fixed_column(nulls, values)
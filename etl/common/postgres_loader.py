@@ -1,118 +1,359 @@
 """
-Load a TSV file into a Redshift database.
+Load extracted data into a PostgreSQL stage table.
+
+Data is loaded with a single streamed COPY by default. With ETL_COPY_QUARANTINE enabled data is loaded with COPY
+in batches of rows, each batch under a savepoint. When a batch fails the batch is bisected into smaller COPYs until
+the offending rows are found. Those rows are saved into the quarantine table with the error text and the row number
+while all the good rows still load. Only errors caused by the row values (ROW_ERRORS) are bisected, any other error
+fails the load. Binary (PGCOPY) rows are saved hex encoded, text rows as text.
 """
+import io
 import os
 import re
-import inspect
+import time
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import psycopg2
-import psycopg2.extras
 
 from etl import config
-from etl.constants import NULL_VALUE
 from etl.sql.runner import runner
 from etl.common.db import get_postgres, handle_error
+from etl.utils import metrics, profiling
 from etl import constants
 
-REDSHIFT_COPY_ERROR = """"\
-    File: '{filename}'
-    Error: '{err_reason}'
-    FieldName: '{colname}'
-    FieldType: '{type}'
-    ReceivedValue: '{raw_field_value}'
-    RawLine: '{raw_line}' 
+QUARANTINE_TABLE_NAME = 'public.etl_quarantine'
+# Temporary table created from the stage DDL to compare it with an existing stage table
+LAYOUT_TABLE_NAME = 'etl_stage_layout'
+# COPY errors caused by a row: malformed or out of range values, constraint violations
+ROW_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError)
+
+# <editor-fold desc='Quarantine table DDL'>
+QUARANTINE_TABLE_DDL = f"""
+create table if not exists {QUARANTINE_TABLE_NAME} (
+	id SERIAL PRIMARY KEY,
+	table_name VARCHAR(100),
+	source VARCHAR(200),
+	line_number INTEGER,
+	raw_line TEXT,
+	error TEXT,
+	created_at TIMESTAMP default now()
+	)
 """
+# </editor-fold>
+
+
+def _iter_file_lines(file_path, start, end):
+    with open(file_path, 'rb') as tsv_file:
+        tsv_file.seek(start)
+        while tsv_file.tell() < end:
+            line = tsv_file.readline()
+            if not line:
+                return
+            yield line
+
+
+class FileChunk(io.RawIOBase):
+    """
+    Read-only binary file-like object limited to a byte range of a file
+    """
+
+    def __init__(self, file_path, start, end):
+        self._file = open(file_path, 'rb')
+        self._file.seek(start)
+        self._remaining = end - start
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+        super(FileChunk, self).close()
 
 
 class PostGresLoader:
     """
-    Redshift data loader
+    PostgreSQL stage table data loader
     """
 
     def __init__(self, transformer, file):
         self.table_name = transformer.get_stage_table_name()
         self.table_ddl = transformer.get_stage_table_ddl()
-        self.file = file.get_file_name()
+        # Source loader providing the COPY input: TsvLoader (saved file) or StreamLoader (no file)
+        self.source = file
+
+    def _get_table_ddl(self, unlogged):
+        if unlogged:
+            return re.sub(r'create\s+table', 'create unlogged table', self.table_ddl, count=1, flags=re.IGNORECASE)
+
+        return self.table_ddl
+
+    @staticmethod
+    def _get_layout(cursor, table_name):
+        """
+        :return: tuple (relpersistence, list of 'column type'), None if the table doesn't exist
+        """
+        cursor.execute("""
+        select c.relpersistence, array_agg(a.attname || ' ' || format_type(a.atttypid, a.atttypmod) order by a.attnum)
+        from pg_class c
+            join pg_attribute a on a.attrelid = c.oid and a.attnum > 0 and not a.attisdropped
+        where c.oid = to_regclass(%s)
+        group by c.relpersistence
+        """, (table_name, ))
+        return cursor.fetchone()
+
+    def _is_layout_current(self, cursor, unlogged):
+        """
+        Check an existing stage table still matches the stage DDL columns and the ETL_STAGE_UNLOGGED setting
+        """
+        layout = self._get_layout(cursor, self.table_name)
+        if layout is None:
+            return True
+
+        cursor.execute(re.sub(r'create\s+table\s+\S+', 'create temp table {}'.format(LAYOUT_TABLE_NAME),
+                              self.table_ddl, count=1, flags=re.IGNORECASE))
+        _, columns = self._get_layout(cursor, LAYOUT_TABLE_NAME)
+        cursor.execute('drop table {}'.format(LAYOUT_TABLE_NAME))
+
+        return layout[0] == ('u' if unlogged else 'p') and layout[1] == columns
 
     @handle_error
-    def rebuild_stage_table(self, recreate_table=True):
+    def rebuild_stage_table(self, recreate_table=True, truncate=False, unlogged=None):
         """
         Rebuild appropriate ETL stage table
+
+        :param recreate_table: Drop and create the table
+        :param truncate: Truncate an existing table instead of dropping it. A table whose columns don't match the
+                         DDL or which isn't UNLOGGED as configured is dropped and created again
+        :param unlogged: Create the table as UNLOGGED, no WAL is written for the stage data
         """
+        if unlogged is None:
+            unlogged = config.ETL_STAGE_UNLOGGED
+        table_ddl = self._get_table_ddl(unlogged)
+
         with get_postgres() as conn:
             with conn.cursor() as cursor:
-                if recreate_table:
+                if recreate_table and truncate and not self._is_layout_current(cursor, unlogged):
+                    print('stage table {} doesn\'t match its DDL, creating it again'.format(self.table_name))
+                    truncate = False
+
+                if recreate_table and not truncate:
                     cursor.execute("drop table if exists {} cascade".format(self.table_name))
-                    cursor.execute(self.table_ddl)
+                    cursor.execute(table_ddl)
                     conn.commit()
                     return
 
                 if not runner.table_exists(self.table_name):
-                    cursor.execute(self.table_ddl)
+                    cursor.execute(table_ddl)
                     conn.commit()
                     return
 
-    def load(self, *args, **kwargs):
+                if truncate:
+                    cursor.execute("truncate table {}".format(self.table_name))
+                    conn.commit()
+                    return
+
+    def create_stage_partition(self, suffix, unlogged=None):
+        """
+        Switch loading to a child table of the stage table. Selecting from the stage table returns the rows of
+        all its partitions, so sharded workers can each load their own partition.
+
+        :param suffix: Partition name suffix unique per worker
+        """
+        if unlogged is None:
+            unlogged = config.ETL_STAGE_UNLOGGED
+        partition_name = '{}_{}'.format(self.table_name, suffix)
 
         with get_postgres() as conn:
             with conn.cursor() as cursor:
-                try:
-                    with open(constants.LOCAL_STORAGE+self.file,"r") as upload_file:
-                        # cursor.copy_from(upload_file,self.table_name,sep='\t')
-                        # conn.commit()
-                        cursor.copy_expert("COPY {} from stdin with csv header delimiter '\t'"
-                                           .format(self.table_name),upload_file)
-                        conn.commit()
+                cursor.execute('create {}table if not exists {} () inherits ({})'.format(
+                    'unlogged ' if unlogged else '', partition_name, self.table_name))
+            conn.commit()
 
+        self.table_name = partition_name
 
-                    upload_error = False
-                    for msg in conn.notices:
-                        if '{}'.format(self.table_name) not in msg:
-                            continue
+    def _get_copy_info(self, chunk, rows, size, started_at):
+        metrics.count_copy(self.table_name, rows, size)
+        duration = time.time() - started_at
+        info = {
+            'chunk': chunk,
+            'rows': rows,
+            'bytes': size,
+            'duration_secs': duration,
+            'rows_per_sec': rows / duration if duration > 0 else 0.0,
+        }
+        print('COPY chunk {chunk}: {rows} rows, {bytes} bytes in {duration_secs:.2f}s ({rows_per_sec:.0f} rows/s)'
+              .format(**info))
+        return info
 
-                        upload_error = True if 'stl_load_errors' in msg else upload_error
-                        if 'record' in msg:
-                            try:
-                                rows_cnt = int(re.findall(r'\d+', msg)[0])
-                            except (IndexError, ValueError):
-                                pass
+    def _get_chunks(self, file_path, chunks_count):
+        """
+        Split a TSV file into row aligned byte ranges, the header row is skipped
+        """
+        file_size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as tsv_file:
+            tsv_file.readline()
+            offsets = [tsv_file.tell()]
+            for i in range(1, chunks_count):
+                tsv_file.seek(max(offsets[-1], file_size * i // chunks_count))
+                tsv_file.readline()
+                offsets.append(tsv_file.tell())
+            offsets.append(file_size)
+
+        return [(start, end) for start, end in zip(offsets, offsets[1:]) if end > start]
 
-                    if upload_error:
-                        self.show_redshift_error(conn, rollback=False)
-                        return
+    def _copy_records(self, cursor, records, line_number, quarantined):
+        """
+        COPY a list of records under a savepoint. On a row error (ROW_ERRORS) bisect the records
+        until the failing rows are isolated.
+
+        :return: amount of loaded rows
+        """
+        cursor.execute('savepoint etl_copy')
+        try:
+            cursor.copy_expert("COPY {} from stdin with {}".format(self.table_name, self.source.copy_chunk_options),
+                               self.source.make_payload(records))
+            rows = cursor.rowcount
+            cursor.execute('release savepoint etl_copy')
+            return rows
+        except ROW_ERRORS as ex:
+            cursor.execute('rollback to savepoint etl_copy')
+            if len(records) == 1:
+                quarantined.append((line_number, records[0], str(ex).strip()))
+                return 0
 
-                except psycopg2.InternalError as ex:
-                    raise ex
+        middle = len(records) // 2
+        return (self._copy_records(cursor, records[:middle], line_number, quarantined) +
+                self._copy_records(cursor, records[middle:], line_number + middle, quarantined))
 
-    def show_redshift_error(self, conn, rollback=True):
+    def _format_record(self, record):
         """
-        Fetch data load error from Redshift specific tables
+        Make a quarantine raw_line: binary records are always hex encoded, text records can't hold NUL characters
         """
-        if rollback:
-            conn.rollback()
+        if self.source.binary:
+            return record.hex()
+        if isinstance(record, bytes):
+            record = record.decode('utf-8', errors='backslashreplace')
 
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-            cursor.execute('SELECT pg_last_copy_id() as query_id')
-            query_id = cursor.fetchone()['query_id']
+        return record.replace('\x00', '\\x00')
+
+    def _quarantine(self, cursor, source_name, quarantined):
+        cursor.execute(QUARANTINE_TABLE_DDL)
+        for line_number, record, error in quarantined:
             cursor.execute("""
-                SELECT
-                  "raw_line",
-                  "filename",
-                  "line_number",
-                  "colname",
-                  "type",
-                  "raw_field_value",
-                  "err_reason"
-                FROM pg_catalog.stl_load_errors
-                WHERE "query" = {};
-                """.format(query_id))
-
-            errors = cursor.fetchall()
-            formatted_errors = []
-            for row in errors:
-                err_row = dict((key, str(val).strip()) for key, val in row.items())
-                formatted_errors.append(REDSHIFT_COPY_ERROR.format(**err_row))
-
-            msg = 'Redshift: stl_load_errors:{}'.format('\n'.join(formatted_errors))
-            self.logger.error(msg)
-            return errors
+            insert into {} (table_name, source, line_number, raw_line, error)
+            values (%s, %s, %s, %s, %s)
+            """.format(QUARANTINE_TABLE_NAME),
+                           (self.table_name, source_name, line_number, self._format_record(record), error))
+
+        metrics.count_copy(self.table_name, 0, 0, quarantined=len(quarantined))
+        print('Quarantined {} rows of {} into {}'.format(len(quarantined), source_name, QUARANTINE_TABLE_NAME))
+
+    def _copy_batches(self, conn, records, source_name):
+        """
+        COPY records in batches of ETL_COPY_BATCH_ROWS rows in a single transaction.
+        Failing rows are quarantined, line numbers count data rows only, starting from 1.
+
+        :return: tuple (loaded rows, quarantined rows, loaded bytes)
+        """
+        loaded_rows = 0
+        loaded_bytes = 0
+        quarantined = []
+        line_number = 1
+        with conn.cursor() as cursor:
+            while True:
+                batch = list(islice(records, config.ETL_COPY_BATCH_ROWS))
+                if not batch:
+                    break
+
+                loaded_rows += self._copy_records(cursor, batch, line_number, quarantined)
+                loaded_bytes += sum(len(record) for record in batch)
+                line_number += len(batch)
+
+            if quarantined:
+                self._quarantine(cursor, source_name, quarantined)
+
+        conn.commit()
+        return loaded_rows, len(quarantined), loaded_bytes
+
+    def _copy_chunk(self, chunk, file_path, start, end):
+        started_at = time.time()
+        with profiling.span('PostGresLoader.copy_chunk', chunk=chunk), get_postgres() as conn:
+            if config.ETL_COPY_QUARANTINE:
+                source_name = '{}[{}]'.format(self.source.get_file_name(), chunk)
+                rows, _, _ = self._copy_batches(conn, _iter_file_lines(file_path, start, end), source_name)
+            else:
+                with conn.cursor() as cursor:
+                    with FileChunk(file_path, start, end) as upload_file:
+                        cursor.copy_expert("COPY {} from stdin with {}"
+                                           .format(self.table_name, self.source.copy_chunk_options), upload_file)
+                    rows = cursor.rowcount
+                conn.commit()
+
+        return self._get_copy_info(chunk, rows, end - start, started_at)
+
+    def load_parallel(self, workers):
+        """
+        Split the source TSV file into row aligned chunks and COPY them over separate pooled connections.
+        Every chunk is committed on its own, so if a chunk fails the stage table is truncated once all the chunks
+        are done: the merge never sees a partially loaded stage.
+
+        :return: list of per chunk info dicts: rows, bytes, duration and throughput
+        """
+        file_path = constants.LOCAL_STORAGE + self.source.get_file_name()
+        chunks = self._get_chunks(file_path, workers)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(self._copy_chunk, chunk, file_path, start, end)
+                for chunk, (start, end) in enumerate(chunks)
+            ]
+            wait(futures)
+
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            with get_postgres() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute('truncate table {}'.format(self.table_name))
+                conn.commit()
+            raise errors[0]
+
+        return [future.result() for future in futures]
+
+    @profiling.traced('PostGresLoader.load')
+    def load(self, *args, **kwargs):
+        """
+        Load the source data into the stage table.
+        Chunks of a saved TSV file are loaded in parallel when ETL_COPY_WORKERS > 1,
+        streamed sources are always loaded with a single connection.
+        Bad rows are quarantined if ETL_COPY_QUARANTINE is enabled.
+
+        :return: list of per chunk info dicts
+        """
+        workers = kwargs.get('workers') or config.ETL_COPY_WORKERS
+        if workers > 1 and self.source.get_file_name() is not None:
+            return self.load_parallel(workers)
+
+        started_at = time.time()
+        with get_postgres() as conn:
+            if config.ETL_COPY_QUARANTINE:
+                source_name = self.source.get_file_name() or 'stream'
+                rows, _, size = self._copy_batches(conn, self.source.iter_records(), source_name)
+                return [self._get_copy_info(0, rows, size, started_at)]
+
+            with conn.cursor() as cursor:
+                with self.source.open_stream() as upload_file:
+                    cursor.copy_expert("COPY {} from stdin with {}"
+                                       .format(self.table_name, self.source.copy_options), upload_file)
+                    copy_info = self._get_copy_info(0, cursor.rowcount, upload_file.tell(), started_at)
+            conn.commit()
+
+        return [copy_info]
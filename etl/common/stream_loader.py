@@ -0,0 +1,234 @@
+"""
+Stream extracted and transformed data straight into COPY ... FROM STDIN.
+Unlike the TSV loader no intermediate file is written so extraction and loading overlap.
+"""
+import io
+import time
+
+from etl import config
+from etl import constants
+from etl.common import pgcopy_writer
+from etl.base.transformer import TRANSFORM_BATCH_ERRORS
+from etl.utils import metrics, profiling
+from etl.utils.common import iter_batches
+from etl.common.tsv_loader import COPY_OPTIONS, COPY_CHUNK_OPTIONS, get_tsv_writer, get_tsv_records
+
+
+class IteratorFile(io.IOBase):
+    """
+    Read-only file-like object on top of an iterator of strings or bytes
+    """
+
+    def __init__(self, iterator, binary=False):
+        self._iterator = iterator
+        self._empty = b'' if binary else ''
+        self._buffer = self._empty
+        self._position = 0
+        self._read_count = 0
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        """
+        Amount of characters (bytes for binary streams) read so far
+        """
+        return self._read_count
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._buffer[self._position:] + self._empty.join(self._iterator)
+            self._buffer, self._position = self._empty, 0
+            self._read_count += len(data)
+            return data
+
+        while len(self._buffer) - self._position < size:
+            try:
+                chunk = next(self._iterator)
+            except StopIteration:
+                break
+            self._buffer = self._buffer[self._position:] + chunk
+            self._position = 0
+
+        data = self._buffer[self._position:self._position + size]
+        self._position += len(data)
+        self._read_count += len(data)
+        return data
+
+
+class StreamLoader:
+    """
+    Serialize flatten data into an in-memory TSV stream consumed by the Postgres loader
+    """
+    copy_options = COPY_OPTIONS
+    # COPY options for a payload made of records only
+    copy_chunk_options = COPY_CHUNK_OPTIONS
+    binary = False
+    # Errors of rows counted as malformed
+    malformed_errors = (Exception, )
+
+    def __init__(self, extractor, transformer):
+        self.fields = transformer.get_tsv_fields()
+        self.extractor = extractor
+        self.transformer = transformer
+        self._transform_name = '{}.transform'.format(type(transformer).__name__)
+        self._buffer = io.StringIO()
+        self._writer = get_tsv_writer(self._buffer, self.fields)
+
+        self.extracted_items_count = 0
+        self.processed_rows_count = 0
+        self.malformed_rows_count = 0
+
+    def _get_header(self):
+        buffer = io.StringIO()
+        get_tsv_writer(buffer, self.fields).writeheader()
+        return buffer.getvalue()
+
+    def _get_trailer(self):
+        return ''
+
+    def iter_records(self):
+        """
+        Generate serialized rows and record the loader throughput once the stream is exhausted
+        """
+        started_at = time.time()
+        yield from self._iter_records()
+        metrics.count_loader_rows(
+            type(self).__name__, self.processed_rows_count, self.malformed_rows_count, time.time() - started_at)
+
+    def _encode_row(self, fact_row):
+        """
+        Serialize a single row into a TSV line
+        """
+        try:
+            self._writer.writerow(fact_row)
+            return self._buffer.getvalue()
+        finally:
+            self._buffer.seek(0)
+            self._buffer.truncate()
+
+    def _encode_batch(self, table):
+        """
+        Serialize an Arrow table into a list of TSV lines, one per row
+        """
+        return get_tsv_records(table)
+
+    def _iter_rows(self, items):
+        for item in items:
+            for fact_row in profiling.trace_generator(
+                    self._transform_name, self.transformer.transform(item), aggregate=True):
+                try:
+                    record = self._encode_row(fact_row)
+                    self.processed_rows_count += 1
+                except self.malformed_errors:
+                    self.malformed_rows_count += 1
+                    continue
+
+                yield record
+
+            # Count only correctly processed items
+            self.extracted_items_count += 1
+
+    def _iter_batch_rows(self, items):
+        for batch in iter_batches(items, config.ETL_TRANSFORM_BATCH_SIZE):
+            try:
+                with profiling.span(self._transform_name + '_batch', items=len(batch)):
+                    table = self.transformer.transform_batch(batch)
+                records = self._encode_batch(table)
+            except TRANSFORM_BATCH_ERRORS:
+                # Fall back to row by row to count malformed rows
+                yield from self._iter_rows(batch)
+                continue
+
+            self.processed_rows_count += table.num_rows
+            self.extracted_items_count += len(batch)
+            yield from records
+
+    def _iter_records(self):
+        """
+        Generate serialized rows
+        """
+        if config.ETL_BATCH_TRANSFORM:
+            return self._iter_batch_rows(self.extractor.extract())
+
+        return self._iter_rows(self.extractor.extract())
+
+    def make_payload(self, records):
+        """
+        Make a COPY input from a list of records, to be loaded with copy_chunk_options
+        """
+        return io.StringIO(''.join(records))
+
+    def _generate_chunks(self):
+        empty = b'' if self.binary else ''
+        chunk = [self._get_header()]
+        chunk_size = 0
+
+        for record in self.iter_records():
+            chunk.append(record)
+            chunk_size += len(record)
+
+            # Keep memory bounded, the chunk is drained as soon as it's big enough
+            if chunk_size >= constants.COPY_BUFFER_SIZE:
+                yield empty.join(chunk)
+                chunk = []
+                chunk_size = 0
+
+        chunk.append(self._get_trailer())
+        yield empty.join(chunk)
+
+    def get_file_name(self):
+        return None
+
+    def open_stream(self):
+        """
+        Open the extractor -> transformer stream as the COPY input
+        """
+        return IteratorFile(self._generate_chunks(), binary=self.binary)
+
+    def load(self, *args, **kwargs):
+        """
+        Nothing to do here, the data is serialized while the Postgres loader reads the stream
+        """
+
+    def cleanup(self):
+        pass
+
+
+class BinaryStreamLoader(StreamLoader):
+    """
+    Serialize flatten data into an in-memory PGCOPY binary stream consumed by the Postgres loader.
+    Rows with values not matching the stage column types are counted as malformed.
+    """
+    copy_options = pgcopy_writer.COPY_OPTIONS
+    copy_chunk_options = pgcopy_writer.COPY_OPTIONS
+    binary = True
+    malformed_errors = (TypeError, ValueError, AttributeError)
+
+    def __init__(self, extractor, transformer):
+        super(BinaryStreamLoader, self).__init__(extractor, transformer)
+        self.writer = pgcopy_writer.PgBinaryWriter(self.fields, transformer.get_column_types())
+
+    def _get_header(self):
+        return self.writer.get_header()
+
+    def _get_trailer(self):
+        return self.writer.get_trailer()
+
+    def _encode_row(self, fact_row):
+        """
+        Serialize a single row into a PGCOPY tuple
+        """
+        return self.writer.encode_row(fact_row)
+
+    def _encode_batch(self, table):
+        """
+        Serialize an Arrow table into a list of PGCOPY tuples, encoded from the column buffers
+        """
+        return self.writer.encode_table(table)
+
+    def make_payload(self, records):
+        """
+        Make a complete PGCOPY binary input from a list of tuples
+        """
+        return io.BytesIO(self.writer.get_header() + b''.join(records) + self.writer.get_trailer())
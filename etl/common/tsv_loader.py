@@ -2,19 +2,57 @@
 Load extracted and transformed data into a TSV file.
 At the moment the TSV loader is the first step for all loaders.
 """
+import io
 import os
 import csv
+import time
 import gzip
 import inspect
 
+from etl import config
 from etl import constants
-from etl.utils.common import get_iterator_or_none, get_script_name
+from etl.base.transformer import TRANSFORM_BATCH_ERRORS
+from etl.utils import metrics, profiling
+from etl.utils.common import get_iterator_or_none, get_script_name, iter_batches
+
+
+COPY_OPTIONS = "csv header delimiter '\t'"
+# COPY options for parts of a TSV file without the header row
+COPY_CHUNK_OPTIONS = "csv delimiter '\t'"
+
+
+def get_tsv_writer(tsv_file, fields):
+    """
+    Get a TSV writer with a format matching the stage COPY options
+    """
+    return csv.DictWriter(
+        tsv_file, fieldnames=fields, delimiter='\t', quoting=csv.QUOTE_NONE, escapechar='\\', lineterminator='\n')
+
+
+def get_tsv_records(table):
+    """
+    Serialize an Arrow table into a list of TSV lines without the header, one per row.
+    Same format as get_tsv_writer(), values with line breaks don't split a row into several lines.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter='\t', quoting=csv.QUOTE_NONE, escapechar='\\', lineterminator='\n')
+    records = []
+    for row in zip(*(column.to_pylist() for column in table.columns)):
+        writer.writerow(row)
+        records.append(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+
+    return records
 
 
 class TsvLoader:
     """
     Serialize flatten data into TSV files
     """
+    copy_options = COPY_OPTIONS
+    copy_chunk_options = COPY_CHUNK_OPTIONS
+    binary = False
 
     def __init__(self, extractor, transformer):
         self.out_file = transformer.get_tsv_file()
@@ -22,6 +60,10 @@ class TsvLoader:
         self.extractor = extractor
         self.transformer = transformer
 
+        self.extracted_items_count = 0
+        self.processed_rows_count = 0
+        self.malformed_rows_count = 0
+
     def save_file(self,file):
 
         if file is None:
@@ -57,6 +99,31 @@ class TsvLoader:
     def get_file_name(self):
         return self.out_file
 
+    def open_stream(self):
+        """
+        Open the saved TSV file as the COPY input
+        """
+        return open(constants.LOCAL_STORAGE + self.out_file, 'r')
+
+    def iter_records(self):
+        """
+        Generate TSV lines of the saved file without the header
+        """
+        with self.open_stream() as tsv_file:
+            tsv_file.readline()
+            yield from tsv_file
+
+    @staticmethod
+    def make_payload(records):
+        """
+        Make a COPY input from a list of TSV lines, to be loaded with copy_chunk_options
+        """
+        if records and isinstance(records[0], bytes):
+            return io.BytesIO(b''.join(records))
+
+        return io.StringIO(''.join(records))
+
+    @profiling.traced('TsvLoader.load')
     def load(self, *args, **kwargs):
         """
         :return: saved TSV file name or None
@@ -75,25 +142,50 @@ class TsvLoader:
         else:
             script_name = get_script_name()
 
+        started_at = time.time()
         extracted_items = get_iterator_or_none(self.extractor.extract())
 
         out_file, file_writer = self._get_writer(False)
+        transform_name = '{}.transform'.format(type(self.transformer).__name__)
+        if config.ETL_BATCH_TRANSFORM:
+            batches = iter_batches(extracted_items or (), config.ETL_TRANSFORM_BATCH_SIZE)
+        else:
+            batches = ([item] for item in extracted_items or ())
 
         with file_writer as tsv_file:
-            writer = csv.DictWriter(
-                tsv_file, fieldnames=self.fields, delimiter='\t', quoting=csv.QUOTE_NONE, escapechar='\\')
+            writer = get_tsv_writer(tsv_file, self.fields)
             writer.writeheader()
 
-            for item in extracted_items:
-                for fact_row in self.transformer.transform(item):
+            for batch in batches:
+                if config.ETL_BATCH_TRANSFORM:
                     try:
-                        writer.writerow(fact_row)
-                        processed_rows_count += 1
-                    except Exception:
-                        malformed_rows_count += 1
+                        with profiling.span(transform_name + '_batch', items=len(batch)):
+                            table = self.transformer.transform_batch(batch)
+                        tsv_file.writelines(get_tsv_records(table))
+                        processed_rows_count += table.num_rows
+                        extracted_items_count += len(batch)
                         continue
-
-                # Count only correctly processed items
-                extracted_items_count += 1
+                    except TRANSFORM_BATCH_ERRORS:
+                        # Fall back to row by row to count malformed rows
+                        pass
+
+                for item in batch:
+                    for fact_row in profiling.trace_generator(
+                            transform_name, self.transformer.transform(item), aggregate=True):
+                        try:
+                            writer.writerow(fact_row)
+                            processed_rows_count += 1
+                        except Exception:
+                            malformed_rows_count += 1
+                            continue
+
+                    # Count only correctly processed items
+                    extracted_items_count += 1
+
+        self.extracted_items_count = extracted_items_count
+        self.processed_rows_count = processed_rows_count
+        self.malformed_rows_count = malformed_rows_count
+        metrics.count_loader_rows(
+            type(self).__name__, processed_rows_count, malformed_rows_count, time.time() - started_at)
 
         #return out_file
@@ -1,5 +1,5 @@
 
-from etl.utils.environ import get_str_value, get_bool_value, get_int_value
+from etl.utils.environ import get_str_value, get_bool_value, get_int_value, get_float_value
 
 
 # PostGres connection
@@ -15,4 +15,144 @@ INDEED_PUB_ID = get_str_value('INDEED_PUB_ID', None)
 # DB connection timeout in seconds
 ETL_DB_TIMEOUT = get_int_value('ETL_DB_TIMEOUT', 30)
 # DB connection retries amount
-ETL_DB_RETRIES = get_int_value('ETL_DB_RETRIES', 3)
\ No newline at end of file
+ETL_DB_RETRIES = get_int_value('ETL_DB_RETRIES', 3)
+# Amount of concurrent API requests used by the extractors, 1 disables concurrency
+ETL_EXTRACT_WORKERS = get_int_value('ETL_EXTRACT_WORKERS', 8)
+
+# Indeed API HTTP client
+# Per request timeout in seconds
+INDEED_HTTP_TIMEOUT = get_float_value('INDEED_HTTP_TIMEOUT', 30.0)
+# Retries amount on 429/5xx responses and connection errors
+INDEED_HTTP_RETRIES = get_int_value('INDEED_HTTP_RETRIES', 5)
+# Base and max backoff between retries in seconds
+INDEED_HTTP_BACKOFF = get_float_value('INDEED_HTTP_BACKOFF', 0.5)
+INDEED_HTTP_BACKOFF_MAX = get_float_value('INDEED_HTTP_BACKOFF_MAX', 30.0)
+# Keep-alive connections kept in the pool
+INDEED_HTTP_POOL_SIZE = get_int_value('INDEED_HTTP_POOL_SIZE', 16)
+# Client side rate limit (requests per second) and burst size, 0 disables the limiter
+INDEED_RATE_LIMIT = get_float_value('INDEED_RATE_LIMIT', 10.0)
+INDEED_RATE_BURST = get_int_value('INDEED_RATE_BURST', 10)
+
+# On-disk API response cache
+INDEED_CACHE = get_bool_value('INDEED_CACHE', True)
+INDEED_CACHE_DIR = get_str_value('INDEED_CACHE_DIR', 'files/cache/indeed')
+# Seconds a cached response stays valid
+INDEED_CACHE_TTL = get_int_value('INDEED_CACHE_TTL', 900)
+# Max cache size, least recently used responses are evicted over it
+INDEED_CACHE_MAX_MB = get_int_value('INDEED_CACHE_MAX_MB', 512)
+# Bypass cached responses and store fresh ones
+INDEED_CACHE_REFRESH = get_bool_value('INDEED_CACHE_REFRESH', False)
+
+# Amount of job keys sent in a single apigetjobs call
+INDEED_DURATION_BATCH_SIZE = get_int_value('INDEED_DURATION_BATCH_SIZE', 50)
+# Amount of duration results applied per commit
+INDEED_DURATION_COMMIT_ROWS = get_int_value('INDEED_DURATION_COMMIT_ROWS', 5000)
+# Max open job keys checked per run, the most overdue first. 0 checks all due keys
+INDEED_DURATION_BUDGET = get_int_value('INDEED_DURATION_BUDGET', 50000)
+# Open jobs returned by the searches within this many hours skip the expiry check, 0 checks them anyway
+INDEED_SEEN_FRESH_HOURS = get_float_value('INDEED_SEEN_FRESH_HOURS', 24.0)
+# Hours between full scans of incremental queries, past their watermark. Only full scans see keys of long-lived
+# jobs, keep it below INDEED_SEEN_FRESH_HOURS. 0 disables full scans
+INDEED_FULL_SCAN_HOURS = get_float_value('INDEED_FULL_SCAN_HOURS', 12.0)
+# Bounds of the interval in days between two checks of an open job
+INDEED_RECHECK_MIN_DAYS = get_float_value('INDEED_RECHECK_MIN_DAYS', 1.0)
+INDEED_RECHECK_MAX_DAYS = get_float_value('INDEED_RECHECK_MAX_DAYS', 30.0)
+# Interval growth factor after every check with a still open result, while the job age has no observed expiry rate
+INDEED_RECHECK_BACKOFF = get_float_value('INDEED_RECHECK_BACKOFF', 1.5)
+# Probability of a job closing between two checks the interval is sized for
+INDEED_RECHECK_TARGET = get_float_value('INDEED_RECHECK_TARGET', 0.25)
+# Checks observed in an age bucket before its expiry rate is trusted
+INDEED_RECHECK_MIN_SAMPLES = get_int_value('INDEED_RECHECK_MIN_SAMPLES', 100)
+
+# Stage the extracted data through a TSV file instead of streaming it into COPY
+ETL_TSV_STAGE = get_bool_value('ETL_TSV_STAGE', False)
+
+# In-stream job key deduplication: exact, bloom or off
+ETL_DEDUPE_MODE = get_str_value('ETL_DEDUPE_MODE', 'exact')
+# Bloom filter sizing for the bloom dedupe mode
+ETL_BLOOM_CAPACITY = get_int_value('ETL_BLOOM_CAPACITY', 1000000)
+ETL_BLOOM_ERROR_RATE = get_float_value('ETL_BLOOM_ERROR_RATE', 0.0001)
+
+# DB connection pool
+# Connections opened on the first checkout and max open connections
+ETL_DB_POOL_MIN = get_int_value('ETL_DB_POOL_MIN', 1)
+ETL_DB_POOL_MAX = get_int_value('ETL_DB_POOL_MAX', 10)
+# Seconds to wait for a free connection when the pool is exhausted
+ETL_DB_POOL_TIMEOUT = get_float_value('ETL_DB_POOL_TIMEOUT', 300.0)
+# Idle seconds after which a connection is checked with a query before reuse, 0 checks every time
+ETL_DB_CHECK_INTERVAL = get_float_value('ETL_DB_CHECK_INTERVAL', 30.0)
+# Per connection statement_timeout in seconds, 0 disables it
+ETL_DB_STATEMENT_TIMEOUT = get_int_value('ETL_DB_STATEMENT_TIMEOUT', 0)
+
+# Max SQL scripts executed concurrently by the SQL runner graph
+ETL_SQL_WORKERS = get_int_value('ETL_SQL_WORKERS', 4)
+
+# Rows fetched per round-trip by server-side cursors
+ETL_DB_ITERSIZE = get_int_value('ETL_DB_ITERSIZE', 2000)
+
+# Sharded extraction
+# Seconds a worker holds claimed indeed_etl_jobs rows, the lease is renewed while the worker is alive
+ETL_SHARD_LEASE_SECS = get_int_value('ETL_SHARD_LEASE_SECS', 600)
+# indeed_etl_jobs rows claimed at once by a worker
+ETL_SHARD_CLAIM_SIZE = get_int_value('ETL_SHARD_CLAIM_SIZE', 2)
+# indeed_etl_jobs rows extracted and committed per checkpoint by run workers, 0 commits once at the end.
+# The next segment is claimed and extracted while the slowest rows of the previous one finish
+ETL_CHECKPOINT_ROWS = get_int_value('ETL_CHECKPOINT_ROWS', 20)
+
+# Daemon
+# Max query rows extracted at once by the daemon, the most overdue first. Every extraction holds a DB connection
+# and a merge takes up to ETL_SQL_WORKERS more, keep it below ETL_DB_POOL_MAX - ETL_SQL_WORKERS
+ETL_DAEMON_CONCURRENCY = get_int_value('ETL_DAEMON_CONCURRENCY', 4)
+# Seconds between reloads of the indeed_etl_jobs schedule, picks up new rows and changed refresh intervals
+ETL_DAEMON_RELOAD_SECS = get_int_value('ETL_DAEMON_RELOAD_SECS', 300)
+# Seconds between duration updates, 0 disables them
+ETL_DAEMON_DURATION_SECS = get_int_value('ETL_DAEMON_DURATION_SECS', 3600)
+# Seconds before query rows of a failed extraction or merge are retried
+ETL_DAEMON_RETRY_SECS = get_int_value('ETL_DAEMON_RETRY_SECS', 300)
+# Days the daemon keeps finished run records
+ETL_DAEMON_KEEP_RUNS_DAYS = get_int_value('ETL_DAEMON_KEEP_RUNS_DAYS', 7)
+
+# Stage loading
+# Create stage tables as UNLOGGED
+ETL_STAGE_UNLOGGED = get_bool_value('ETL_STAGE_UNLOGGED', False)
+# Truncate existing stage tables instead of dropping and creating them again. A table not matching its DDL or
+# ETL_STAGE_UNLOGGED is still created again
+ETL_STAGE_TRUNCATE = get_bool_value('ETL_STAGE_TRUNCATE', False)
+# Parallel COPY streams used to load a saved TSV file. Chunks commit on their own, the stage table is truncated
+# if any of them fails
+ETL_COPY_WORKERS = get_int_value('ETL_COPY_WORKERS', 1)
+# Streamed COPY format: text (TSV) or binary (PGCOPY)
+ETL_COPY_FORMAT = get_str_value('ETL_COPY_FORMAT', 'text')
+# Isolate rows failing COPY into the quarantine table instead of failing the whole load.
+# Every batch of ETL_COPY_BATCH_ROWS rows is held in memory, a streamed load without it keeps a bounded buffer
+ETL_COPY_QUARANTINE = get_bool_value('ETL_COPY_QUARANTINE', False)
+# Rows per COPY batch when quarantine is enabled
+ETL_COPY_BATCH_ROWS = get_int_value('ETL_COPY_BATCH_ROWS', 50000)
+# Transform extracted items in columnar Arrow batches instead of row by row
+ETL_BATCH_TRANSFORM = get_bool_value('ETL_BATCH_TRANSFORM', False)
+# Extracted items per columnar transform batch
+ETL_TRANSFORM_BATCH_SIZE = get_int_value('ETL_TRANSFORM_BATCH_SIZE', 5000)
+
+# Raw API results archive
+# Append raw search results to the Parquet archive
+ETL_ARCHIVE = get_bool_value('ETL_ARCHIVE', True)
+# Root of the archive dataset partitioned by fetch date
+ETL_ARCHIVE_DIR = get_str_value('ETL_ARCHIVE_DIR', 'files/archive/indeed')
+# Buffered results per Parquet file
+ETL_ARCHIVE_FLUSH_ROWS = get_int_value('ETL_ARCHIVE_FLUSH_ROWS', 50000)
+# Archive files read in parallel by the replay mode
+ETL_REPLAY_WORKERS = get_int_value('ETL_REPLAY_WORKERS', 4)
+
+# Metrics
+# node_exporter textfile written at the end of a run, empty disables it
+ETL_METRICS_TEXTFILE = get_str_value('ETL_METRICS_TEXTFILE', 'files/metrics/job_indeed.prom')
+# Pushgateway address like localhost:9091, empty disables pushing
+ETL_METRICS_PUSHGATEWAY = get_str_value('ETL_METRICS_PUSHGATEWAY', '')
+
+# Profiling
+# Write a Chrome trace timeline of the run stages
+ETL_PROFILE = get_bool_value('ETL_PROFILE', False)
+# Write a cProfile dump per outermost traced stage, requires ETL_PROFILE
+ETL_PROFILE_CPROFILE = get_bool_value('ETL_PROFILE_CPROFILE', False)
+# Directory for trace and cProfile files
+ETL_PROFILE_DIR = get_str_value('ETL_PROFILE_DIR', 'files/profile')
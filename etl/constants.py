@@ -12,6 +12,11 @@ INDEED_LIMIT = 25
 INDEED_START = 0
 INDEED_HIGHLIGHT = 0
 INDEED_LATLONG = 1
+# The API doesn't return results beyond this offset
+INDEED_MAX_RESULTS = 1025
+
+# Job age buckets in days used by the duration recheck scheduler, lower bounds
+RECHECK_AGE_BUCKETS = (0, 7, 14, 30, 60, 90, 180, 365)
 
 # TSV constants
 TSV_OUTPUT_FILE_PATTERN = '{name}-{timestamp}.tsv'
@@ -19,4 +24,6 @@ TSV_OUTPUT_TIMESTAMP = '%Y%m%d_%H%M%S'
 
 # Transform
 GZIP_EXT = '.gz'
-LOCAL_STORAGE = 'files/'
\ No newline at end of file
+LOCAL_STORAGE = 'files/'
+# COPY streaming buffer size in bytes
+COPY_BUFFER_SIZE = 1024 * 1024
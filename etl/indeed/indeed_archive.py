@@ -0,0 +1,183 @@
+"""
+Raw Indeed API results archive.
+
+Every run appends raw search results tagged with the query row and fetch time to a Parquet dataset
+partitioned by fetch date:
+    files/archive/indeed/fetch_date=2019-04-15/part-20190415_183351-3f2a9c1b-00000.parquet
+
+ArchiveExtractor replays the dataset instead of calling the API so indeed_jobs can be rebuilt after
+a transform or schema change, the replay merge (indeed_sql_update.py --replay) overwrites the existing rows.
+"""
+import os
+import json
+import uuid
+import threading
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow
+import pyarrow.parquet
+
+from etl import config
+from etl import constants
+from etl.indeed.indeed_dedupe import JobKeyDeduplicator, SeenKeys
+from etl.utils import profiling
+
+PARTITION_PREFIX = 'fetch_date='
+
+ARCHIVE_SCHEMA = pyarrow.schema([
+    pyarrow.field('query_id', pyarrow.int64()),
+    pyarrow.field('query', pyarrow.string()),
+    pyarrow.field('fetched_at', pyarrow.timestamp('us')),
+    pyarrow.field('raw', pyarrow.string()),
+])
+
+
+class ArchiveWriter:
+    """
+    Buffer raw results and write them into Parquet files of the archive dataset. Thread safe.
+    """
+
+    def __init__(self, path=None, flush_rows=None, enabled=None):
+        self.path = path or config.ETL_ARCHIVE_DIR
+        self.flush_rows = flush_rows or config.ETL_ARCHIVE_FLUSH_ROWS
+        self.enabled = config.ETL_ARCHIVE if enabled is None else enabled
+        self.archived_rows_count = 0
+
+        self._run_id = '{}-{}'.format(datetime.utcnow().strftime(constants.TSV_OUTPUT_TIMESTAMP), uuid.uuid4().hex[:8])
+        self._rows = []
+        self._files_count = 0
+        self._lock = threading.Lock()
+
+    def add_page(self, params, results):
+        """
+        Archive raw results of a search page, call it before the results are modified
+        """
+        if not self.enabled:
+            return
+
+        fetched_at = datetime.utcnow()
+        rows = [(params['id'], params['query'], fetched_at, json.dumps(result)) for result in results]
+
+        with self._lock:
+            self._rows.extend(rows)
+            if len(self._rows) < self.flush_rows:
+                return
+            rows, self._rows = self._rows, []
+
+        self._write(rows)
+
+    def _get_file_path(self, fetch_date):
+        with self._lock:
+            file_number = self._files_count
+            self._files_count += 1
+
+        return os.path.join(
+            self.path,
+            '{}{}'.format(PARTITION_PREFIX, fetch_date.isoformat()),
+            'part-{}-{:05d}.parquet'.format(self._run_id, file_number),
+        )
+
+    def _write(self, rows):
+        partitions = {}
+        for row in rows:
+            partitions.setdefault(row[2].date(), []).append(row)
+
+        for fetch_date, partition_rows in partitions.items():
+            columns = list(zip(*partition_rows))
+            table = pyarrow.Table.from_arrays(
+                [pyarrow.array(values, type=field.type) for field, values in zip(ARCHIVE_SCHEMA, columns)],
+                names=ARCHIVE_SCHEMA.names,
+            )
+
+            file_path = self._get_file_path(fetch_date)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            # Write under a temporary name so a concurrent replay never reads a partial file
+            pyarrow.parquet.write_table(table, file_path + '.tmp', compression='snappy')
+            os.replace(file_path + '.tmp', file_path)
+
+        with self._lock:
+            self.archived_rows_count += len(rows)
+
+    def close(self):
+        """
+        Write buffered results
+        """
+        with self._lock:
+            rows, self._rows = self._rows, []
+
+        if rows:
+            self._write(rows)
+
+
+class ArchiveExtractor:
+    """
+    Replay archived raw results instead of calling the Indeed API.
+    Files are yielded newest first, only the Parquet reads run in parallel. Like the merge, the exact mode
+    deduplicator keeps the max url||onmousedown row of a job key, which isn't always its newest version.
+    """
+
+    def __init__(self, from_date=None, to_date=None, path=None, workers=None, deduplicator=None):
+        self.from_date = from_date
+        self.to_date = to_date
+        self.path = path or config.ETL_ARCHIVE_DIR
+        self.workers = workers or config.ETL_REPLAY_WORKERS
+        self.deduplicator = deduplicator or JobKeyDeduplicator()
+        # Replayed results aren't fresh, no key is seen
+        self.seen_keys = SeenKeys()
+
+    def _get_files(self):
+        if not os.path.isdir(self.path):
+            return
+
+        for partition in sorted(os.listdir(self.path), reverse=True):
+            if not partition.startswith(PARTITION_PREFIX):
+                continue
+
+            fetch_date = partition[len(PARTITION_PREFIX):]
+            if self.from_date and fetch_date < self.from_date:
+                continue
+            if self.to_date and fetch_date > self.to_date:
+                continue
+
+            partition_path = os.path.join(self.path, partition)
+            for file_name in sorted(os.listdir(partition_path), reverse=True):
+                if file_name.endswith('.parquet'):
+                    yield os.path.join(partition_path, file_name)
+
+    @staticmethod
+    def _read_file(file_path):
+        data = pyarrow.parquet.read_table(file_path, columns=['query', 'raw']).to_pydict()
+        results = []
+        for query, raw in zip(data['query'], data['raw']):
+            result = json.loads(raw)
+            result['query'] = query
+            results.append(result)
+
+        return results
+
+    def _extract(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            for file_path in self._get_files():
+                pending.append(executor.submit(self._read_file, file_path))
+                # Keep memory bounded, read ahead only a couple of files per worker
+                if len(pending) >= self.workers * 2:
+                    yield from pending.popleft().result()
+
+            while pending:
+                yield from pending.popleft().result()
+
+    def commit_watermarks(self):
+        """
+        Replayed results don't move query watermarks
+        """
+
+    def close(self):
+        """
+        Nothing to write, replayed results aren't archived again
+        """
+
+    def extract(self):
+        return profiling.trace_generator('ArchiveExtractor.extract', self.deduplicator.filter(self._extract()))
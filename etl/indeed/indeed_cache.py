@@ -0,0 +1,171 @@
+"""
+On-disk Indeed API response cache.
+
+Responses are cached as JSON files keyed by the request URL and the normalized query parameters without
+the publisher id, so overlapping queries and re-runs after a failed load don't hit the API again.
+Entries expire after a TTL and the least recently used ones are evicted once the cache grows over its size limit.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+
+from etl import config
+from etl.utils import metrics
+
+# Query parameters which don't change the response
+IGNORED_PARAMS = ('publisher', )
+# Key added to responses served from the cache, their cache time
+CACHED_AT_KEY = 'etl_cached_at'
+
+
+class ResponseCache:
+    """
+    Size-bounded LRU response cache with TTL. Thread safe.
+    """
+
+    def __init__(self, path=None, ttl=None, max_size=None, enabled=None, refresh=None):
+        """
+        :param ttl: Entry time to live in seconds
+        :param max_size: Max cache size in bytes
+        :param refresh: Don't read cached entries, only store fresh responses
+        """
+        self.path = path or config.INDEED_CACHE_DIR
+        self.ttl = config.INDEED_CACHE_TTL if ttl is None else ttl
+        self.max_size = config.INDEED_CACHE_MAX_MB * 1024 * 1024 if max_size is None else max_size
+        self.enabled = config.INDEED_CACHE if enabled is None else enabled
+        self.refresh = config.INDEED_CACHE_REFRESH if refresh is None else refresh
+
+        self.hits_count = 0
+        self.misses_count = 0
+        self.evictions_count = 0
+
+        self._size = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_key(url, params):
+        normalized = sorted((name, str(value)) for name, value in params.items() if name not in IGNORED_PARAMS)
+        return hashlib.sha1(json.dumps([url, normalized]).encode('utf-8')).hexdigest()
+
+    def _get_file_path(self, key):
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def _count(self, result):
+        with self._lock:
+            if result == 'hit':
+                self.hits_count += 1
+            else:
+                self.misses_count += 1
+        metrics.count_cache(result)
+
+    def get(self, url, params):
+        """
+        Get a cached response
+
+        :return: decoded JSON response with its cache time under CACHED_AT_KEY or None
+        """
+        if not self.enabled or self.refresh:
+            return None
+
+        file_path = self._get_file_path(self._get_key(url, params))
+        try:
+            with open(file_path, 'r') as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            self._count('miss')
+            return None
+
+        if time.time() - entry['cached_at'] > self.ttl:
+            self._count('miss')
+            return None
+
+        # Entry mtime is the LRU access time
+        try:
+            os.utime(file_path)
+        except OSError:
+            pass
+
+        self._count('hit')
+        response = entry['response']
+        response[CACHED_AT_KEY] = entry['cached_at']
+        return response
+
+    def put(self, url, params, response):
+        """
+        Store a response and evict least recently used entries if the cache is over its size limit
+        """
+        if not self.enabled:
+            return
+
+        file_path = self._get_file_path(self._get_key(url, params))
+        data = json.dumps({'cached_at': time.time(), 'response': response})
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        tmp_path = '{}.{}.tmp'.format(file_path, threading.get_ident())
+        try:
+            with open(tmp_path, 'w') as cache_file:
+                cache_file.write(data)
+        except OSError:
+            # Don't leave a partial file on a full disk
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        try:
+            previous_size = os.path.getsize(file_path)
+        except OSError:
+            previous_size = 0
+        os.replace(tmp_path, file_path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._scan())
+            else:
+                self._size += len(data) - previous_size
+
+            if self._size > self.max_size:
+                self._evict()
+
+    def _scan(self):
+        """
+        Generate (mtime, path, size) of all cache entries
+        """
+        if not os.path.isdir(self.path):
+            return
+
+        for directory in os.scandir(self.path):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.endswith('.json'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    yield stat.st_mtime, entry.path, stat.st_size
+
+    def _evict(self):
+        # Evict down to 90% of the limit so eviction doesn't run on every put
+        target_size = self.max_size * 0.9
+        entries = sorted(self._scan())
+        self._size = sum(size for _, _, size in entries)
+
+        for _, file_path, size in entries:
+            if self._size <= target_size:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                continue
+            self._size -= size
+            self.evictions_count += 1
+            metrics.count_cache('eviction')
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits_count,
+                'misses': self.misses_count,
+                'evictions': self.evictions_count,
+            }
@@ -0,0 +1,146 @@
+"""
+Shared Indeed API client.
+
+All Indeed API calls go through a single pooled keep-alive session with per request timeouts,
+jittered exponential backoff on 429/5xx responses and a client side token-bucket rate limiter.
+Successful responses with results are served from the on-disk response cache when possible. A response cache write
+error, for ex. a full disk, is logged and doesn't fail the request.
+"""
+import time
+import random
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from etl import config
+from etl.indeed.indeed_cache import ResponseCache
+from etl.utils import metrics
+
+__all__ = (
+    'IndeedApiError',
+    'indeed_client',
+)
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class IndeedApiError(Exception):
+    """
+    Raised when the Indeed API doesn't return a valid response after all retries
+    """
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter. Thread safe.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available
+        """
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                wait_time = (1 - self._tokens) / self.rate
+
+            time.sleep(wait_time)
+
+
+class IndeedClient:
+    """
+    Indeed API client with connection pooling, retries and rate limiting. Thread safe.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache or ResponseCache()
+        self._timeout = config.INDEED_HTTP_TIMEOUT
+        self._retries = config.INDEED_HTTP_RETRIES
+        self._backoff = config.INDEED_HTTP_BACKOFF
+        self._backoff_max = config.INDEED_HTTP_BACKOFF_MAX
+        self._limiter = TokenBucket(config.INDEED_RATE_LIMIT, config.INDEED_RATE_BURST)
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.INDEED_HTTP_POOL_SIZE)
+        self._session = requests.Session()
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def _get_backoff(self, attempt, response=None):
+        if response is not None:
+            try:
+                return min(float(response.headers['Retry-After']), self._backoff_max)
+            except (KeyError, ValueError):
+                pass
+
+        # Full jitter exponential backoff
+        return random.uniform(0, min(self._backoff_max, self._backoff * 2 ** attempt))
+
+    @staticmethod
+    def _is_cacheable(result):
+        """
+        Error responses like a bad publisher key or an invalid query come back with HTTP 200, don't cache them
+        """
+        return isinstance(result, dict) and 'error' not in result and 'results' in result
+
+    def _put_cache(self, url, params, result):
+        try:
+            self.cache.put(url, params, result)
+        except OSError as ex:
+            print('response cache write failed: {}'.format(ex))
+
+    def get(self, url, params):
+        """
+        Send a GET request and return decoded JSON response
+        """
+        cached = self.cache.get(url, params)
+        if cached is not None:
+            return cached
+
+        attempt = 0
+        started_at = time.monotonic()
+        try:
+            while True:
+                self._limiter.acquire()
+                response = None
+                try:
+                    response = self._session.get(url, params=params, timeout=self._timeout)
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        response.raise_for_status()
+                        result = response.json()
+                        if self._is_cacheable(result):
+                            self._put_cache(url, params, result)
+                        return result
+
+                    error = 'HTTP {}'.format(response.status_code)
+                except (requests.ConnectionError, requests.Timeout) as ex:
+                    error = str(ex)
+                except (requests.HTTPError, ValueError) as ex:
+                    raise IndeedApiError('Indeed API error: {}'.format(ex)) from ex
+
+                if attempt >= self._retries:
+                    raise IndeedApiError('Indeed API error after {} retries: {}'.format(attempt, error))
+
+                time.sleep(self._get_backoff(attempt, response))
+                attempt += 1
+        finally:
+            metrics.observe_api_request(url, time.monotonic() - started_at, attempt)
+
+
+indeed_client = IndeedClient()
@@ -0,0 +1,218 @@
+"""
+In-stream job key deduplication.
+
+The same posting comes back under several queries and pages. Duplicates are dropped from the extraction
+stream before staging. The winner rule matches indeed_jobs_update.sql: the row with the greatest
+url||onmousedown (compared in "C" collation) wins. A row is passed on only when it is the first one for its
+job key or beats the best one seen so far, so the SQL winner always reaches the stage table.
+
+Every (job key, query) pair is spilled to a temporary file and loaded into a queries stage table,
+so indeed_queries keeps all the queries which matched a key.
+
+Keys of all the fetched search results, including results older than a query watermark, are spilled the same
+way into a seen keys stage table, indeed_jobs_duration_seen_update.sql sets their last_seen_at.
+"""
+import math
+import hashlib
+import tempfile
+
+from etl import config
+from etl import constants
+from etl.common.db import get_postgres
+
+QUERIES_STAGE_TABLE_NAME = 'indeed_stage_queries'
+
+# <editor-fold desc='Queries stage table DDL'>
+QUERIES_STAGE_TABLE_DDL = f"""
+create table {QUERIES_STAGE_TABLE_NAME} (
+	jobkey VARCHAR(30),
+	jobquery VARCHAR(50)
+	)
+"""
+# </editor-fold>
+
+SEEN_STAGE_TABLE_NAME = 'indeed_stage_seen'
+
+# <editor-fold desc='Seen keys stage table DDL'>
+SEEN_STAGE_TABLE_DDL = f"""
+create table {SEEN_STAGE_TABLE_NAME} (
+	jobkey VARCHAR(30)
+	)
+"""
+# </editor-fold>
+
+DEDUPE_EXACT = 'exact'
+DEDUPE_BLOOM = 'bloom'
+DEDUPE_OFF = 'off'
+
+
+def _copy_value(value):
+    """
+    Escape a value for the COPY text format
+    """
+    if value is None:
+        return '\\N'
+
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def reset_queries_stage(cursor):
+    """
+    Drop the queries and seen keys stage tables with their partitions and create them empty
+    """
+    cursor.execute('drop table if exists {} cascade'.format(QUERIES_STAGE_TABLE_NAME))
+    cursor.execute(QUERIES_STAGE_TABLE_DDL)
+    cursor.execute('drop table if exists {} cascade'.format(SEEN_STAGE_TABLE_NAME))
+    cursor.execute(SEEN_STAGE_TABLE_DDL)
+
+
+def _copy_stage(cursor, table_name, stage_file, partition_suffix):
+    """
+    COPY a spilled file into a key stage table, or into a child table of it for sharded workers
+    """
+    if partition_suffix is not None:
+        partition_name = '{}_{}'.format(table_name, partition_suffix)
+        cursor.execute('create table if not exists {} () inherits ({})'.format(partition_name, table_name))
+        table_name = partition_name
+
+    stage_file.seek(0)
+    cursor.copy_expert('COPY {} from stdin'.format(table_name), stage_file)
+
+
+class BloomFilter:
+    """
+    Fixed memory set of strings with a given false positive rate
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _get_positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        hash_1 = int.from_bytes(digest[:8], 'little')
+        hash_2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((hash_1 + i * hash_2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        """
+        Add a key
+
+        :return: True if the key was (probably) added before
+        """
+        present = True
+        for position in self._get_positions(key):
+            byte, bit = divmod(position, 8)
+            if not self._bits[byte] & (1 << bit):
+                present = False
+                self._bits[byte] |= 1 << bit
+
+        return present
+
+
+class JobKeyDeduplicator:
+    """
+    Drop duplicated job keys from the extraction stream.
+
+    Modes:
+        exact - keep the best url||onmousedown seen per job key, deterministic and equivalent to the SQL rule
+        bloom - fixed memory Bloom filter, the first row of a key wins and the SQL rule picks among survivors.
+                A false positive drops a unique job, so size ETL_BLOOM_CAPACITY above the expected keys amount
+        off - no deduplication
+    """
+
+    def __init__(self, mode=None):
+        self.mode = mode or config.ETL_DEDUPE_MODE
+        if self.mode not in (DEDUPE_EXACT, DEDUPE_BLOOM, DEDUPE_OFF):
+            raise ValueError("Unknown dedupe mode: '{}'".format(self.mode))
+
+        self._winners = {}
+        self._bloom = None
+        if self.mode == DEDUPE_BLOOM:
+            self._bloom = BloomFilter(config.ETL_BLOOM_CAPACITY, config.ETL_BLOOM_ERROR_RATE)
+
+        self._query_pairs = tempfile.TemporaryFile(mode='w+t', encoding='utf-8')
+        self.duplicates_count = 0
+
+    @staticmethod
+    def _get_url_id(item):
+        return (item.get('url') or '') + (item.get('onmousedown') or '')
+
+    def _is_duplicate(self, item):
+        job_key = item.get('jobkey')
+        if self.mode == DEDUPE_OFF or job_key is None:
+            return False
+
+        if self.mode == DEDUPE_BLOOM:
+            return self._bloom.add(job_key)
+
+        url_id = self._get_url_id(item)
+        best_url_id = self._winners.get(job_key)
+        if best_url_id is not None and url_id <= best_url_id:
+            return True
+
+        self._winners[job_key] = url_id
+        return False
+
+    def filter(self, items):
+        """
+        Pass through only new or winning rows of each job key
+        """
+        for item in items:
+            self._query_pairs.write('{}\t{}\n'.format(_copy_value(item.get('jobkey')), _copy_value(item.get('query'))))
+            if self._is_duplicate(item):
+                self.duplicates_count += 1
+                continue
+
+            yield item
+
+    def load_query_pairs(self, partition_suffix=None):
+        """
+        Rebuild the queries stage table and load all (job key, query) pairs seen in the stream
+
+        :param partition_suffix: Load into a child table of the queries stage table instead, used by sharded workers
+        """
+        with get_postgres() as conn:
+            with conn.cursor() as cursor:
+                if partition_suffix is None:
+                    reset_queries_stage(cursor)
+                _copy_stage(cursor, QUERIES_STAGE_TABLE_NAME, self._query_pairs, partition_suffix)
+                conn.commit()
+
+    def close(self):
+        self._query_pairs.close()
+
+
+class SeenKeys:
+    """
+    Spill keys of all the fetched search results, before any watermark filtering.
+    Results flagged as expired by the search aren't seen.
+    """
+
+    def __init__(self):
+        self._keys = tempfile.TemporaryFile(mode='w+t', encoding='utf-8')
+        self.seen_count = 0
+
+    def add(self, result):
+        job_key = result.get('jobkey')
+        if job_key is None or result.get('expired') in constants.TRUE_VALUES:
+            return
+
+        self._keys.write('{}\n'.format(_copy_value(job_key)))
+        self.seen_count += 1
+
+    def load(self, partition_suffix=None):
+        """
+        Load the seen keys into the seen keys stage table. Call it after load_query_pairs(), which rebuilds the
+        stage table when partition_suffix isn't set.
+
+        :param partition_suffix: Load into a child table of the seen keys stage table, used by sharded workers
+        """
+        with get_postgres() as conn:
+            with conn.cursor() as cursor:
+                _copy_stage(cursor, SEEN_STAGE_TABLE_NAME, self._keys, partition_suffix)
+            conn.commit()
+
+    def close(self):
+        self._keys.close()
@@ -3,33 +3,61 @@
 https://ads.indeed.com/jobroll/xmlfeed
 
 '''
-import json
+import threading
+from itertools import islice
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait, as_completed
 
-import requests
-import psycopg2.extras
-
-from etl.common.db import get_postgres
+from etl.common.db import get_postgres, iter_query
+from etl.indeed.indeed_client import indeed_client
+from etl.indeed.indeed_cache import CACHED_AT_KEY
+from etl.indeed.indeed_archive import ArchiveWriter
+from etl.indeed.indeed_dedupe import JobKeyDeduplicator, SeenKeys
+from etl.utils import metrics, profiling
+from etl.utils.common import parse_http_date
 from etl import constants
 from etl import config
 
 
 class IndeedExtractor:
 
+    def __init__(self, workers=None, deduplicator=None, archive=None, work_queue=None, claims_done=None):
+        """
+        :param work_queue: Extract only the indeed_etl_jobs rows claimed from a sharded run WorkQueue
+        :param claims_done: threading.Event set once the rows are claimed, while the last ones are still extracted
+        """
+        self.workers = workers or config.ETL_EXTRACT_WORKERS
+        self.deduplicator = deduplicator or JobKeyDeduplicator()
+        self.archive = archive or ArchiveWriter()
+        self.work_queue = work_queue
+        self.claims_done = claims_done
+        # ids of the query rows claimed from the work queue
+        self.query_ids = []
+        self.seen_keys = SeenKeys()
+        self.watermarks = {}
+        # Incremental queries fully scanned last before this time are paginated to the end again
+        self.full_scan_before = None
+        if config.INDEED_FULL_SCAN_HOURS:
+            self.full_scan_before = datetime.utcnow() - timedelta(hours=config.INDEED_FULL_SCAN_HOURS)
+        # ids of the query rows paginated without a watermark
+        self.full_scans = set()
+        self._watermarks_lock = threading.Lock()
+
     def _get_command(self, query):
-        indeed_url = constants.INDEED_JOB_SEARCH
-        r = requests.get(indeed_url, params=query)
-        return json.loads(r.text)
+        return indeed_client.get(constants.INDEED_JOB_SEARCH, query)
 
     def _get_parameters(self):
+        if self.work_queue is not None:
+            for params in self.work_queue.iter_claims():
+                self.query_ids.append(params['id'])
+                yield params
+            if self.claims_done is not None:
+                self.claims_done.set()
+            return
 
-        with get_postgres() as conn:
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-                cursor.execute("""
-                SELECT * FROM public.indeed_etl_jobs where is_active = TRUE 
-                """
-                               )
-                for query in cursor.fetchall():
-                    yield query
+        yield from iter_query("""
+        SELECT * FROM public.indeed_etl_jobs where is_active = TRUE
+        """)
 
     def _query_mapping(self,params):
 
@@ -59,13 +87,83 @@ class IndeedExtractor:
 
         return results
 
-    def extract(self):
+    @staticmethod
+    def _next_offsets(end, total_results):
+        """
+        Generate the remaining start offsets of a query once the first page is known.
+        The offsets follow exactly the same sequence as the sequential pagination.
+        """
+        while total_results > end and end < constants.INDEED_MAX_RESULTS:
+            start = end + 1
+            yield start
+            end = min(start + constants.INDEED_LIMIT, total_results)
+
+    def _get_page(self, params, start):
+        query = self._query_mapping(params)
+        query['start'] = start
+        return params, start, self._get_command(query)
+
+    def _is_incremental(self, params):
+        """
+        Date sorted queries with a watermark stop at the first page older than the watermark.
+        Keys of long-lived jobs are on later pages, so a full scan every INDEED_FULL_SCAN_HOURS keeps them seen.
+        """
+        if params['sort'] != 'date' or params.get('watermark_date') is None:
+            return False
+
+        last_full_scan_at = params.get('last_full_scan_at')
+        return self.full_scan_before is None or (
+            last_full_scan_at is not None and last_full_scan_at >= self.full_scan_before)
+
+    def _advance_watermark(self, query_id, watermark):
+        with self._watermarks_lock:
+            if query_id not in self.watermarks or watermark > self.watermarks[query_id]:
+                self.watermarks[query_id] = watermark
+
+    def _process_page(self, params, results):
+        """
+        Archive raw page results, tag them with the query and track the newest job seen for the query watermark.
+        Keys of all the page results are seen, unless the page is served from the response cache: it may be
+        up to INDEED_CACHE_TTL old. Results older than the stored watermark are then dropped for incremental queries.
+
+        :return: tuple (page results, True if the whole page is older than the watermark)
+        """
+        self.archive.add_page(params, results['results'])
+
+        watermark_date = params['watermark_date'] if self._is_incremental(params) else None
+        if watermark_date is None:
+            self.full_scans.add(params['id'])
+        page_results = []
+        newest = None
+        is_cached = CACHED_AT_KEY in results
+
+        for result in results['results']:
+            result['query'] = params['query']
+            if not is_cached:
+                self.seen_keys.add(result)
+            job_date = parse_http_date(result.get('date'))
+            if job_date is not None:
+                if newest is None or job_date > newest[0]:
+                    newest = (job_date, result.get('jobkey'))
+                if watermark_date is not None and job_date < watermark_date:
+                    continue
+
+            page_results.append(result)
+
+        if newest is not None:
+            self._advance_watermark(params['id'], newest)
+
+        metrics.count_page(params['query'], len(results['results']))
+
+        return page_results, watermark_date is not None and not page_results
+
+    def _extract_sequential(self):
         for params in self._get_parameters():
             query = self._query_mapping(params)
             total_results = 1
             end = 0
 
-            while total_results > end and end < 1025:
+            while total_results > end and end < constants.INDEED_MAX_RESULTS:
                 results = self._get_command(query)
                 total_results = results['totalResults']
                 print(end)
@@ -77,52 +175,164 @@ class IndeedExtractor:
                 #     continue
                 end = results['end']
                 query['start'] = end + 1
-                for result in results['results']:
-                    result['query'] = params['query']
-                    yield result
+                page_results, is_older = self._process_page(params, results)
+                yield from page_results
+                if is_older:
+                    print('Reached watermark')
+                    break
 
+    def _extract_concurrent(self):
+        """
+        Fan out the first page of every query row and, as soon as a first page returns totalResults,
+        all the remaining pages of that query. Pages are yielded in completion order.
+        Incremental queries are paginated one page at a time so they can stop at the watermark.
+        New query rows are started only while less than workers * 2 pages are in flight, so sharded workers
+        claim rows as they have capacity.
+        """
+        max_pending = self.workers * 2
+        parameters = self._get_parameters()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {
+                executor.submit(self._get_page, params, constants.INDEED_START)
+                for params in islice(parameters, max_pending)
+            }
 
-class IndeedDuration:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    params, start, results = future.result()
+                    if start == constants.INDEED_START and results['totalResults'] == 0:
+                        print('No Results')
+                        continue
 
-    def _get_command(self, query):
-        indeed_url = constants.INDEED_GET_JOB
-        r = requests.get(indeed_url, params=query)
-        return json.loads(r.text)
+                    page_results, is_older = self._process_page(params, results)
+                    offsets = self._next_offsets(results['end'], results['totalResults'])
+                    if self._is_incremental(params):
+                        offsets = islice(offsets, 0 if is_older else 1)
+                    elif start != constants.INDEED_START:
+                        offsets = ()
 
-    def _get_open_jobs(self):
+                    for offset in offsets:
+                        pending.add(executor.submit(self._get_page, params, offset))
 
+                    yield from page_results
+
+                for params in islice(parameters, max(max_pending - len(pending), 0)):
+                    pending.add(executor.submit(self._get_page, params, constants.INDEED_START))
+
+    def commit_watermarks(self):
+        """
+        Store the newest job seen per query row as a pending watermark and the full scan time of the query rows
+        paginated without a watermark. Call it once the stage load commits.
+        Pending watermarks are taken by the next merge before it merges indeed_jobs and promoted after it
+        (indeed_etl_jobs_watermark_snapshot.sql and indeed_etl_jobs_watermark_update.sql).
+        """
         with get_postgres() as conn:
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            with conn.cursor() as cursor:
                 cursor.execute("""
-                select distinct job_key 
-                from public.indeed_jobs_duration
-                    where job_expired = '1900-01-01'
-                    and job_no_api = '1900-01-01'
-                """
-                               )
-                for query in cursor.fetchall():
-                    yield query
+                update public.indeed_etl_jobs
+                set last_full_scan_at = now() at time zone 'utc'
+                where id = any(%s)
+                """, (list(self.full_scans), ))
+                for query_id, (job_date, job_key) in self.watermarks.items():
+                    cursor.execute("""
+                    update public.indeed_etl_jobs
+                    set pending_watermark_date = %s, pending_watermark_key = %s
+                    where id = %s and (watermark_date is null or watermark_date < %s)
+                    """, (job_date, job_key, query_id, job_date))
+            conn.commit()
+
+    def close(self):
+        """
+        Write the buffered raw results archive
+        """
+        self.archive.close()
+
+    def extract(self):
+        if self.workers > 1:
+            items = self._extract_concurrent()
+        else:
+            items = self._extract_sequential()
+
+        return profiling.trace_generator('IndeedExtractor.extract', self.deduplicator.filter(items))
+
+
+class IndeedDuration:
+
+    def __init__(self, workers=None, batch_size=None, budget=None, fresh_hours=None):
+        self.workers = workers or config.ETL_EXTRACT_WORKERS
+        self.batch_size = batch_size or config.INDEED_DURATION_BATCH_SIZE
+        self.budget = config.INDEED_DURATION_BUDGET if budget is None else budget
+        self.fresh_hours = config.INDEED_SEEN_FRESH_HOURS if fresh_hours is None else fresh_hours
 
-    def _query_mapping(self, job_key):
+    def _get_command(self, query):
+        return indeed_client.get(constants.INDEED_GET_JOB, query)
+
+    def _get_open_jobs(self):
+        """
+        Get open jobs due for a check, the most overdue first, up to the per run budget.
+        Jobs still returned by the searches recently are live and skipped.
+        """
+        yield from iter_query("""
+        select job_key, job_date, last_checked, check_count
+        from public.indeed_jobs_duration
+            where job_expired = '1900-01-01'
+            and job_no_api = '1900-01-01'
+            and (next_check_at is null or next_check_at <= now() at time zone 'utc')
+            and (last_seen_at is null or last_seen_at < now() at time zone 'utc' - make_interval(secs => %s))
+        order by next_check_at nulls first
+        limit %s
+        """, (self.fresh_hours * 3600, self.budget or None))
+
+    def _query_mapping(self, job_keys):
 
         query = {
             "v": constants.INDEED_API_VERSION,
             "format": constants.INDEED_FORMAT,
-            "jobkeys": job_key,
+            "jobkeys": ','.join(job_keys),
             "publisher": config.INDEED_PUB_ID,
         }
 
         return query
 
+    def _get_batches(self):
+        open_jobs = self._get_open_jobs()
+        while True:
+            batch = list(islice(open_jobs, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def _check_batch(self, jobs):
+        """
+        Look up a batch of open jobs with a single API call.
+        Keys missing from the response are reported as not available in the API.
+
+        :return: list of tuples (job row, expired, api_active)
+        """
+        result = self._get_command(self._query_mapping([job['job_key'] for job in jobs]))
+        statuses = {item['jobkey']: item['expired'] for item in result.get('results', [])}
+
+        checked = []
+        for job in jobs:
+            if job['job_key'] in statuses:
+                checked.append((job, statuses[job['job_key']], True))
+            else:
+                checked.append((job, False, False))
+
+        return checked
+
     def extract(self):
-        for job_key in self._get_open_jobs():
-            query = self._query_mapping(job_key['job_key'])
-            result = self._get_command(query)
-            api_active = True
-            try:
-                expired_status = result['results'][0]['expired']
-            except IndexError:
-                api_active = False
-                expired_status = False
-
-            yield job_key['job_key'], expired_status, api_active
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = set()
+            for batch in self._get_batches():
+                pending.add(executor.submit(self._check_batch, batch))
+
+                # Keep the amount of in-flight batches bounded
+                if len(pending) >= self.workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from future.result()
+
+            for future in as_completed(pending):
+                yield from future.result()
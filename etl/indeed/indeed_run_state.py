@@ -0,0 +1,111 @@
+"""
+Checkpointed pipeline runs.
+
+Every job_indeed run records its stages in indeed_etl_run_stages. A resumed run skips the finished stages.
+A run can't be resumed once a newer run rebuilt the stage tables, its stage data is gone.
+Inside a stage the progress is checkpointed by the stage itself:
+    indeed_etl - query rows are extracted as a sharded run with a single worker. Rows are committed in segments
+                 of ETL_CHECKPOINT_ROWS rows (job_indeed.py --checkpoint-rows) and the rows of committed segments
+                 aren't extracted again
+    indeed_sql_update - merges are idempotent, the stage runs again as a whole
+    indeed_duration_update - results are committed every INDEED_DURATION_COMMIT_ROWS keys and checked keys
+                 get a next_check_at, so they aren't due again
+"""
+from datetime import datetime
+
+from etl import constants
+from etl.common.db import get_postgres
+from etl.indeed.indeed_work_queue import is_stage_reset_since, get_run_worker_id
+
+STAGES_TABLE_NAME = 'public.indeed_etl_run_stages'
+
+
+class RunResumeError(Exception):
+    pass
+
+
+class PipelineRun:
+    """
+    Pipeline run state
+    """
+
+    def __init__(self, stages, run_id=None, resume=False):
+        """
+        :param stages: Stage names in the execution order
+        :param run_id: Run id, a new one is generated by default
+        :param resume: Resume run_id or, if it isn't set, the latest unfinished run
+        """
+        self.stages = stages
+        self.run_id = run_id
+        self.resume = resume
+        # Worker id of the resumed run extraction, None for a new run
+        self.worker_id = None
+        self._finished = set()
+
+    def _get_unfinished_run_id(self, cursor):
+        cursor.execute(f"""
+        select run_id
+        from {STAGES_TABLE_NAME}
+        group by run_id
+        having bool_or(finished_at is null)
+        order by min(created_at) desc
+        limit 1
+        """)
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def open(self):
+        """
+        Register the run stages and load the finished ones when resuming
+
+        :raise RunResumeError: if the resumed run stage data was dropped by a newer run
+        :return: run id
+        """
+        with get_postgres() as conn:
+            with conn.cursor() as cursor:
+                if self.resume and self.run_id is None:
+                    self.run_id = self._get_unfinished_run_id(cursor)
+                    if self.run_id is None:
+                        print('no unfinished run to resume, starting a new one')
+
+                if self.resume and self.run_id is not None and is_stage_reset_since(cursor, self.run_id):
+                    raise RunResumeError('Run {} can\'t be resumed, a newer run reset the stage tables'.format(
+                        self.run_id))
+
+                if self.run_id is None:
+                    self.run_id = 'job_indeed_{}'.format(datetime.utcnow().strftime(constants.TSV_OUTPUT_TIMESTAMP))
+                elif self.resume:
+                    self.worker_id = get_run_worker_id(cursor, self.run_id)
+
+                for stage in self.stages:
+                    cursor.execute(f"""
+                    insert into {STAGES_TABLE_NAME} (run_id, stage) values (%s, %s)
+                    on conflict do nothing
+                    """, (self.run_id, stage))
+
+                cursor.execute(f"""
+                select stage from {STAGES_TABLE_NAME} where run_id = %s and finished_at is not null
+                """, (self.run_id, ))
+                self._finished = {stage for stage, in cursor.fetchall()}
+            conn.commit()
+
+        return self.run_id
+
+    def is_finished(self, stage):
+        return stage in self._finished
+
+    def _set_time(self, stage, column):
+        with get_postgres() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                update {STAGES_TABLE_NAME} set {column} = now() at time zone 'utc'
+                where run_id = %s and stage = %s
+                """, (self.run_id, stage))
+            conn.commit()
+
+    def start_stage(self, stage):
+        self._set_time(stage, 'started_at')
+
+    def finish_stage(self, stage):
+        self._set_time(stage, 'finished_at')
+        self._finished.add(stage)
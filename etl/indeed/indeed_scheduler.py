@@ -0,0 +1,119 @@
+"""
+Adaptive recheck scheduler for open job expiry checks.
+
+Every open job key gets a next_check_at. After each still open result the next check moves further out:
+the interval is sized so the job closes with INDEED_RECHECK_TARGET probability in the meantime,
+using the expiry rate observed for jobs of the same age. Until an age bucket has enough observations
+the interval is a fraction of the job age, growing by INDEED_RECHECK_BACKOFF per open check.
+"""
+import math
+import bisect
+from datetime import timedelta
+
+from etl import config
+from etl import constants
+
+STATS_TABLE_NAME = 'public.indeed_jobs_duration_stats'
+
+# Base interval as a fraction of the job age while the age bucket has too few observations
+AGE_INTERVAL_FACTOR = 0.1
+
+
+def get_age_bucket(age_days):
+    """
+    Get the age bucket lower bound of a job age in days
+    """
+    return constants.RECHECK_AGE_BUCKETS[max(bisect.bisect_right(constants.RECHECK_AGE_BUCKETS, age_days) - 1, 0)]
+
+
+class RecheckScheduler:
+    """
+    Compute next check times and collect expiry statistics per job age bucket
+    """
+
+    def __init__(self):
+        self.min_days = config.INDEED_RECHECK_MIN_DAYS
+        self.max_days = config.INDEED_RECHECK_MAX_DAYS
+        self.backoff = config.INDEED_RECHECK_BACKOFF
+        self.target = config.INDEED_RECHECK_TARGET
+        self.min_samples = config.INDEED_RECHECK_MIN_SAMPLES
+
+        # age bucket -> closed jobs per day of exposure
+        self._rates = {}
+        # age bucket -> [checks, closed, exposure days] observed in this run
+        self._observed = {}
+
+    def load_stats(self, cursor):
+        """
+        Load expiry rates observed in the previous runs
+        """
+        cursor.execute(f'select age_bucket, checks_count, closed_count, exposure_days from {STATS_TABLE_NAME}')
+        self._rates = {
+            age_bucket: closed_count / exposure_days
+            for age_bucket, checks_count, closed_count, exposure_days in cursor.fetchall()
+            if checks_count >= self.min_samples and exposure_days > 0
+        }
+
+    @staticmethod
+    def _get_age_days(job, checked_at):
+        if job['job_date'] is None:
+            return 0
+        return max((checked_at.date() - job['job_date']).days, 0)
+
+    def _get_exposure_days(self, job, checked_at):
+        """
+        Days the job could have closed in since the previous check
+        """
+        since = job['last_checked']
+        if since is None:
+            if job['job_date'] is None:
+                return self.min_days
+            return min(self._get_age_days(job, checked_at), self.max_days)
+
+        return max((checked_at - since).total_seconds() / 86400, 0)
+
+    def record(self, job, checked_at, closed):
+        """
+        Record a check result for the expiry statistics
+        """
+        age_bucket = get_age_bucket(self._get_age_days(job, checked_at))
+        observed = self._observed.setdefault(age_bucket, [0, 0, 0.0])
+        observed[0] += 1
+        observed[1] += int(closed)
+        observed[2] += self._get_exposure_days(job, checked_at)
+
+    def get_next_check_at(self, job, checked_at):
+        """
+        Get the next check time of a job which is still open
+        """
+        age_days = self._get_age_days(job, checked_at)
+        rate = self._rates.get(get_age_bucket(age_days))
+
+        if rate is None:
+            # No observed rate, back off from open results instead
+            interval = age_days * AGE_INTERVAL_FACTOR * self.backoff ** job['check_count']
+        elif rate > 0:
+            interval = -math.log(1 - self.target) / rate
+        else:
+            interval = self.max_days
+
+        interval = min(max(interval, self.min_days), self.max_days)
+
+        return checked_at + timedelta(days=interval)
+
+    def save_stats(self, cursor):
+        """
+        Add the statistics observed in this run
+        """
+        for age_bucket, (checks_count, closed_count, exposure_days) in self._observed.items():
+            cursor.execute(f"""
+            insert into {STATS_TABLE_NAME} as s (age_bucket, checks_count, closed_count, exposure_days, updated_at)
+            values (%s, %s, %s, %s, now() at time zone 'utc')
+            on conflict (age_bucket) do update set
+                checks_count = s.checks_count + excluded.checks_count,
+                closed_count = s.closed_count + excluded.closed_count,
+                exposure_days = s.exposure_days + excluded.exposure_days,
+                updated_at = excluded.updated_at
+            """, (age_bucket, checks_count, closed_count, exposure_days))
+
+        self._observed = {}
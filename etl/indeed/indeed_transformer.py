@@ -1,3 +1,10 @@
+from datetime import date, time
+from email.utils import parsedate_tz
+
+import numpy
+import pandas
+import pyarrow
+
 from etl.base.transformer import BaseTransformer
 
 
@@ -27,10 +34,74 @@ FIELDS = (
     'formattedlocationfull',
     'formattedrelativetime',
     'stations',
-
+    'job_date',
+    'job_time',
+    'day_num',
+    'zip',
 )
 # </editor-fold>
 
+# <editor-fold desc='API fields copied as is'>
+SOURCE_FIELDS = {
+    'jobkey': 'jobkey',
+    'jobquery': 'query',
+    'company': 'company',
+    'city': 'city',
+    'state': 'state',
+    'country': 'country',
+    'latitude': 'latitude',
+    'longitude': 'longitude',
+    'language': 'language',
+    'formattedlocation': 'formattedLocation',
+    'jobsource': 'source',
+    'jobdate': 'date',
+    'url': 'url',
+    'onmousedown': 'onmousedown',
+    'sponsored': 'sponsored',
+    'expired': 'expired',
+    'indeedapply': 'indeedApply',
+    'formattedlocationfull': 'formattedLocationFull',
+    'formattedrelativetime': 'formattedRelativeTime',
+    'stations': 'stations',
+}
+# </editor-fold>
+
+# API fields read by the columnar transform
+BATCH_SOURCE_FIELDS = tuple(SOURCE_FIELDS.values()) + ('jobtitle', )
+# Day, month name, year and time part of an RFC 822 date like 'Mon, 15 Apr 2019 18:33:51 GMT'
+JOB_DATE_PATTERN = r'(\d{1,2} [A-Za-z]{3} \d{4} \d{2}:\d{2}:\d{2})'
+JOB_DATE_FORMAT = '%d %b %Y %H:%M:%S'
+
+# <editor-fold desc='Stage column types'>
+COLUMN_TYPES = {
+    'jobkey': 'varchar',
+    'jobquery': 'varchar',
+    'jobtitle': 'varchar',
+    'company': 'varchar',
+    'city': 'varchar',
+    'state': 'varchar',
+    'country': 'varchar',
+    'latitude': 'float8',
+    'longitude': 'float8',
+    'language': 'varchar',
+    'formattedlocation': 'varchar',
+    'jobsource': 'varchar',
+    'jobdate': 'varchar',
+    'url': 'varchar',
+    'onmousedown': 'varchar',
+    'sponsored': 'bool',
+    'expired': 'bool',
+    'indeedapply': 'bool',
+    'formattedlocationfull': 'varchar',
+    'formattedrelativetime': 'varchar',
+    'stations': 'varchar',
+    'job_date': 'date',
+    'job_time': 'time',
+    'day_num': 'int4',
+    'zip': 'varchar',
+}
+# </editor-fold>
+
 # <editor-fold desc='Stage table DDL'>
 STAGE_TABLE_DDL = f"""
 create table {STAGE_TABLE_NAME} (
@@ -54,7 +125,11 @@ create table {STAGE_TABLE_NAME} (
 	indeedapply BOOLEAN,
 	formattedlocationfull VARCHAR(50),
 	formattedrelativetime VARCHAR(30),
-	stations VARCHAR(30)
+	stations VARCHAR(30),
+	job_date DATE,
+	job_time TIME,
+	day_num INTEGER,
+	zip VARCHAR(15)
 	)
 """
 # </editor-fold>
@@ -67,34 +142,100 @@ class IndeedTransformer(BaseTransformer):
         self._stage_table_name = STAGE_TABLE_NAME
         self._stage_table_ddl = STAGE_TABLE_DDL
         self._tsv_fields = FIELDS
+        self._column_types = COLUMN_TYPES
 
     @staticmethod
     def _clean_data(doc, name):
 
         return doc.get(name).replace('\"', '')
 
+    @staticmethod
+    def _parse_job_date(doc):
+        """
+        Split an RFC 822 job date like 'Mon, 15 Apr 2019 18:33:51 GMT' into ISO date, ISO time and ISO weekday
+        """
+        parsed = parsedate_tz(doc.get('date') or '')
+        if parsed is None:
+            return None, None, None
+
+        try:
+            job_date = date(*parsed[:3])
+            job_time = time(*parsed[3:6])
+        except ValueError:
+            return None, None, None
+
+        return job_date.isoformat(), job_time.isoformat(), job_date.isoweekday()
+
+    @staticmethod
+    def _parse_zip(doc):
+        """
+        Get zip code from a location like 'Charlotte, NC 28202'
+        """
+        parts = (doc.get('formattedLocationFull') or '').split(' ')
+        return parts[2] if len(parts) > 2 else None
+
     def transform(self, doc):
+        job_date, job_time, day_num = self._parse_job_date(doc)
 
-        yield {
-            'jobkey': doc.get('jobkey'),
-            'jobquery': doc.get('query'),
+        fact_row = {field: doc.get(source) for field, source in SOURCE_FIELDS.items()}
+        fact_row.update({
             'jobtitle': self._clean_data(doc,'jobtitle'),
-            'company': doc.get('company'),
-            'city': doc.get('city'),
-            'state': doc.get('state'),
-            'country': doc.get('country'),
-            'latitude': doc.get('latitude'),
-            'longitude': doc.get('longitude'),
-            'language': doc.get('language'),
-            'formattedlocation': doc.get('formattedLocation'),
-            'jobsource': doc.get('source'),
-            'jobdate': doc.get('date'),
-            'url': doc.get('url'),
-            'onmousedown': doc.get('onmousedown'),
-            'sponsored': doc.get('sponsored'),
-            'expired': doc.get('expired'),
-            'indeedapply': doc.get('indeedApply'),
-            'formattedlocationfull': doc.get('formattedLocationFull'),
-            'formattedrelativetime': doc.get('formattedRelativeTime'),
-            'stations': doc.get('stations'),
-        }
\ No newline at end of file
+            'job_date': job_date,
+            'job_time': job_time,
+            'day_num': day_num,
+            'zip': self._parse_zip(doc),
+        })
+
+        yield fact_row
+
+    @staticmethod
+    def _parse_job_dates(dates):
+        """
+        Vectorized version of _parse_job_date()
+
+        :return: tuple of Arrow arrays (job_date, job_time, day_num)
+        """
+        parsed = pandas.to_datetime(
+            dates.str.extract(JOB_DATE_PATTERN, expand=False), format=JOB_DATE_FORMAT, errors='coerce')
+        missing = parsed.isna().values
+        timestamps = parsed.values.astype('datetime64[us]')
+        days = timestamps.astype('datetime64[D]')
+        microseconds = (timestamps - days).astype('int64')
+        day_nums = numpy.where(missing, 0, parsed.dt.dayofweek.fillna(0).values + 1).astype('int32')
+
+        return (
+            pyarrow.array(days, type=pyarrow.date32(), mask=missing),
+            pyarrow.array(microseconds, mask=missing).cast(pyarrow.time64('us')),
+            pyarrow.array(day_nums, type=pyarrow.int32(), mask=missing),
+        )
+
+    def transform_batch(self, docs):
+        """
+        Columnar version of transform(), one Arrow table for a list of API results
+
+        :raise pyarrow.ArrowException, TypeError, ValueError: if a value doesn't match its column type or a result
+            has no jobtitle, transform() fails on those so the batch is transformed row by row instead
+        """
+        frame = pandas.DataFrame.from_records(docs, columns=BATCH_SOURCE_FIELDS)
+        if frame['jobtitle'].isna().any():
+            raise ValueError('Results without jobtitle')
+        job_date, job_time, day_num = self._parse_job_dates(frame['date'])
+
+        columns = {field: frame[source] for field, source in SOURCE_FIELDS.items()}
+        columns.update({
+            'jobtitle': frame['jobtitle'].str.replace('\"', '', regex=False),
+            'job_date': job_date,
+            'job_time': job_time,
+            'day_num': day_num,
+            'zip': frame['formattedLocationFull'].str.split(' ').str[2],
+        })
+
+        schema = self.get_arrow_schema()
+        arrays = []
+        for field in schema:
+            column = columns[field.name]
+            if not isinstance(column, pyarrow.Array):
+                column = pyarrow.array(column, type=field.type, from_pandas=True)
+            arrays.append(column)
+
+        return pyarrow.Table.from_arrays(arrays, names=schema.names)
\ No newline at end of file
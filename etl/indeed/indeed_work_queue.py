@@ -0,0 +1,357 @@
+"""
+Lease-based work queue over indeed_etl_jobs.
+
+A run is identified by a run id shared by all its workers. Every active indeed_etl_jobs row gets a row in
+indeed_etl_job_runs. Workers on one or several hosts claim rows with SELECT ... FOR UPDATE SKIP LOCKED,
+extract them and stage the results into their own stage partitions (child tables inheriting the stage tables).
+A claim is a lease renewed by a heartbeat thread; rows of a crashed worker are claimed again once the lease expires.
+Workers without claimable rows keep polling until all the run rows are finished, so the rows of a crashed worker
+are picked up even if it was the last one running. The worker finishing last runs the final merge once.
+
+The stage tables are used by a single owner at a time: a cron pipeline run, whose creating worker rebuilds them,
+or the daemon, which rebuilds them at start and loads each of its runs into partitions of their own. A new run is
+refused with StageBusyError while a run of another worker id is active, i.e. holds leases of live workers or is
+merging, so cron pipeline runs and the daemon never drop the stage of each other. Runs of indeed_etl.py without
+a run id don't register: they check no run uses the stage tables before rebuilding them, but later runs don't see
+them.
+
+A merge is claimed by a single worker. A merge started more than a lease ago is considered crashed: another worker
+of the run can claim it again and the stage tables are free again.
+
+With checkpoint_rows set a worker claims, loads and finishes rows in segments of that many rows, so a rerun of
+the same run (for ex. job_indeed.py --resume) skips the rows of committed segments. Segments overlap: the next one
+claims its rows while the previous one extracts its last rows, see indeed_etl._load_shard().
+"""
+import re
+import os
+import threading
+import traceback
+
+import psycopg2.extras
+
+from etl import config
+from etl.common.db import get_postgres
+from etl.utils.common import get_host_name
+
+RUNS_TABLE_NAME = 'public.indeed_etl_runs'
+JOB_RUNS_TABLE_NAME = 'public.indeed_etl_job_runs'
+
+# pg_advisory_xact_lock key serializing run registration
+REGISTER_LOCK_KEY = 7316520
+
+
+class StageBusyError(Exception):
+    pass
+
+
+def get_worker_id(prefix=None):
+    """
+    Get a worker id unique to the process: host name and pid, after an optional prefix
+    """
+    worker_id = '{}_{}'.format(get_host_name(), os.getpid())
+    return '{}_{}'.format(prefix, worker_id) if prefix else worker_id
+
+
+def get_run_worker_id(cursor, run_id):
+    """
+    Get the worker id which claimed most rows of a run, for ex. the crashed process of a resumed single worker run
+
+    :return: worker id or None if no row was claimed
+    """
+    cursor.execute(f"""
+    select worker_id from {JOB_RUNS_TABLE_NAME}
+    where run_id = %s and worker_id is not null
+    group by worker_id
+    order by count(*) desc
+    limit 1
+    """, (run_id, ))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def check_stage_free(cursor, run_id, worker_id, lease_secs):
+    """
+    Check no run of another worker uses the stage tables. Worker ids are unique per process, so runs of worker_id
+    belong to the same process (for ex. the daemon runs) or to the crashed process of a resumed run. Merges started
+    more than lease_secs ago are considered crashed too.
+
+    :param run_id: Run to ignore, None checks all the runs
+    :param worker_id: Worker id owning the stage, None checks the runs of all the workers
+    :raise StageBusyError: if a run of another worker holds leases of live workers or is merging
+    """
+    cursor.execute(f"""
+    select r.run_id from {RUNS_TABLE_NAME} r
+    where r.run_id is distinct from %(run_id)s
+        and r.merged_at is null
+        and exists (
+            select 1 from {JOB_RUNS_TABLE_NAME} jr
+            where jr.run_id = r.run_id
+                and jr.worker_id is distinct from %(worker_id)s
+                and (
+                    r.merge_started_at > now() at time zone 'utc' - make_interval(secs => %(lease_secs)s)
+                    or (jr.finished_at is null and jr.lease_expires_at > now() at time zone 'utc')
+                    )
+            )
+    limit 1
+    """, {'run_id': run_id, 'worker_id': worker_id, 'lease_secs': lease_secs})
+    row = cursor.fetchone()
+    if row is not None:
+        raise StageBusyError('Run {} is using the stage tables'.format(row[0]))
+
+
+def is_stage_reset_since(cursor, run_id):
+    """
+    Check if a run registered after run_id rebuilt the stage tables, dropping the stage partitions of run_id
+
+    :return: True if the stage was reset, False if it still holds the run_id data or the run isn't registered
+    """
+    cursor.execute(f"""
+    select exists (
+        select 1 from {RUNS_TABLE_NAME} newer
+        join {RUNS_TABLE_NAME} run on newer.created_at > run.created_at
+        where run.run_id = %s
+    )
+    """, (run_id, ))
+    return cursor.fetchone()[0]
+
+
+class WorkQueue:
+    """
+    Claim indeed_etl_jobs rows of a run for a worker
+    """
+
+    def __init__(self, run_id, worker_id=None, lease_secs=None, claim_size=None, checkpoint_rows=None,
+                 partition_suffix=None):
+        """
+        :param checkpoint_rows: Max rows claimed per iter_claims() call, 0 claims until the run has no rows left
+        :param partition_suffix: Stage partitions suffix, the worker id by default
+        """
+        self.run_id = run_id
+        self.worker_id = worker_id or get_worker_id()
+        self.lease_secs = lease_secs or config.ETL_SHARD_LEASE_SECS
+        self.claim_size = claim_size or config.ETL_SHARD_CLAIM_SIZE
+        self.checkpoint_rows = config.ETL_CHECKPOINT_ROWS if checkpoint_rows is None else checkpoint_rows
+        self.partition_suffix = partition_suffix
+        self.claimed_count = 0
+
+        self._stop_heartbeat = threading.Event()
+        self._heartbeat = None
+
+    def get_partition_suffix(self):
+        """
+        Get the stage partitions suffix of the worker
+        """
+        return re.sub(r'\W+', '_', self.partition_suffix or self.worker_id).lower()[:40]
+
+    def register(self, reset_stage, query_ids=None):
+        """
+        Register the run and its indeed_etl_jobs rows. Safe to call from all the workers concurrently.
+
+        :param reset_stage: Callable rebuilding the stage tables, called once by the worker creating the run.
+                            None keeps the stage tables, for ex. for daemon runs loading their own partitions
+        :param query_ids: Register only these indeed_etl_jobs rows instead of all the active ones
+        :raise StageBusyError: if the run is new and a run of another worker uses the stage tables
+        :return: True if the run was created by this worker
+        """
+        with get_postgres() as conn:
+            with conn.cursor() as cursor:
+                # Other workers wait here until the stage tables are rebuilt and the rows are registered
+                cursor.execute('select pg_advisory_xact_lock(%s)', (REGISTER_LOCK_KEY, ))
+                cursor.execute(f"""
+                insert into {RUNS_TABLE_NAME} (run_id) values (%s)
+                on conflict (run_id) do nothing
+                returning run_id
+                """, (self.run_id, ))
+                is_created = cursor.fetchone() is not None
+
+                if is_created:
+                    check_stage_free(cursor, self.run_id, self.worker_id, self.lease_secs)
+                    if reset_stage is not None:
+                        reset_stage()
+                    cursor.execute(f"""
+                    insert into {JOB_RUNS_TABLE_NAME} (run_id, query_id)
+                    select %s, id from public.indeed_etl_jobs
+                    where is_active = TRUE and (%s::int[] is null or id = any(%s::int[]))
+                    on conflict do nothing
+                    """, (self.run_id, query_ids, query_ids))
+
+                # Leases held under the same worker id belong to a crashed previous process, release them
+                cursor.execute(f"""
+                update {JOB_RUNS_TABLE_NAME}
+                set lease_expires_at = null
+                where run_id = %s and worker_id = %s and finished_at is null
+                """, (self.run_id, self.worker_id))
+            conn.commit()
+
+        return is_created
+
+    def _claim(self, claim_size):
+        with get_postgres() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                cursor.execute(f"""
+                update {JOB_RUNS_TABLE_NAME} r
+                set worker_id = %(worker_id)s,
+                    lease_expires_at = now() at time zone 'utc' + make_interval(secs => %(lease_secs)s),
+                    attempts = r.attempts + 1
+                from (
+                    select query_id
+                    from {JOB_RUNS_TABLE_NAME}
+                    where run_id = %(run_id)s
+                        and finished_at is null
+                        and (lease_expires_at is null or lease_expires_at < now() at time zone 'utc')
+                    order by query_id
+                    limit %(claim_size)s
+                    for update skip locked
+                    ) c,
+                    public.indeed_etl_jobs j
+                where r.run_id = %(run_id)s
+                    and r.query_id = c.query_id
+                    and j.id = r.query_id
+                returning j.*
+                """, {
+                    'run_id': self.run_id,
+                    'worker_id': self.worker_id,
+                    'lease_secs': self.lease_secs,
+                    'claim_size': claim_size,
+                })
+                rows = cursor.fetchall()
+            conn.commit()
+
+        return rows
+
+    def _renew_leases(self):
+        while not self._stop_heartbeat.wait(self.lease_secs / 3):
+            # A failed renewal is retried on the next beat, the lease is still valid for two more beats
+            try:
+                with get_postgres() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute(f"""
+                        update {JOB_RUNS_TABLE_NAME}
+                        set lease_expires_at = now() at time zone 'utc' + make_interval(secs => %s)
+                        where run_id = %s and worker_id = %s and finished_at is null
+                        """, (self.lease_secs, self.run_id, self.worker_id))
+                    conn.commit()
+            except Exception:
+                print('lease renewal of worker {} failed, retrying'.format(self.worker_id))
+                traceback.print_exc()
+
+    def iter_claims(self):
+        """
+        Claim indeed_etl_jobs rows a few at a time until the run has no claimable rows left
+        or checkpoint_rows rows are claimed. Rows leased by other live workers are left to them.
+        """
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._renew_leases, name='lease-heartbeat', daemon=True)
+            self._heartbeat.start()
+
+        claimed_count = 0
+        while not self.checkpoint_rows or claimed_count < self.checkpoint_rows:
+            claim_size = self.claim_size
+            if self.checkpoint_rows:
+                claim_size = min(claim_size, self.checkpoint_rows - claimed_count)
+
+            rows = self._claim(claim_size)
+            if not rows:
+                return
+
+            claimed_count += len(rows)
+            self.claimed_count += len(rows)
+            yield from rows
+
+    def finish(self, query_ids=None):
+        """
+        Mark the rows claimed by the worker as finished, call it once the worker stage partitions are committed.
+        Rows claimed again by another worker after a lease expiry are left to that worker.
+
+        :param query_ids: Finish only these rows, for ex. the rows of a committed segment
+        """
+        with get_postgres() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                update {JOB_RUNS_TABLE_NAME}
+                set finished_at = now() at time zone 'utc'
+                where run_id = %s and worker_id = %s and finished_at is null
+                    and (%s::int[] is null or query_id = any(%s::int[]))
+                """, (self.run_id, self.worker_id, query_ids, query_ids))
+            conn.commit()
+
+    def get_wait_secs(self):
+        """
+        Get seconds until some run row can be claimed again: 0 if unclaimed rows are left, otherwise the time until
+        the earliest lease of another worker expires.
+
+        :return: seconds or None once all the run rows are finished
+        """
+        with get_postgres() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                select
+                    count(*),
+                    bool_or(lease_expires_at is null),
+                    extract(epoch from min(lease_expires_at) - now() at time zone 'utc')
+                from {JOB_RUNS_TABLE_NAME}
+                where run_id = %s and finished_at is null
+                """, (self.run_id, ))
+                unfinished_count, is_unclaimed, lease_secs = cursor.fetchone()
+            conn.rollback()
+
+        if not unfinished_count:
+            return None
+        if is_unclaimed:
+            return 0
+
+        return max(float(lease_secs), 0)
+
+    def close(self):
+        """
+        Stop renewing leases
+        """
+        self._stop_heartbeat.set()
+
+    def claim_merge(self):
+        """
+        Claim the final merge of the run. Only one worker gets it, once all the run rows are finished.
+        A merge started more than lease_secs ago without finishing crashed, it can be claimed again.
+
+        :return: True if the worker has to run the merge
+        """
+        with get_postgres() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                update {RUNS_TABLE_NAME}
+                set merge_started_at = now() at time zone 'utc'
+                where run_id = %(run_id)s
+                    and merged_at is null
+                    and (
+                        merge_started_at is null
+                        or merge_started_at < now() at time zone 'utc' - make_interval(secs => %(lease_secs)s)
+                        )
+                    and not exists (
+                        select 1 from {JOB_RUNS_TABLE_NAME}
+                        where run_id = %(run_id)s and finished_at is null
+                        )
+                returning run_id
+                """, {'run_id': self.run_id, 'lease_secs': self.lease_secs})
+                is_claimed = cursor.fetchone() is not None
+            conn.commit()
+
+        return is_claimed
+
+    def start_merge(self):
+        """
+        Record the merge of a run merged outside of claim_merge(), for ex. by the job_indeed merge stage
+        """
+        with get_postgres() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                update {RUNS_TABLE_NAME} set merge_started_at = now() at time zone 'utc' where run_id = %s
+                """, (self.run_id, ))
+            conn.commit()
+
+    def set_merged(self):
+        with get_postgres() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                update {RUNS_TABLE_NAME} set merged_at = now() at time zone 'utc' where run_id = %s
+                """, (self.run_id, ))
+            conn.commit()
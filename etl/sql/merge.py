@@ -0,0 +1,69 @@
+"""
+Merge (upsert) statements.
+
+A merge script is a plain SELECT stored in a SQL file. The SELECT results are inserted into a target table
+with INSERT ... ON CONFLICT on the target key columns, so existing rows are skipped or updated through the
+key index instead of NOT IN anti-joins against the whole target table.
+"""
+
+__all__ = (
+    'MergeScript',
+    'build_merge_query',
+)
+
+DO_NOTHING = 'nothing'
+DO_UPDATE = 'update'
+
+
+def build_merge_query(target_table, select_query, key_columns, columns=None, on_conflict=DO_NOTHING):
+    """
+    Build an INSERT ... ON CONFLICT statement
+
+    :param target_table: Target table name
+    :param select_query: Source SELECT query
+    :param key_columns: Target key columns used as the conflict target
+    :param columns: Target columns in the SELECT order, required for DO UPDATE
+    :param on_conflict: 'nothing' to skip existing rows or 'update' to overwrite non-key columns
+    :return: SQL query string
+    """
+    select_query = select_query.strip().rstrip(';').rstrip()
+    sql_query = 'insert into {}'.format(target_table)
+    if columns:
+        sql_query += ' ({})'.format(', '.join(columns))
+
+    sql_query += '\n{}\non conflict ({})'.format(select_query, ', '.join(key_columns))
+
+    if on_conflict == DO_NOTHING:
+        return sql_query + ' do nothing'
+
+    if on_conflict != DO_UPDATE:
+        raise ValueError("Unknown on_conflict action: '{}'".format(on_conflict))
+
+    if not columns:
+        raise ValueError('Target columns are required for DO UPDATE merges')
+
+    update_columns = [column for column in columns if column not in key_columns]
+    if not update_columns:
+        return sql_query + ' do nothing'
+
+    return sql_query + ' do update set {}'.format(
+        ', '.join('{0} = excluded.{0}'.format(column) for column in update_columns))
+
+
+class MergeScript:
+    """
+    A SQL file with a SELECT query merged into a target table.
+    Key columns default to the target table primary key.
+    """
+
+    def __init__(self, path, target_table, key_columns=None, on_conflict=DO_NOTHING):
+        self.path = path
+        self.target_table = target_table
+        self.key_columns = key_columns
+        self.on_conflict = on_conflict
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return "MergeScript('{}' -> '{}')".format(self.path, self.target_table)
@@ -8,16 +8,35 @@ import os
 import sys
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 import psycopg2
 import psycopg2.extras
 
+from etl import config
 from etl.common.db import get_postgres
+from etl.sql.merge import DO_UPDATE, MergeScript, build_merge_query
+from etl.utils import metrics, profiling
 
 __all__ = (
     'runner',
+    'SqlGraphError',
 )
 
+NODE_DONE = 'done'
+NODE_FAILED = 'failed'
+NODE_SKIPPED = 'skipped'
+
+
+class SqlGraphError(Exception):
+    """
+    Raised when some nodes of a SQL scripts graph fail. The per-node report is available as `report`
+    """
+
+    def __init__(self, message, report):
+        super(SqlGraphError, self).__init__(message)
+        self.report = report
+
 
 class SqlRunner:
 
@@ -57,6 +76,7 @@ class SqlRunner:
                 'duration_secs': elapsed_time,
                 'affected_rows': affected_rows,
             }
+            metrics.observe_sql(query_description, elapsed_time, affected_rows)
 
             process_info = {
                 'process_id': os.getpid(),
@@ -87,7 +107,7 @@ class SqlRunner:
         Execute a single SQL script
         """
         sql_query = self.read_query(path)
-        with get_postgres() as conn:
+        with profiling.span(path), get_postgres() as conn:
             with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
                 result = self.exec_query(cursor, sql_query, params, show_error=show_error, query_description=path)
                 if explicit_commit:
@@ -108,6 +128,162 @@ class SqlRunner:
                 conn.commit()
         return affected_rows
 
+    def get_primary_key(self, cursor, table_name):
+        """
+        Get primary key columns of a given table
+        """
+        cursor.execute("""
+        select
+          a.attname as column_name
+        from
+          pg_index i
+          join pg_attribute a on a.attrelid = i.indrelid and a.attnum = any(i.indkey)
+        where
+          i.indrelid = %s::regclass and
+          i.indisprimary
+        order by
+          array_position(i.indkey::int2[], a.attnum);
+        """, (table_name, ))
+
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_table_columns(self, cursor, table_name):
+        """
+        Get column names of a given table in the table order
+        """
+        cursor.execute("""
+        select
+          attname as column_name
+        from
+          pg_attribute
+        where
+          attrelid = %s::regclass and
+          attnum > 0 and
+          not attisdropped
+        order by
+          attnum;
+        """, (table_name, ))
+
+        return [row[0] for row in cursor.fetchall()]
+
+    def exec_merge(self, merge, show_error=True, explicit_commit=False):
+        """
+        Execute a merge script: upsert results of the script SELECT query into the target table
+        """
+        select_query = self.read_query(merge.path)
+        with profiling.span(str(merge), target_table=merge.target_table), get_postgres() as conn:
+            with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                key_columns = merge.key_columns or self.get_primary_key(cursor, merge.target_table)
+                if not key_columns:
+                    raise ValueError("Table '{}' has no primary key to merge on".format(merge.target_table))
+
+                columns = None
+                if merge.on_conflict == DO_UPDATE:
+                    columns = self.get_table_columns(cursor, merge.target_table)
+
+                sql_query = build_merge_query(
+                    merge.target_table, select_query, key_columns, columns=columns, on_conflict=merge.on_conflict)
+                result = self.exec_query(cursor, sql_query, show_error=show_error, query_description=str(merge))
+                if explicit_commit:
+                    conn.commit()
+                return result
+
+    def exec_script(self, script, show_error=True, explicit_commit=False):
+        """
+        Execute a SQL script path or a merge script
+        """
+        if isinstance(script, MergeScript):
+            return self.exec_merge(script, show_error=show_error, explicit_commit=explicit_commit)
+
+        return self.exec_sql_script(script, show_error=show_error, explicit_commit=explicit_commit)
+
+    @staticmethod
+    def _get_dependents(graph):
+        dependents = {node: [] for node in graph}
+        for node, dependencies in graph.items():
+            for dependency in dependencies:
+                if dependency not in graph:
+                    raise ValueError("Unknown dependency '{}' of '{}'".format(dependency, node))
+                dependents[dependency].append(node)
+
+        # Detect cycles with a topological sort
+        in_degree = {node: len(dependencies) for node, dependencies in graph.items()}
+        ready = [node for node, degree in in_degree.items() if degree == 0]
+        visited = 0
+        while ready:
+            node = ready.pop()
+            visited += 1
+            for dependent in dependents[node]:
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    ready.append(dependent)
+
+        if visited != len(graph):
+            raise ValueError('SQL scripts graph has a cycle')
+
+        return dependents
+
+    def _exec_node(self, script, explicit_commit):
+        start_time = time.time()
+        affected_rows = self.exec_script(script, explicit_commit=explicit_commit)
+        return affected_rows, time.time() - start_time
+
+    def exec_sql_graph(self, graph, max_workers=None, explicit_commit=True):
+        """
+        Execute a dependency graph of SQL scripts. Independent scripts run concurrently, each on its own
+        pooled connection. A failed script stops all its dependents, independent branches keep running.
+
+        :param graph: dict {script: iterable of scripts it depends on}, a script is a path or a MergeScript
+        :param max_workers: Max scripts running at the same time
+        :param explicit_commit: Commit after every script
+        :return: dict {script: {'status', 'duration_secs', 'affected_rows', 'error'}}
+        """
+        dependents = self._get_dependents(graph)
+        waiting_for = {node: set(dependencies) for node, dependencies in graph.items()}
+        report = {}
+
+        def skip_dependents(failed_node):
+            for dependent in dependents[failed_node]:
+                if dependent not in report:
+                    report[dependent] = {
+                        'status': NODE_SKIPPED,
+                        'duration_secs': 0.0,
+                        'affected_rows': 0,
+                        'error': "Dependency '{}' failed".format(failed_node),
+                    }
+                    skip_dependents(dependent)
+
+        with ThreadPoolExecutor(max_workers=max_workers or config.ETL_SQL_WORKERS) as executor:
+            futures = {}
+            for node, dependencies in waiting_for.items():
+                if not dependencies:
+                    futures[executor.submit(self._exec_node, node, explicit_commit)] = node
+
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = futures.pop(future)
+                    try:
+                        affected_rows, duration = future.result()
+                    except Exception as ex:
+                        report[node] = {
+                            'status': NODE_FAILED, 'duration_secs': 0.0, 'affected_rows': 0, 'error': str(ex)}
+                        skip_dependents(node)
+                        continue
+
+                    report[node] = {
+                        'status': NODE_DONE, 'duration_secs': duration, 'affected_rows': affected_rows, 'error': None}
+                    for dependent in dependents[node]:
+                        waiting_for[dependent].discard(node)
+                        if not waiting_for[dependent] and dependent not in report:
+                            futures[executor.submit(self._exec_node, dependent, explicit_commit)] = dependent
+
+        failed = [str(node) for node, info in report.items() if info['status'] == NODE_FAILED]
+        if failed:
+            raise SqlGraphError('SQL scripts failed: {}'.format(', '.join(failed)), report)
+
+        return report
+
 
     def exec_analyze_table(self, table_name, scheme='public'):
         """
@@ -146,11 +322,11 @@ class SqlRunner:
             with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
                 cursor.execute("""
                 select
-                  distinct("tablename") as tablename 
+                  tablename
                 from
-                  pg_table_def
+                  pg_tables
                 where
-                  "schemaname"=%s;
+                  schemaname=%s;
                 """, (scheme, ))
 
                 return [row['tablename'] for row in cursor.fetchall()]
@@ -160,12 +336,12 @@ class SqlRunner:
             with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
                 cursor.execute("""
                 select
-                  distinct("tablename") as tablename 
+                  tablename
                 from
-                  pg_table_def
+                  pg_tables
                 where
-                  "tablename"=%s and
-                  "schemaname"=%s;
+                  tablename=%s and
+                  schemaname=%s;
                 """, (table_name, scheme))
 
                 return len(cursor.fetchall()) > 0
@@ -7,9 +7,12 @@ import time
 import json
 import socket
 import itertools
+from datetime import timezone
+from email.utils import parsedate_to_datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from etl import config
+from etl.utils import metrics
 
 
 def exec_time(func):
@@ -19,6 +22,7 @@ def exec_time(func):
     def _timed(*args, **kwargs):
         start = time.time()
         result = func(*args, **kwargs)
+        metrics.observe_stage(func.__name__, time.time() - start)
         return result
     return _timed
 
@@ -33,6 +37,7 @@ def exec_time_info(info_str):
             msg = "Start '{}'".format(info_str)
             result = func(*args, **kwargs)
             msg = "Finished '{}' in {:.2f}s".format(info_str, time.time() - start)
+            metrics.observe_stage(info_str, time.time() - start)
             return result
         return _timed
     return _timing_decorator
@@ -63,6 +68,18 @@ def get_iterator_or_none(iterator, empty_iterator=False):
         return ()
 
 
+def iter_batches(iterable, batch_size):
+    """
+    Split an iterable into lists of up to batch_size items
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
 def get_script_name():
     """
     Get nice looking script name with stripped path and .py
@@ -97,6 +114,17 @@ def get_elapsed_time(started_at, finished_at):
     return delta.seconds + delta.microseconds / 1000000.
 
 
+def parse_http_date(value):
+    """
+    Parse an RFC 822 date string like 'Mon, 15 Apr 2019 18:33:51 GMT' into a naive UTC datetime.
+    Return None if the value can't be parsed.
+    """
+    try:
+        return parsedate_to_datetime(value).astimezone(timezone.utc).replace(tzinfo=None)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
 def get_host_name():
     """
     Get host name.
@@ -0,0 +1,108 @@
+"""
+ETL metrics.
+
+Metrics are collected into a dedicated prometheus_client registry during a run and written at the end of
+the run into a node_exporter textfile and, if configured, pushed to a Pushgateway.
+"""
+import os
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, push_to_gateway, write_to_textfile
+
+from etl import config
+from etl.common.db import get_pool_stats
+
+REGISTRY = CollectorRegistry()
+
+API_REQUEST_SECONDS = Histogram(
+    'indeed_api_request_seconds', 'Indeed API request latency including retries', ['endpoint'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0), registry=REGISTRY)
+API_RETRIES = Counter(
+    'indeed_api_retries_total', 'Indeed API request retries', ['endpoint'], registry=REGISTRY)
+QUERY_PAGES = Counter(
+    'indeed_query_pages_total', 'Indeed search pages fetched per query', ['query'], registry=REGISTRY)
+QUERY_RESULTS = Counter(
+    'indeed_query_results_total', 'Indeed search results received per query', ['query'], registry=REGISTRY)
+CACHE_REQUESTS = Counter(
+    'indeed_cache_total', 'Indeed response cache hits, misses and evictions', ['result'], registry=REGISTRY)
+
+LOADER_ROWS = Counter(
+    'etl_loader_rows_total', 'Rows transformed and serialized by a loader', ['loader', 'status'], registry=REGISTRY)
+LOADER_ROWS_PER_SECOND = Gauge(
+    'etl_loader_rows_per_second', 'Rows per second through transform and serialization', ['loader'],
+    registry=REGISTRY)
+
+COPY_ROWS = Counter('etl_copy_rows_total', 'Rows loaded with COPY', ['table'], registry=REGISTRY)
+COPY_BYTES = Counter('etl_copy_bytes_total', 'Bytes loaded with COPY', ['table'], registry=REGISTRY)
+COPY_QUARANTINED_ROWS = Counter(
+    'etl_copy_quarantined_rows_total', 'Rows quarantined by COPY', ['table'], registry=REGISTRY)
+
+SQL_SECONDS = Gauge('etl_sql_duration_seconds', 'SQL script duration', ['script'], registry=REGISTRY)
+SQL_AFFECTED_ROWS = Gauge('etl_sql_affected_rows', 'SQL script affected rows', ['script'], registry=REGISTRY)
+
+STAGE_SECONDS = Gauge('etl_stage_duration_seconds', 'ETL stage duration', ['stage'], registry=REGISTRY)
+
+DB_POOL = Gauge('etl_db_pool', 'DB connection pool counters', ['counter'], registry=REGISTRY)
+
+
+def observe_api_request(url, duration, retries=0):
+    endpoint = url.rstrip('/').rsplit('/', 1)[-1]
+    API_REQUEST_SECONDS.labels(endpoint).observe(duration)
+    if retries:
+        API_RETRIES.labels(endpoint).inc(retries)
+
+
+def count_cache(result):
+    CACHE_REQUESTS.labels(result).inc()
+
+
+def count_page(query, results_count):
+    QUERY_PAGES.labels(query).inc()
+    QUERY_RESULTS.labels(query).inc(results_count)
+
+
+def count_loader_rows(loader, processed, malformed, duration):
+    LOADER_ROWS.labels(loader, 'processed').inc(processed)
+    LOADER_ROWS.labels(loader, 'malformed').inc(malformed)
+    if duration > 0:
+        LOADER_ROWS_PER_SECOND.labels(loader).set((processed + malformed) / duration)
+
+
+def count_copy(table, rows, size, quarantined=0):
+    COPY_ROWS.labels(table).inc(max(rows, 0))
+    if size:
+        COPY_BYTES.labels(table).inc(size)
+    if quarantined:
+        COPY_QUARANTINED_ROWS.labels(table).inc(quarantined)
+
+
+def observe_sql(script, duration, affected_rows):
+    SQL_SECONDS.labels(script).set(duration)
+    SQL_AFFECTED_ROWS.labels(script).set(affected_rows)
+
+
+def observe_stage(stage, duration):
+    STAGE_SECONDS.labels(stage).set(duration)
+
+
+def write_metrics(job):
+    """
+    Write collected metrics into the textfile and push them to the Pushgateway if configured.
+    Errors are printed and not raised, it's called from finally blocks and mustn't hide the run error.
+
+    :return: True if the metrics were written
+    """
+    for counter, value in get_pool_stats().items():
+        DB_POOL.labels(counter).set(value)
+
+    try:
+        if config.ETL_METRICS_TEXTFILE:
+            os.makedirs(os.path.dirname(config.ETL_METRICS_TEXTFILE) or '.', exist_ok=True)
+            write_to_textfile(config.ETL_METRICS_TEXTFILE, REGISTRY)
+
+        if config.ETL_METRICS_PUSHGATEWAY:
+            push_to_gateway(config.ETL_METRICS_PUSHGATEWAY, job=job, registry=REGISTRY)
+    except Exception as ex:
+        print('Failed to write metrics: {!r}'.format(ex))
+        return False
+
+    return True
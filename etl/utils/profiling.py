@@ -0,0 +1,185 @@
+"""
+Opt-in profiling hooks.
+
+With ETL_PROFILE enabled stages are wrapped in nested trace spans written as a Chrome trace JSON timeline
+(open it in chrome://tracing or https://ui.perfetto.dev). With ETL_PROFILE_CPROFILE enabled as well
+a cProfile dump is written per outermost span of every thread.
+
+With profiling disabled spans are a shared no-op object and generators are returned untouched,
+so the overhead is a function call per hook.
+"""
+import os
+import re
+import json
+import time
+import cProfile
+import threading
+from datetime import datetime
+from functools import wraps
+
+from etl import config
+from etl import constants
+
+_origin = time.perf_counter()
+_events = []
+_aggregates = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _add_event(name, started_at, finished_at, args):
+    event = {
+        'name': name,
+        'ph': 'X',
+        'ts': (started_at - _origin) * 1000000,
+        'dur': (finished_at - started_at) * 1000000,
+        'pid': os.getpid(),
+        'tid': threading.get_ident(),
+        'args': args,
+    }
+    with _lock:
+        _events.append(event)
+
+
+def _get_file_name(name, ext):
+    return '{}-{}{}'.format(
+        re.sub(r'[^\w.-]+', '_', name), datetime.utcnow().strftime(constants.TSV_OUTPUT_TIMESTAMP), ext)
+
+
+class _NoopSpan:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self._profile = None
+        self._started_at = None
+
+    def __enter__(self):
+        if config.ETL_PROFILE_CPROFILE and not getattr(_local, 'profiling', False):
+            _local.profiling = True
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _add_event(self.name, self._started_at, time.perf_counter(), self.args)
+
+        if self._profile is not None:
+            self._profile.disable()
+            _local.profiling = False
+            os.makedirs(config.ETL_PROFILE_DIR, exist_ok=True)
+            self._profile.dump_stats(os.path.join(config.ETL_PROFILE_DIR, _get_file_name(self.name, '.prof')))
+
+        return False
+
+
+def span(name, **args):
+    """
+    Trace span context manager
+    """
+    if not config.ETL_PROFILE:
+        return _NOOP_SPAN
+
+    return _Span(name, args)
+
+
+def traced(name):
+    """
+    Wrap every call of a function into a trace span
+    """
+    def _decorator(func):
+        @wraps(func)
+        def _traced(*args, **kwargs):
+            if not config.ETL_PROFILE:
+                return func(*args, **kwargs)
+
+            with _Span(name, {}):
+                return func(*args, **kwargs)
+        return _traced
+    return _decorator
+
+
+def _trace_iterable(name, iterable, aggregate):
+    busy_time = 0.0
+    items_count = 0
+    started_at = time.perf_counter()
+    iterator = iter(iterable)
+
+    while True:
+        next_started_at = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            busy_time += time.perf_counter() - next_started_at
+
+        items_count += 1
+        yield item
+
+    if aggregate:
+        with _lock:
+            total = _aggregates.setdefault(name, {'busy_secs': 0.0, 'calls': 0, 'items': 0})
+            total['busy_secs'] += busy_time
+            total['calls'] += 1
+            total['items'] += items_count
+        return
+
+    _add_event(name, started_at, time.perf_counter(), {'busy_secs': busy_time, 'items': items_count})
+
+
+def trace_generator(name, iterable, aggregate=False):
+    """
+    Measure time spent producing items of a generator stage. The time the consumer spends between items
+    isn't counted as busy time.
+
+    :param aggregate: Don't add an event per generator, sum up busy time over all calls instead.
+                      Used for per item stages like transform
+    """
+    if not config.ETL_PROFILE:
+        return iterable
+
+    return _trace_iterable(name, iterable, aggregate)
+
+
+def write_trace(name):
+    """
+    Write collected spans as a Chrome trace JSON file.
+    Errors are printed and not raised, it's called from finally blocks and mustn't hide the run error.
+
+    :return: trace file path or None if profiling is disabled or the file can't be written
+    """
+    if not config.ETL_PROFILE:
+        return None
+
+    with _lock:
+        trace = {
+            'traceEvents': list(_events),
+            'displayTimeUnit': 'ms',
+            'otherData': {'aggregates': dict(_aggregates)},
+        }
+
+    path = os.path.join(config.ETL_PROFILE_DIR, _get_file_name(name, '.json'))
+    try:
+        os.makedirs(config.ETL_PROFILE_DIR, exist_ok=True)
+        with open(path, 'w') as trace_file:
+            json.dump(trace, trace_file)
+    except OSError as ex:
+        print('Failed to write the trace: {!r}'.format(ex))
+        return None
+
+    return path
@@ -0,0 +1,288 @@
+"""
+Long-running Indeed ETL daemon.
+
+Instead of running every active query at the cron cadence, every indeed_etl_jobs row runs on its own
+refresh_interval. Due rows are kept in a priority queue ordered by next_run_at. Each due row is extracted as a
+sharded run of its own (see indeed_etl.py --run-id) on a pool of ETL_DAEMON_CONCURRENCY threads, so a slow row
+doesn't hold the others. Extracted runs are merged in the background while the next due rows are extracted.
+The duration update runs every ETL_DAEMON_DURATION_SECS, taking turns with the merges.
+
+The daemon owns the stage tables: it rebuilds them at start, every run loads its own stage partitions and the
+partitions are dropped once merged. New cron pipeline runs (job_indeed.py) are refused while the daemon runs,
+run a single daemon per database.
+
+The process lives across runs, so the DB connection pool and the keep-alive HTTP session of the Indeed client
+stay warm.
+"""
+import time
+import heapq
+import signal
+import traceback
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from etl import config
+from etl.common.db import get_postgres
+from etl.indeed.indeed_work_queue import WorkQueue, StageBusyError, RUNS_TABLE_NAME, get_worker_id
+from etl.utils import metrics
+from etl.utils.common import get_script_name
+
+import indeed_etl
+import indeed_sql_update
+import indeed_duration_update
+
+# Sharded worker id prefix of the daemon runs, the worker id is unique per daemon process
+WORKER_ID_PREFIX = 'indeed_daemon'
+# Max seconds slept at once, so a stop signal is handled quickly
+MAX_SLEEP_SECS = 5
+
+
+class IndeedDaemon:
+    """
+    Schedule indeed_etl_jobs rows by their refresh interval
+    """
+
+    def __init__(self):
+        self.concurrency = config.ETL_DAEMON_CONCURRENCY
+        self.script_name = get_script_name()
+        self.worker_id = get_worker_id(WORKER_ID_PREFIX)
+
+        # heap of (next run at, query id)
+        self._queue = []
+        # extraction future -> (run work queue, query id)
+        self._extractions = {}
+        # (run work queue, query id) of extracted runs waiting for a merge, query id is None for failed runs
+        self._unmerged = []
+        # runs of the running merge
+        self._merging = []
+        # future of the running merge or duration update
+        self._background = None
+        self._reload_at = None
+        self._duration_at = None
+        self._stopped = False
+
+    def stop(self, *args):
+        print('stopping once the running extractions are merged')
+        self._stopped = True
+
+    @staticmethod
+    def _warm_up():
+        """
+        Open the pool connections before the first run
+        """
+        with get_postgres() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('select 1')
+            conn.rollback()
+
+    def _claim_stage(self):
+        """
+        Rebuild the stage tables once no run of another worker uses them
+
+        :return: False if the daemon was stopped while waiting
+        """
+        while not self._stopped:
+            try:
+                indeed_etl.claim_stage(self.worker_id)
+                return True
+            except StageBusyError as ex:
+                print('{}, retrying in {}s'.format(ex, config.ETL_DAEMON_RETRY_SECS))
+
+            retry_at = time.time() + config.ETL_DAEMON_RETRY_SECS
+            while not self._stopped and time.time() < retry_at:
+                time.sleep(MAX_SLEEP_SECS)
+
+        return False
+
+    def _get_busy(self):
+        """
+        Get ids of the query rows extracted or waiting for their merge
+        """
+        runs = list(self._extractions.values()) + self._unmerged + self._merging
+        return {query_id for _, query_id in runs if query_id is not None}
+
+    def _reload(self, now):
+        """
+        Rebuild the queue from indeed_etl_jobs, picks up new rows and changed schedules
+        """
+        busy = self._get_busy()
+        with get_postgres() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('select id, next_run_at from public.indeed_etl_jobs where is_active = TRUE')
+                self._queue = [(next_run_at or now, query_id) for query_id, next_run_at in cursor.fetchall()
+                               if query_id not in busy]
+            conn.rollback()
+
+        heapq.heapify(self._queue)
+        self._reload_at = now + timedelta(seconds=config.ETL_DAEMON_RELOAD_SECS)
+        print('{} active query rows scheduled'.format(len(self._queue)))
+
+    def _get_due(self, now, limit):
+        query_ids = []
+        while self._queue and self._queue[0][0] <= now and len(query_ids) < limit:
+            query_ids.append(heapq.heappop(self._queue)[1])
+
+        return query_ids
+
+    def _reschedule(self, query_ids):
+        """
+        Move the next run of the query rows by their refresh interval
+        """
+        with get_postgres() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                update public.indeed_etl_jobs
+                set next_run_at = now() at time zone 'utc' + refresh_interval
+                where id = any(%s)
+                returning id, next_run_at
+                """, (query_ids, ))
+                for query_id, next_run_at in cursor.fetchall():
+                    heapq.heappush(self._queue, (next_run_at, query_id))
+
+                cursor.execute(f"""
+                delete from {RUNS_TABLE_NAME}
+                where run_id like 'daemon_%%'
+                    and created_at < now() at time zone 'utc' - make_interval(days => %s)
+                """, (config.ETL_DAEMON_KEEP_RUNS_DAYS, ))
+            conn.commit()
+
+    def _retry(self, query_ids):
+        """
+        Move the next run of failed query rows by ETL_DAEMON_RETRY_SECS. It's stored, so reloads keep the backoff
+        """
+        retry_at = datetime.utcnow() + timedelta(seconds=config.ETL_DAEMON_RETRY_SECS)
+        try:
+            with get_postgres() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                    update public.indeed_etl_jobs set next_run_at = %s where id = any(%s)
+                    """, (retry_at, query_ids))
+                conn.commit()
+        except Exception:
+            traceback.print_exc()
+
+        for query_id in query_ids:
+            heapq.heappush(self._queue, (retry_at, query_id))
+
+    @staticmethod
+    def _extract(work_queue, query_id):
+        indeed_etl.main(run_id=work_queue.run_id, worker_id=work_queue.worker_id, merge=False, query_ids=[query_id],
+                        reset_stage=False, partition_suffix=work_queue.get_partition_suffix())
+
+    @staticmethod
+    def _merge(runs):
+        """
+        Merge the stage tables and drop the partitions of the extracted runs. Committed partitions of runs still
+        extracting are merged as well, they are dropped by a later merge.
+        """
+        for work_queue, _ in runs:
+            work_queue.start_merge()
+        indeed_sql_update.main()
+        for work_queue, _ in runs:
+            indeed_etl.drop_stage_partitions(work_queue.get_partition_suffix())
+            work_queue.set_merged()
+
+    def _start_extractions(self, executor, now):
+        for query_id in self._get_due(now, self.concurrency - len(self._extractions)):
+            run_id = 'daemon_{}_{}'.format(datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f'), query_id)
+            work_queue = WorkQueue(run_id, self.worker_id, partition_suffix=run_id)
+            print('run {}: query row {}'.format(run_id, query_id))
+            self._extractions[executor.submit(self._extract, work_queue, query_id)] = (work_queue, query_id)
+
+    def _start_background(self, merger, now):
+        """
+        Start the duration update when it's due, otherwise merge the extracted runs
+        """
+        if self._background is not None:
+            return
+
+        if not self._stopped and self._duration_at is not None and now >= self._duration_at:
+            self._duration_at = now + timedelta(seconds=config.ETL_DAEMON_DURATION_SECS)
+            self._background = merger.submit(indeed_duration_update.main)
+        elif self._unmerged:
+            self._merging, self._unmerged = self._unmerged, []
+            print('merging {} runs'.format(len(self._merging)))
+            self._background = merger.submit(self._merge, self._merging)
+
+    def _collect(self, done):
+        for future in done:
+            if future is self._background:
+                self._background = None
+                runs, self._merging = self._merging, []
+                query_ids = [query_id for _, query_id in runs if query_id is not None]
+                try:
+                    future.result()
+                except Exception:
+                    traceback.print_exc()
+                    # Partitions of the runs are left to the next merge
+                    self._unmerged.extend((work_queue, None) for work_queue, _ in runs)
+                    if query_ids:
+                        self._retry(query_ids)
+                else:
+                    if query_ids:
+                        self._reschedule(query_ids)
+            else:
+                work_queue, query_id = self._extractions.pop(future)
+                try:
+                    future.result()
+                except Exception:
+                    traceback.print_exc()
+                    self._unmerged.append((work_queue, None))
+                    self._retry([query_id])
+                else:
+                    self._unmerged.append((work_queue, query_id))
+
+            metrics.write_metrics(self.script_name)
+
+    def _wait(self, now):
+        """
+        Wait until an extraction or the background task finishes or the next schedule event
+
+        :return: finished futures
+        """
+        wake_at = [self._reload_at]
+        if self._queue and len(self._extractions) < self.concurrency:
+            wake_at.append(self._queue[0][0])
+        if self._duration_at is not None and self._background is None:
+            wake_at.append(self._duration_at)
+
+        timeout = min(max((min(wake_at) - now).total_seconds(), 0), MAX_SLEEP_SECS)
+        futures = list(self._extractions)
+        if self._background is not None:
+            futures.append(self._background)
+
+        if not futures:
+            time.sleep(timeout)
+            return set()
+
+        done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        return done
+
+    def run(self):
+        self._warm_up()
+        if not self._claim_stage():
+            return
+        if config.ETL_DAEMON_DURATION_SECS:
+            self._duration_at = datetime.utcnow()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor, \
+                ThreadPoolExecutor(max_workers=1) as merger:
+            while not self._stopped or self._extractions or self._unmerged or self._background is not None:
+                now = datetime.utcnow()
+                if not self._stopped:
+                    if now >= (self._reload_at or now):
+                        self._reload(now)
+                    self._start_extractions(executor, now)
+                self._start_background(merger, now)
+                self._collect(self._wait(now))
+
+
+def main(*args, **kwargs):
+    daemon = IndeedDaemon()
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run()
+
+
+if __name__ == '__main__':
+    main()
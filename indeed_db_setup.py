@@ -1,20 +1,32 @@
 from etl.sql.runner import runner
 
-SQL_SCRIPTS =[
-    'sql/indeed/indeed_etl_jobs_create.sql',
-    'sql/indeed/indeed_jobs_create.sql',
-    'sql/indeed/indeed_jobs_duration_create.sql',
-    'sql/indeed/indeed_jobs_full_text_create.sql',
-    'sql/indeed/indeed_mapping_day_create.sql',
-    'sql/indeed/indeed_mapping_month_create.sql',
-    'sql/indeed/indeed_queries_create.sql',
-]
+ETL_JOBS_CREATE = 'sql/indeed/indeed_etl_jobs_create.sql'
+ETL_RUNS_CREATE = 'sql/indeed/indeed_etl_runs_create.sql'
+JOBS_DURATION_CREATE = 'sql/indeed/indeed_jobs_duration_create.sql'
+
+# Script -> scripts it depends on. Independent scripts run concurrently.
+SQL_GRAPH = {
+    ETL_JOBS_CREATE: (),
+    'sql/indeed/indeed_etl_jobs_watermark_create.sql': (ETL_JOBS_CREATE, ),
+    'sql/indeed/indeed_etl_jobs_schedule_create.sql': (ETL_JOBS_CREATE, ),
+    'sql/indeed/indeed_etl_jobs_full_scan_create.sql': (ETL_JOBS_CREATE, ),
+    ETL_RUNS_CREATE: (ETL_JOBS_CREATE, ),
+    'sql/indeed/indeed_etl_run_stages_create.sql': (ETL_RUNS_CREATE, ),
+    'sql/indeed/indeed_jobs_create.sql': (),
+    JOBS_DURATION_CREATE: (),
+    'sql/indeed/indeed_jobs_duration_schedule_create.sql': (JOBS_DURATION_CREATE, ),
+    'sql/indeed/indeed_jobs_duration_seen_create.sql': (JOBS_DURATION_CREATE, ),
+    'sql/indeed/indeed_jobs_full_text_create.sql': (),
+    'sql/indeed/indeed_mapping_day_create.sql': (),
+    'sql/indeed/indeed_mapping_month_create.sql': (),
+    'sql/indeed/indeed_queries_create.sql': (),
+}
 
 
 def main(*args, **kwargs):
-    for script in SQL_SCRIPTS:
-        runner.exec_sql_script(script,explicit_commit=True)
-        print('Finished', script)
+    report = runner.exec_sql_graph(SQL_GRAPH)
+    for script, info in report.items():
+        print('Finished', script, 'in {:.2f}s'.format(info['duration_secs']))
 
 
 if __name__ == '__main__':
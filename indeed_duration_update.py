@@ -1,31 +1,110 @@
-import psycopg2
+import io
+from datetime import datetime
 
+from etl import config
 from etl.indeed.indeed_extractor import IndeedDuration
+from etl.indeed.indeed_scheduler import RecheckScheduler
 from etl.common.db import get_postgres
 
+STAGE_TABLE_NAME = 'indeed_stage_jobs_duration'
+
+STAGE_TABLE_DDL = f"""
+create temp table if not exists {STAGE_TABLE_NAME} (
+	job_key VARCHAR(30),
+	expired BOOLEAN,
+	api_active BOOLEAN,
+	last_checked TIMESTAMP,
+	next_check_at TIMESTAMP
+	)
+"""
+
+APPLY_CHECKED = f"""
+update public.indeed_jobs_duration d
+set last_checked = s.last_checked,
+	next_check_at = s.next_check_at,
+	check_count = d.check_count + 1
+from {STAGE_TABLE_NAME} s
+where d.job_key = s.job_key
+"""
+
+APPLY_EXPIRED = f"""
+update public.indeed_jobs_duration d
+set job_expired = current_date
+from {STAGE_TABLE_NAME} s
+where d.job_key = s.job_key
+	and s.expired
+"""
+
+APPLY_NO_API = f"""
+update public.indeed_jobs_duration d
+set job_no_api = current_date
+from {STAGE_TABLE_NAME} s
+where d.job_key = s.job_key
+	and not s.expired
+	and not s.api_active
+"""
+
+
+def _apply_batch(cursor, batch):
+    """
+    COPY a batch of duration results into the stage table and apply them with one UPDATE per outcome
+    """
+    buffer = io.StringIO()
+    for job_key, expired, api_active, last_checked, next_check_at in batch:
+        buffer.write('{}\t{}\t{}\t{}\t{}\n'.format(
+            job_key, expired, api_active, last_checked, next_check_at or '\\N'))
+    buffer.seek(0)
+
+    cursor.execute(f'truncate {STAGE_TABLE_NAME}')
+    cursor.copy_expert(f'COPY {STAGE_TABLE_NAME} from stdin', buffer)
+    cursor.execute(APPLY_CHECKED)
+    cursor.execute(APPLY_EXPIRED)
+    cursor.execute(APPLY_NO_API)
+
 
 def main(*args, **kwargs):
 
     extractor = IndeedDuration()
+    scheduler = RecheckScheduler()
+    checked_count = 0
+    expired_count = 0
+    no_api_count = 0
 
     with get_postgres() as conn:
-        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
-            for job_key, expired, api_active in extractor.extract():
-                print(job_key, expired, api_active)
+        with conn.cursor() as cursor:
+            cursor.execute(STAGE_TABLE_DDL)
+            scheduler.load_stats(cursor)
+
+            batch = []
+            for job, expired, api_active in extractor.extract():
+                checked_at = datetime.utcnow()
+                is_open = api_active and not expired
+                scheduler.record(job, checked_at, closed=not is_open)
+                next_check_at = scheduler.get_next_check_at(job, checked_at) if is_open else None
+
+                batch.append((job['job_key'], expired, api_active, checked_at, next_check_at))
+                checked_count += 1
                 if expired:
-                    cursor.execute(f"""
-                        update public.indeed_jobs_duration
-                        set job_expired = current_date
-                        where job_key = '{job_key}'
-                    """)
+                    expired_count += 1
                 elif not api_active:
-                    cursor.execute(f"""
-                        update public.indeed_jobs_duration
-                        set job_no_api = current_date
-                        where job_key = '{job_key}'
-                    """)
+                    no_api_count += 1
+
+                # Commit regularly so a crash doesn't throw away the whole run
+                if len(batch) >= config.INDEED_DURATION_COMMIT_ROWS:
+                    _apply_batch(cursor, batch)
+                    scheduler.save_stats(cursor)
+                    conn.commit()
+                    batch = []
+
+            if batch:
+                _apply_batch(cursor, batch)
+            scheduler.save_stats(cursor)
+            cursor.execute(f'drop table if exists {STAGE_TABLE_NAME}')
             conn.commit()
 
+    print('Checked {} job keys: {} expired, {} no api, {} open'.format(
+        checked_count, expired_count, no_api_count, checked_count - expired_count - no_api_count))
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
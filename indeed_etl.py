@@ -1,22 +1,242 @@
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+from etl import config
+from etl.indeed.indeed_client import indeed_client
 from etl.indeed.indeed_extractor import IndeedExtractor
-from etl.indeed.indeed_transformer import IndeedTransformer
+from etl.indeed.indeed_archive import ArchiveExtractor
+from etl.indeed.indeed_dedupe import reset_queries_stage, QUERIES_STAGE_TABLE_NAME, SEEN_STAGE_TABLE_NAME
+from etl.indeed.indeed_transformer import IndeedTransformer, STAGE_TABLE_NAME
+from etl.indeed.indeed_work_queue import WorkQueue, REGISTER_LOCK_KEY, check_stage_free
+from etl.common.db import get_postgres
 from etl.common.tsv_loader import TsvLoader
+from etl.common.stream_loader import StreamLoader, BinaryStreamLoader
 from etl.common.postgres_loader import PostGresLoader
 
+import indeed_sql_update
 
-def main(*args, **kwargs):
-    print('starting indeed extract')
-    extractor = IndeedExtractor()
+# Min seconds between claim attempts while other workers hold the leases of the unfinished rows
+MIN_POLL_SECS = 1
+# Checkpoint segments of a worker extracted at once, the next segment runs while the last rows of one finish
+SEGMENT_OVERLAP = 2
+
+def _clear_watermarks(cursor):
+    """
+    Drop the watermarks not promoted yet, their stage rows are dropped unmerged with the stage tables
+    """
+    cursor.execute("""
+    update public.indeed_etl_jobs
+    set
+        pending_watermark_date = null, pending_watermark_key = null,
+        merging_watermark_date = null, merging_watermark_key = null
+    where pending_watermark_date is not null or merging_watermark_date is not null
+    """)
+
+
+def _reset_stage():
+    PostGresLoader(IndeedTransformer(), None).rebuild_stage_table(truncate=config.ETL_STAGE_TRUNCATE)
+    with get_postgres() as conn:
+        with conn.cursor() as cursor:
+            reset_queries_stage(cursor)
+            _clear_watermarks(cursor)
+        conn.commit()
+
+
+def claim_stage(worker_id):
+    """
+    Rebuild the stage tables for a process owning them across its runs, for ex. indeed_daemon.py
+
+    :param worker_id: Worker id of the process runs
+    :raise StageBusyError: if a run of another worker uses the stage tables
+    """
+    with get_postgres() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('select pg_advisory_xact_lock(%s)', (REGISTER_LOCK_KEY, ))
+            check_stage_free(cursor, None, worker_id, config.ETL_SHARD_LEASE_SECS)
+            _reset_stage()
+        conn.commit()
+
+
+def create_stage_partitions(partition_suffix):
+    """
+    Create the stage partitions of a worker before its segments load them concurrently
+    """
+    PostGresLoader(IndeedTransformer(), None).create_stage_partition(partition_suffix)
+    with get_postgres() as conn:
+        with conn.cursor() as cursor:
+            for table_name in (QUERIES_STAGE_TABLE_NAME, SEEN_STAGE_TABLE_NAME):
+                cursor.execute('create table if not exists {0}_{1} () inherits ({0})'.format(
+                    table_name, partition_suffix))
+        conn.commit()
+
+
+def drop_stage_partitions(partition_suffix):
+    """
+    Drop the stage partitions of a worker once they are merged
+    """
+    with get_postgres() as conn:
+        with conn.cursor() as cursor:
+            for table_name in (STAGE_TABLE_NAME, QUERIES_STAGE_TABLE_NAME, SEEN_STAGE_TABLE_NAME):
+                cursor.execute('drop table if exists {}_{}'.format(table_name, partition_suffix))
+        conn.commit()
+
+
+def _load(extractor, partition_suffix=None):
+    """
+    Extract, transform and load into the stage tables
+
+    :param partition_suffix: Load into the worker stage partitions instead of rebuilding the stage tables
+    :raise StageBusyError: if the stage tables are rebuilt while a registered run uses them
+    """
     transformer = IndeedTransformer()
-    tsv_loader = TsvLoader(extractor, transformer)
-    tsv_loader.load()
-    postgres_loader = PostGresLoader(transformer, tsv_loader)
-    postgres_loader.rebuild_stage_table()
-    postgres_loader.load()
-    tsv_loader.cleanup()
+    if config.ETL_TSV_STAGE:
+        # Write an intermediate TSV file, useful for debugging
+        source_loader = TsvLoader(extractor, transformer)
+    elif config.ETL_COPY_FORMAT == 'binary':
+        source_loader = BinaryStreamLoader(extractor, transformer)
+    else:
+        source_loader = StreamLoader(extractor, transformer)
+    postgres_loader = PostGresLoader(transformer, source_loader)
+
+    try:
+        if partition_suffix is None:
+            source_loader.load()
+            with get_postgres() as conn:
+                with conn.cursor() as cursor:
+                    # Unregistered runs don't take the stage tables from registered ones, see claim_stage()
+                    cursor.execute('select pg_advisory_xact_lock(%s)', (REGISTER_LOCK_KEY, ))
+                    check_stage_free(cursor, None, None, config.ETL_SHARD_LEASE_SECS)
+                    postgres_loader.rebuild_stage_table(truncate=config.ETL_STAGE_TRUNCATE)
+                    _clear_watermarks(cursor)
+                conn.commit()
+        else:
+            postgres_loader.create_stage_partition(partition_suffix)
+            source_loader.load()
+        postgres_loader.load()
+    finally:
+        # Write the raw results archive even if the load fails, it's what a replay of the failed run reads
+        extractor.close()
+    extractor.deduplicator.load_query_pairs(partition_suffix)
+    extractor.deduplicator.close()
+    extractor.seen_keys.load(partition_suffix)
+    extractor.seen_keys.close()
+    extractor.commit_watermarks()
+    source_loader.cleanup()
+    print('processed rows: {}, malformed rows: {}, duplicates dropped: {}, seen keys: {}'.format(
+        source_loader.processed_rows_count, source_loader.malformed_rows_count,
+        extractor.deduplicator.duplicates_count, extractor.seen_keys.seen_count))
+
+
+def _load_segment(work_queue, extractor, partition_suffix):
+    """
+    Extract and load the rows of a checkpoint segment, then finish them
+    """
+    try:
+        _load(extractor, partition_suffix)
+    finally:
+        extractor.claims_done.set()
+
+    if extractor.query_ids:
+        work_queue.finish(extractor.query_ids)
+        print('checkpoint: {} query rows finished'.format(len(extractor.query_ids)))
+
+
+def _load_segments(work_queue, partition_suffix):
+    """
+    Load segments of checkpoint_rows rows until no row is claimable. Once a segment has claimed its rows the next
+    segment starts claiming, so the slowest rows of a segment don't stall the worker.
+    """
+    segments = []
+    with ThreadPoolExecutor(max_workers=SEGMENT_OVERLAP) as executor:
+        while True:
+            extractor = IndeedExtractor(work_queue=work_queue, claims_done=threading.Event())
+            segment = executor.submit(_load_segment, work_queue, extractor, partition_suffix)
+            segments.append(segment)
+            extractor.claims_done.wait()
+
+            # A segment short of checkpoint_rows rows claimed all the claimable rows
+            if not work_queue.checkpoint_rows or len(extractor.query_ids) < work_queue.checkpoint_rows:
+                break
+            if any(segment.done() and segment.exception() is not None for segment in segments):
+                break
+
+    for segment in segments:
+        segment.result()
+
+
+def _load_shard(work_queue, query_ids=None, reset_stage=True):
+    """
+    Claim, extract and load query rows of the run, committing every checkpoint_rows rows.
+    Returns once all the run rows are finished, rows leased by other workers are waited for and claimed
+    if their lease expires.
+    """
+    work_queue.register(reset_stage=_reset_stage if reset_stage else None, query_ids=query_ids)
+    partition_suffix = work_queue.get_partition_suffix()
+    create_stage_partitions(partition_suffix)
+    print('worker {} of run {}'.format(work_queue.worker_id, work_queue.run_id))
+
+    try:
+        while True:
+            _load_segments(work_queue, partition_suffix)
+
+            wait_secs = work_queue.get_wait_secs()
+            if wait_secs is None:
+                break
+
+            print('waiting {:.0f}s for query rows leased by other workers'.format(wait_secs))
+            time.sleep(max(wait_secs, MIN_POLL_SECS))
+    finally:
+        work_queue.close()
+
+
+def main(*args, replay=False, from_date=None, to_date=None, run_id=None, worker_id=None, merge=True, query_ids=None,
+         checkpoint_rows=None, reset_stage=True, partition_suffix=None, **kwargs):
+    """
+    :param replay: Rebuild the stage table from the raw results archive instead of calling the Indeed API.
+                   The replayed stage is merged with indeed_sql_update --replay, overwriting existing indeed_jobs rows
+    :param from_date: First archive fetch date to replay, YYYY-MM-DD
+    :param to_date: Last archive fetch date to replay, YYYY-MM-DD
+    :param run_id: Run id shared by sharded workers. Each worker claims indeed_etl_jobs rows of the run,
+                   loads its own stage partitions and the worker finishing last runs indeed_sql_update.
+                   Rerunning a worker with the same run id and worker id resumes it
+    :param worker_id: Sharded worker id, host name and pid by default
+    :param merge: Run indeed_sql_update once all the run shards finish or the replay is loaded
+    :param query_ids: Extract only these indeed_etl_jobs rows of a new run
+    :param checkpoint_rows: Query rows committed per checkpoint, ETL_CHECKPOINT_ROWS by default
+    :param reset_stage: Rebuild the stage tables when the run is created, off for runs of a process owning them
+    :param partition_suffix: Stage partitions suffix of the worker, the worker id by default
+    """
+    if replay:
+        print('starting indeed replay')
+        _load(ArchiveExtractor(from_date=from_date, to_date=to_date))
+        if merge:
+            indeed_sql_update.main(replay=True)
+    elif run_id:
+        print('starting indeed extract')
+        work_queue = WorkQueue(run_id, worker_id, checkpoint_rows=checkpoint_rows, partition_suffix=partition_suffix)
+        _load_shard(work_queue, query_ids, reset_stage)
+        if merge and work_queue.claim_merge():
+            print('all shards of run {} finished, merging'.format(run_id))
+            indeed_sql_update.main()
+            work_queue.set_merged()
+    else:
+        print('starting indeed extract')
+        _load(IndeedExtractor())
+
+    print('response cache: {}'.format(indeed_client.cache.get_stats()))
     print('finished indeed extract')
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Load Indeed search results into the stage tables')
+    parser.add_argument('--replay', action='store_true',
+                        help='read the raw results archive instead of the API and merge it over existing rows')
+    parser.add_argument('--from-date', help='first archive fetch date to replay, YYYY-MM-DD')
+    parser.add_argument('--to-date', help='last archive fetch date to replay, YYYY-MM-DD')
+    parser.add_argument('--run-id', help='shard the run across all the workers started with this run id')
+    parser.add_argument('--worker-id', help='sharded worker id, host name and pid by default')
+    cmd_args = parser.parse_args()
+    main(replay=cmd_args.replay, from_date=cmd_args.from_date, to_date=cmd_args.to_date,
+         run_id=cmd_args.run_id, worker_id=cmd_args.worker_id)
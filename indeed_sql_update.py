@@ -1,19 +1,60 @@
+import argparse
 
 from etl.sql.runner import runner
+from etl.sql.merge import MergeScript, DO_UPDATE
+from etl.indeed.indeed_work_queue import WorkQueue
 
-SQL_SCRIPTS =[
-    'sql/indeed/indeed_jobs_update.sql',
-    'sql/indeed/indeed_queries_update.sql',
-    'sql/indeed/indeed_jobs_full_text_update.sql',
-    'sql/indeed/indeed_jobs_duration_update.sql',
-]
+WATERMARK_SNAPSHOT = 'sql/indeed/indeed_etl_jobs_watermark_snapshot.sql'
+JOBS_UPDATE = MergeScript('sql/indeed/indeed_jobs_update.sql', 'public.indeed_jobs')
+JOBS_DURATION_UPDATE = MergeScript('sql/indeed/indeed_jobs_duration_update.sql', 'public.indeed_jobs_duration')
+QUERIES_UPDATE = MergeScript('sql/indeed/indeed_queries_update.sql', 'public.indeed_queries')
+JOBS_FULL_TEXT_UPDATE = MergeScript('sql/indeed/indeed_jobs_full_text_update.sql', 'public.indeed_jobs_full_text')
+# Replayed rows overwrite the existing indeed_jobs rows
+JOBS_REPLAY_UPDATE = MergeScript('sql/indeed/indeed_jobs_replay_update.sql', 'public.indeed_jobs',
+                                 on_conflict=DO_UPDATE)
 
+# Script -> scripts it depends on. Independent scripts run concurrently.
+SQL_GRAPH = {
+    WATERMARK_SNAPSHOT: (),
+    JOBS_UPDATE: (WATERMARK_SNAPSHOT, ),
+    'sql/indeed/indeed_etl_jobs_watermark_update.sql': (JOBS_UPDATE, ),
+    QUERIES_UPDATE: (),
+    JOBS_FULL_TEXT_UPDATE: (JOBS_UPDATE, ),
+    JOBS_DURATION_UPDATE: (JOBS_UPDATE, ),
+    'sql/indeed/indeed_jobs_duration_seen_update.sql': (JOBS_DURATION_UPDATE, ),
+}
 
-def main(*args, **kwargs):
-    for script in SQL_SCRIPTS:
-        runner.exec_sql_script(script,explicit_commit=True)
-        print('Finished', script)
+# Merge of a stage rebuilt from the raw results archive (indeed_etl.py --replay). Replays don't move watermarks
+# and don't see keys. Full text rows have no replayed column, durations get the replayed job date.
+REPLAY_SQL_GRAPH = {
+    JOBS_REPLAY_UPDATE: (),
+    QUERIES_UPDATE: (),
+    JOBS_FULL_TEXT_UPDATE: (JOBS_REPLAY_UPDATE, ),
+    JOBS_DURATION_UPDATE: (JOBS_REPLAY_UPDATE, ),
+    'sql/indeed/indeed_jobs_duration_replay_update.sql': (JOBS_DURATION_UPDATE, ),
+}
+
+
+def main(*args, run_id=None, replay=False, **kwargs):
+    """
+    :param run_id: Sharded run merged, its merge is recorded so no new run resets the stage tables meanwhile
+    :param replay: Merge a replayed stage, overwriting the existing rows
+    """
+    work_queue = WorkQueue(run_id) if run_id else None
+    if work_queue is not None:
+        work_queue.start_merge()
+
+    report = runner.exec_sql_graph(REPLAY_SQL_GRAPH if replay else SQL_GRAPH)
+    for script, info in report.items():
+        print('Finished', script, 'in {:.2f}s'.format(info['duration_secs']))
+
+    if work_queue is not None:
+        work_queue.set_merged()
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Merge the Indeed stage tables')
+    parser.add_argument('--replay', action='store_true',
+                        help='merge a stage replayed from the raw results archive, overwriting existing rows')
+    cmd_args = parser.parse_args()
+    main(replay=cmd_args.replay)
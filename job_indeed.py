@@ -1,3 +1,9 @@
+import time
+import argparse
+
+from etl.indeed.indeed_run_state import PipelineRun
+from etl.indeed.indeed_work_queue import get_worker_id
+from etl.utils import metrics, profiling
 from etl.utils.common import get_script_name
 
 import indeed_etl
@@ -10,12 +16,47 @@ SCRIPTS =[
     indeed_duration_update,
 ]
 
-def main():
+# Sharded worker id prefix of the pipeline processes
+WORKER_ID_PREFIX = 'job_indeed'
+
+
+def main(run_id=None, resume=False, checkpoint_rows=None):
+    """
+    :param checkpoint_rows: Query rows committed per extraction checkpoint, ETL_CHECKPOINT_ROWS by default
+    """
     parent_script_name = get_script_name()
+    run = PipelineRun([script.__name__ for script in SCRIPTS], run_id=run_id, resume=resume)
+    run.open()
+    # Worker ids are unique per process, so an overlapping run doesn't pass for the owner of the stage tables.
+    # A resumed run takes over the worker id of the crashed process: its leases and stage partitions
+    worker_id = run.worker_id or get_worker_id(WORKER_ID_PREFIX)
+    print('run {}, worker {}'.format(run.run_id, worker_id))
+
+    try:
+        for script in SCRIPTS:
+            if run.is_finished(script.__name__):
+                print('skipping finished', script.__name__)
+                continue
 
-    for script in SCRIPTS:
-        script.main(script_name=script.__name__, parent_script_name=parent_script_name)
+            start = time.time()
+            run.start_stage(script.__name__)
+            with profiling.span(script.__name__):
+                # The merge is a stage of its own
+                script.main(script_name=script.__name__, parent_script_name=parent_script_name,
+                            run_id=run.run_id, worker_id=worker_id, merge=False, checkpoint_rows=checkpoint_rows)
+            run.finish_stage(script.__name__)
+            metrics.observe_stage(script.__name__, time.time() - start)
+    finally:
+        metrics.write_metrics(parent_script_name)
+        profiling.write_trace(parent_script_name)
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Run the Indeed ETL pipeline')
+    parser.add_argument('--resume', action='store_true',
+                        help='resume the latest unfinished run, or --run-id, skipping committed work')
+    parser.add_argument('--run-id', help='run id, a new one is generated by default')
+    parser.add_argument('--checkpoint-rows', type=int,
+                        help='query rows extracted per checkpoint, a resumed run skips the committed ones')
+    cmd_args = parser.parse_args()
+    main(run_id=cmd_args.run_id, resume=cmd_args.resume, checkpoint_rows=cmd_args.checkpoint_rows)
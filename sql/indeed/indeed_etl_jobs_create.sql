@@ -11,7 +11,11 @@ create table if not exists public.indeed_etl_jobs(
 	job_type VARCHAR (25),  --- Allowed values: "fulltime", "parttime", "contract", "internship", "temporary".
 	country VARCHAR (20),
 	channel VARCHAR (50),
-	is_active boolean
+	is_active boolean,
+	watermark_date timestamp, --- newest job date loaded for the query
+	watermark_key VARCHAR(30),
+	pending_watermark_date timestamp, --- newest job date staged, promoted once merged into indeed_jobs
+	pending_watermark_key VARCHAR(30)
 );
 
 insert into public.indeed_etl_jobs (query, city, state, zip, radius, fromage, sort, site_type, job_type, country, channel, is_active)
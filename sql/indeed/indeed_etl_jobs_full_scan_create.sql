@@ -0,0 +1,3 @@
+alter table public.indeed_etl_jobs
+	add column if not exists last_full_scan_at timestamp --- last run paginating the query past its watermark
+;
@@ -0,0 +1,4 @@
+alter table public.indeed_etl_jobs
+	add column if not exists refresh_interval interval not null default interval '1 day', --- for ex. '1 hour' for high-churn queries
+	add column if not exists next_run_at timestamp --- next daemon run of the query, null runs it right away
+;
@@ -0,0 +1,8 @@
+alter table public.indeed_etl_jobs
+	add column if not exists watermark_date timestamp,
+	add column if not exists watermark_key VARCHAR(30),
+	add column if not exists pending_watermark_date timestamp,
+	add column if not exists pending_watermark_key VARCHAR(30),
+	add column if not exists merging_watermark_date timestamp, --- pending watermark taken by the running merge
+	add column if not exists merging_watermark_key VARCHAR(30)
+;
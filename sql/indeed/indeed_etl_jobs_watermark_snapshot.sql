@@ -0,0 +1,11 @@
+--- Take the pending watermarks before indeed_jobs is merged. Their stage rows are committed before them, so the merge
+--- includes these rows, while watermarks committed during the merge stay pending for the next one.
+update public.indeed_etl_jobs
+set
+	merging_watermark_date = pending_watermark_date
+	, merging_watermark_key = pending_watermark_key
+	, pending_watermark_date = null
+	, pending_watermark_key = null
+where pending_watermark_date is not null
+	and (merging_watermark_date is null or merging_watermark_date < pending_watermark_date)
+;
@@ -0,0 +1,8 @@
+update public.indeed_etl_jobs
+set
+	watermark_date = merging_watermark_date
+	, watermark_key = merging_watermark_key
+	, merging_watermark_date = null
+	, merging_watermark_key = null
+where merging_watermark_date is not null
+;
@@ -0,0 +1,8 @@
+create table if not exists public.indeed_etl_run_stages(
+	run_id VARCHAR(64) not null,
+	stage VARCHAR(100) not null,
+	created_at timestamp not null default (now() at time zone 'utc'),
+	started_at timestamp,
+	finished_at timestamp, --- a resumed run skips finished stages
+	primary key (run_id, stage)
+);
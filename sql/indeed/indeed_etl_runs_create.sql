@@ -0,0 +1,21 @@
+create table if not exists public.indeed_etl_runs(
+	run_id VARCHAR(64) primary key,
+	created_at timestamp not null default (now() at time zone 'utc'),
+	merge_started_at timestamp, --- set by the worker which runs the final merge
+	merged_at timestamp
+);
+
+create table if not exists public.indeed_etl_job_runs(
+	run_id VARCHAR(64) not null references public.indeed_etl_runs (run_id) on delete cascade,
+	query_id INT not null,
+	worker_id VARCHAR(100), --- worker holding the lease
+	lease_expires_at timestamp, --- the row can be claimed again once the lease expires
+	attempts INT not null default 0,
+	finished_at timestamp, --- set once the worker stage partition is committed
+	primary key (run_id, query_id)
+);
+
+create index if not exists indeed_etl_job_runs_open_idx
+	on public.indeed_etl_job_runs (run_id, lease_expires_at)
+	where finished_at is null
+;
@@ -0,0 +1,8 @@
+update public.indeed_jobs_duration d
+set job_date = j.job_date
+from public.indeed_jobs j
+	join (select distinct jobkey from public.indeed_stage_jobs) sj ---only replayed keys
+	on j.job_key = sj.jobkey
+where d.job_key = j.job_key
+	and d.job_date is distinct from j.job_date
+;
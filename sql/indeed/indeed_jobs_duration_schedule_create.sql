@@ -0,0 +1,16 @@
+alter table public.indeed_jobs_duration
+	add column if not exists last_checked timestamp,
+	add column if not exists next_check_at timestamp,
+	add column if not exists check_count integer not null default 0
+;
+create index if not exists indeed_jobs_duration_next_check_idx
+	on public.indeed_jobs_duration (next_check_at)
+	where job_expired = '1900-01-01' and job_no_api = '1900-01-01'
+;
+create table if not exists public.indeed_jobs_duration_stats(
+	age_bucket integer primary key,
+	checks_count bigint not null default 0,
+	closed_count bigint not null default 0,
+	exposure_days double precision not null default 0,
+	updated_at timestamp
+);
@@ -0,0 +1,3 @@
+alter table public.indeed_jobs_duration
+	add column if not exists last_seen_at timestamp
+;
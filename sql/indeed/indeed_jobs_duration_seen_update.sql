@@ -0,0 +1,8 @@
+update public.indeed_jobs_duration d
+set last_seen_at = now() at time zone 'utc'
+from (
+	select distinct jobkey
+	from public.indeed_stage_seen ---keys of all the fetched search results, before the watermark filter
+	) s
+where d.job_key = s.jobkey
+;
@@ -1,9 +1,17 @@
-insert into public.indeed_jobs_duration
 select distinct
-	job_key
-	,job_date
+	j.job_key
+	,j.job_date
 	,to_date('1900-01-01','YYYY-MM-DD') job_expired
 	,to_date('1900-01-01','YYYY-MM-DD') job_no_api
-from public.indeed_jobs
-where job_key not in (select job_key from public.indeed_jobs_duration)
+from public.indeed_jobs j
+	join (select distinct jobkey from public.indeed_stage_jobs) sj ---only keys of this run
+	on j.job_key = sj.jobkey
+union
+select
+	j.job_key
+	,j.job_date
+	,to_date('1900-01-01','YYYY-MM-DD') job_expired
+	,to_date('1900-01-01','YYYY-MM-DD') job_no_api
+from public.indeed_jobs j ---backfill keys a failed earlier merge missed
+where not exists (select 1 from public.indeed_jobs_duration d where d.job_key = j.job_key)
 ;
@@ -1,7 +1,13 @@
-insert into public.indeed_jobs_full_text
-
 select distinct
-	job_key
+	j.job_key
 	, null job_text
-from public.indeed_jobs
-where job_key not in (select job_key from public.indeed_jobs_full_text)
+from public.indeed_jobs j
+	join (select distinct jobkey from public.indeed_stage_jobs) sj ---only keys of this run
+	on j.job_key = sj.jobkey
+union
+select
+	j.job_key
+	, null job_text
+from public.indeed_jobs j ---backfill keys a failed earlier merge missed
+where not exists (select 1 from public.indeed_jobs_full_text ft where ft.job_key = j.job_key)
+;
@@ -0,0 +1,25 @@
+select distinct on (sj.jobkey)
+	sj.jobkey as job_key
+	, sj.job_date
+	, sj.job_time
+	, sj.jobtitle as job_title
+	, sj.company
+	, sj.city
+	, sj.state
+	, sj.zip
+	, sj.country
+	, sj.latitude
+	, sj.longitude
+	, sj.jobsource as job_source
+	, sj.url
+	, sj.onmousedown as on_mouse_down
+	, sj.sponsored
+	, sj.expired
+	, sj.indeedapply
+	, sj.stations
+	, sj.day_num
+from public.indeed_stage_jobs sj
+where sj.job_date is not null
+	and sj.url||sj.onmousedown is not null
+order by sj.jobkey, sj.url||sj.onmousedown collate "C" desc ---same row as indeed_jobs_update, one per key for the update
+;
@@ -19,5 +19,9 @@ create table if not exists public.indeed_stage_jobs(
 	indeedapply BOOLEAN,
 	formattedlocationfull VARCHAR(50),
 	formattedrelativetime VARCHAR(30),
-	stations VARCHAR(30)
+	stations VARCHAR(30),
+	job_date DATE,
+	job_time TIME,
+	day_num INTEGER,
+	zip VARCHAR(15)
 );
\ No newline at end of file
@@ -0,0 +1,20 @@
+"""
+Shared test fixtures.
+
+Tests using the db_conn fixture run against the database configured with the PG_DB_* environment variables
+and are skipped when PG_DB_HOST isn't set.
+"""
+import pytest
+
+from etl import config
+from etl.common.db import get_postgres
+
+
+@pytest.fixture
+def db_conn():
+    if not config.PG_DB_HOST:
+        pytest.skip('PG_DB_HOST is not set')
+
+    with get_postgres() as conn:
+        yield conn
+        conn.rollback()
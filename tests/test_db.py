@@ -0,0 +1,39 @@
+"""
+DbConn pool accounting against the configured database.
+"""
+import pytest
+
+from etl import config
+from etl.common.db import DbConn
+
+
+@pytest.fixture
+def make_pool():
+    if not config.PG_DB_HOST:
+        pytest.skip('PG_DB_HOST is not set')
+
+    pools = []
+
+    def _make_pool(**kwargs):
+        pool = DbConn(**kwargs)
+        pools.append(pool)
+        return pool
+
+    yield _make_pool
+
+    for pool in pools:
+        for conn, _ in pool._pool:
+            conn.close()
+
+
+@pytest.mark.parametrize('min_size, connects', [(0, 1), (3, 3)])
+def test_warm_up_is_not_a_checkout(make_pool, min_size, connects):
+    pool = make_pool(min_size=min_size, max_size=5)
+
+    conn = pool.get_conn()
+    pool.put_conn(conn)
+
+    stats = pool.get_stats()
+    assert stats['checkouts'] == 1
+    assert stats['connects'] == connects
+    assert stats['idle'] == connects
@@ -0,0 +1,70 @@
+"""
+IndeedClient response caching.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from etl.indeed.indeed_cache import ResponseCache, CACHED_AT_KEY
+from etl.indeed.indeed_client import IndeedClient
+
+RESPONSES = {
+    '/error': {'error': 'Invalid publisher number provided.'},
+    '/empty': {'totalResults': 0},
+    '/results': {'totalResults': 1, 'results': [{'jobkey': 'key'}]},
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        data = json.dumps(RESPONSES[self.path.split('?')[0]]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{}'.format(server.server_port)
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('path, cached', [('/error', False), ('/empty', False), ('/results', True)])
+def test_only_responses_with_results_are_cached(stub_url, tmp_path, path, cached):
+    cache = ResponseCache(path=str(tmp_path), ttl=60, max_size=1024 * 1024, enabled=True, refresh=False)
+    client = IndeedClient(cache=cache)
+    url = stub_url + path
+
+    assert client.get(url, {'q': 'python'}) == RESPONSES[path]
+    assert (cache.get(url, {'q': 'python'}) is not None) == cached
+
+
+def test_cached_responses_are_flagged(stub_url, tmp_path):
+    cache = ResponseCache(path=str(tmp_path), ttl=60, max_size=1024 * 1024, enabled=True, refresh=False)
+    client = IndeedClient(cache=cache)
+    url = stub_url + '/results'
+
+    assert CACHED_AT_KEY not in client.get(url, {'q': 'python'})
+    assert CACHED_AT_KEY in client.get(url, {'q': 'python'})
+
+
+def test_cache_write_error_returns_the_response(stub_url, tmp_path):
+    # A file where the cache directory should be fails every cache write
+    cache_path = tmp_path / 'cache'
+    cache_path.write_text('')
+    cache = ResponseCache(path=str(cache_path), ttl=60, max_size=1024 * 1024, enabled=True, refresh=False)
+    client = IndeedClient(cache=cache)
+
+    assert client.get(stub_url + '/results', {'q': 'python'}) == RESPONSES['/results']
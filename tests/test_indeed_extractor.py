@@ -0,0 +1,127 @@
+"""
+IndeedExtractor pagination against a local stub Indeed server.
+"""
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from etl import constants
+from etl.indeed.indeed_archive import ArchiveWriter
+from etl.indeed.indeed_client import indeed_client
+from etl.indeed.indeed_extractor import IndeedExtractor
+
+# query -> totalResults returned by the stub
+TOTAL_RESULTS = {
+    'python': 130,
+    'data engineer': 60,
+    'etl': 0,
+    'sql': 25,
+}
+# Latency of every stub response in seconds
+STUB_LATENCY = 0.05
+
+
+class StubIndeedHandler(BaseHTTPRequestHandler):
+    """
+    apisearch stub returning deterministic pages of results
+    """
+
+    def do_GET(self):
+        params = {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+        query = params['q']
+        start = int(params['start'])
+        total_results = TOTAL_RESULTS[query]
+        # Like the API, end is the offset after the last result of the page
+        end = min(start + constants.INDEED_LIMIT, total_results)
+
+        with self.server.lock:
+            self.server.requests.append((query, start))
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+
+        body = {
+            'totalResults': total_results,
+            'start': start,
+            'end': end,
+            'results': [{
+                'jobkey': '{}-{}'.format(query, offset),
+                'jobtitle': query,
+                'date': 'Mon, 15 Apr 2019 18:33:51 GMT',
+                'url': 'http://stub/{}'.format(offset),
+                'onmousedown': '',
+            } for offset in range(start, end)],
+        }
+        time.sleep(STUB_LATENCY)
+        with self.server.lock:
+            self.server.in_flight -= 1
+
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubIndeedHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.in_flight = 0
+    server.max_in_flight = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setattr(constants, 'INDEED_JOB_SEARCH', 'http://127.0.0.1:{}/ads/apisearch'.format(server.server_port))
+    monkeypatch.setattr(indeed_client.cache, 'enabled', False)
+    monkeypatch.setattr(indeed_client._limiter, 'rate', 0)
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def _get_params():
+    return [{
+        'id': query_id,
+        'query': query,
+        'zip': '28202',
+        'sort': 'relevance',
+        'radius': 25,
+        'fromage': None,
+        'site_type': None,
+        'job_type': None,
+        'country': 'us',
+        'channel': None,
+        'watermark_date': None,
+    } for query_id, query in enumerate(TOTAL_RESULTS)]
+
+
+def _extract(server, monkeypatch, workers):
+    monkeypatch.setattr(IndeedExtractor, '_get_parameters', lambda self: iter(_get_params()))
+    server.requests = []
+    server.max_in_flight = 0
+    extractor = IndeedExtractor(workers=workers, archive=ArchiveWriter(enabled=False))
+
+    rows = list(extractor.extract())
+
+    return sorted(server.requests), sorted(row['jobkey'] for row in rows), server.max_in_flight
+
+
+def test_concurrent_pagination_matches_sequential(stub_server, monkeypatch):
+    sequential_requests, sequential_keys, sequential_in_flight = _extract(stub_server, monkeypatch, workers=1)
+    concurrent_requests, concurrent_keys, concurrent_in_flight = _extract(stub_server, monkeypatch, workers=8)
+
+    assert concurrent_requests == sequential_requests
+    assert concurrent_keys == sequential_keys
+    assert {query for query, _ in concurrent_requests} == set(TOTAL_RESULTS)
+    assert sequential_in_flight == 1
+    assert concurrent_in_flight > 1
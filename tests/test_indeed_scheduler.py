@@ -0,0 +1,104 @@
+"""
+RecheckScheduler intervals and expiry statistics.
+"""
+import math
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from etl.indeed.indeed_scheduler import RecheckScheduler, STATS_TABLE_NAME, get_age_bucket
+
+CHECKED_AT = datetime(2019, 4, 15, 12)
+CREATE_SCRIPTS = ('sql/indeed/indeed_jobs_duration_create.sql', 'sql/indeed/indeed_jobs_duration_schedule_create.sql')
+
+
+def _get_job(age_days, check_count=0, last_checked=None):
+    job_date = None if age_days is None else CHECKED_AT.date() - timedelta(days=age_days)
+    return {'job_date': job_date, 'check_count': check_count, 'last_checked': last_checked}
+
+
+def _get_scheduler(rates=None):
+    scheduler = RecheckScheduler()
+    scheduler.min_days = 1.0
+    scheduler.max_days = 30.0
+    scheduler.backoff = 1.5
+    scheduler.target = 0.25
+    scheduler.min_samples = 100
+    scheduler._rates = rates or {}
+    return scheduler
+
+
+def _get_interval_days(scheduler, job):
+    return (scheduler.get_next_check_at(job, CHECKED_AT) - CHECKED_AT).total_seconds() / 86400
+
+
+@pytest.mark.parametrize('age_days, age_bucket', [(-1, 0), (0, 0), (6, 0), (7, 7), (29, 14), (364, 180), (900, 365)])
+def test_age_bucket(age_days, age_bucket):
+    assert get_age_bucket(age_days) == age_bucket
+
+
+@pytest.mark.parametrize('age_days, check_count, interval', [
+    (20, 0, 2.0),
+    (20, 2, 4.5),
+    # Clamped to the min and max days
+    (3, 0, 1.0),
+    (None, 0, 1.0),
+    (365, 5, 30.0),
+])
+def test_interval_without_stats_backs_off(age_days, check_count, interval):
+    scheduler = _get_scheduler()
+
+    assert _get_interval_days(scheduler, _get_job(age_days, check_count)) == pytest.approx(interval)
+
+
+def test_interval_with_stats_keeps_the_target():
+    rate = 0.05
+    scheduler = _get_scheduler({14: rate, 30: 0.0, 60: 10.0})
+    interval = -math.log(1 - scheduler.target) / rate
+
+    # The target probability holds whatever the open checks count
+    for check_count in (0, 3, 10):
+        assert _get_interval_days(scheduler, _get_job(20, check_count)) == pytest.approx(interval)
+    # A bucket with no closed job is checked at the max days, a high rate at the min days
+    assert _get_interval_days(scheduler, _get_job(40, 0)) == pytest.approx(30.0)
+    assert _get_interval_days(scheduler, _get_job(70, 0)) == pytest.approx(1.0)
+
+
+def test_exposure_accounting():
+    scheduler = _get_scheduler()
+
+    # First check: exposed since the job date, up to the max days
+    scheduler.record(_get_job(10), CHECKED_AT, closed=False)
+    scheduler.record(_get_job(100), CHECKED_AT, closed=True)
+    # Rechecks: exposed since the previous check
+    scheduler.record(_get_job(11, 1, CHECKED_AT - timedelta(hours=36)), CHECKED_AT, closed=True)
+    # No job date: age 0, exposed for the min days
+    scheduler.record(_get_job(None), CHECKED_AT, closed=False)
+
+    assert scheduler._observed == {
+        7: [2, 1, 11.5],
+        90: [1, 1, 30.0],
+        0: [1, 0, 1.0],
+    }
+
+
+def test_save_stats_adds_to_the_stored_stats(db_conn):
+    with db_conn.cursor() as cursor:
+        for script in CREATE_SCRIPTS:
+            with open(script) as sql_file:
+                cursor.execute(sql_file.read())
+        cursor.execute(f'delete from {STATS_TABLE_NAME}')
+
+        scheduler = _get_scheduler()
+        scheduler.min_samples = 3
+        for _ in range(2):
+            scheduler.record(_get_job(10), CHECKED_AT, closed=False)
+            scheduler.record(_get_job(10, 1, CHECKED_AT - timedelta(days=2)), CHECKED_AT, closed=True)
+            scheduler.save_stats(cursor)
+            assert scheduler._observed == {}
+
+        cursor.execute(f'select age_bucket, checks_count, closed_count, exposure_days from {STATS_TABLE_NAME}')
+        assert cursor.fetchall() == [(7, 4, 2, 24.0)]
+
+        scheduler.load_stats(cursor)
+        assert scheduler._rates == {7: pytest.approx(2 / 24.0)}
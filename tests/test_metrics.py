@@ -0,0 +1,16 @@
+"""
+Metrics export.
+"""
+from etl import config
+from etl.utils import metrics
+
+
+def test_write_metrics_failure_is_not_raised(tmp_path, monkeypatch):
+    textfile = tmp_path / 'job_indeed.prom'
+    monkeypatch.setattr(config, 'ETL_METRICS_TEXTFILE', str(textfile))
+    # Nothing listens on port 1
+    monkeypatch.setattr(config, 'ETL_METRICS_PUSHGATEWAY', '127.0.0.1:1')
+    metrics.observe_stage('test_stage', 1.0)
+
+    assert metrics.write_metrics('test_job') is False
+    assert 'etl_stage_duration_seconds' in textfile.read_text()
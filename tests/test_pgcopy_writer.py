@@ -0,0 +1,121 @@
+"""
+PGCOPY binary writer round trip through COPY ... (FORMAT binary).
+"""
+import io
+from datetime import date, time
+
+import pyarrow
+import pytest
+
+from etl.base.transformer import ARROW_TYPES
+from etl.common.pgcopy_writer import COPY_OPTIONS, PgBinaryWriter
+
+COLUMN_TYPES = {
+    'name': 'varchar',
+    'description': 'text',
+    'latitude': 'float8',
+    'day_num': 'int4',
+    'sponsored': 'bool',
+    'job_date': 'date',
+    'job_time': 'time',
+}
+FIELDS = tuple(COLUMN_TYPES)
+
+ROWS = [
+    {
+        'name': 'python developer',
+        'description': 'plain text',
+        'latitude': 35.2271,
+        'day_num': 1,
+        'sponsored': True,
+        'job_date': date(2019, 4, 15),
+        'job_time': time(18, 33, 51),
+    },
+    {
+        'name': 'Zürich – 東京 😀',
+        'description': 'tab\there, backslash \\ quote " newline\nand a NUL-free   line separator',
+        'latitude': -0.5,
+        'day_num': -7,
+        'sponsored': False,
+        'job_date': date(1999, 12, 31),
+        'job_time': time(0, 0, 0, 1),
+    },
+    {field: None for field in FIELDS},
+    {
+        'name': '',
+        'description': '',
+        'latitude': '1e-7',
+        'day_num': '42',
+        'sponsored': 'false',
+        'job_date': '2000-01-01',
+        'job_time': '23:59:59.999999',
+    },
+]
+
+TABLE_DDL = """
+create temp table pgcopy_round_trip (
+    name VARCHAR(100),
+    description TEXT,
+    latitude FLOAT,
+    day_num INTEGER,
+    sponsored BOOLEAN,
+    job_date DATE,
+    job_time TIME
+    )
+"""
+
+EXPECTED = [
+    ROWS[0],
+    ROWS[1],
+    ROWS[2],
+    {
+        'name': '',
+        'description': '',
+        'latitude': 1e-7,
+        'day_num': 42,
+        'sponsored': False,
+        'job_date': date(2000, 1, 1),
+        'job_time': time(23, 59, 59, 999999),
+    },
+]
+
+
+def _get_table(rows):
+    return pyarrow.Table.from_arrays(
+        [pyarrow.array([row[field] for row in rows], type=ARROW_TYPES[COLUMN_TYPES[field]]) for field in FIELDS],
+        names=list(FIELDS))
+
+
+def test_encode_table_matches_encode_row():
+    writer = PgBinaryWriter(FIELDS, COLUMN_TYPES)
+    table = _get_table(EXPECTED)
+    records = [writer.encode_row(row) for row in EXPECTED]
+
+    assert writer.encode_table(table) == records
+    # Sliced arrays and several chunks
+    assert writer.encode_table(table.slice(1, 2)) == records[1:3]
+    assert writer.encode_table(pyarrow.concat_tables([table, table.slice(2)])) == records + records[2:]
+    assert writer.encode_table(table.slice(0, 0)) == []
+
+
+def test_encode_table_checks_column_types():
+    writer = PgBinaryWriter(FIELDS, dict(COLUMN_TYPES, day_num='float8'))
+
+    with pytest.raises(TypeError):
+        writer.encode_table(_get_table(EXPECTED))
+
+
+def test_binary_copy_round_trip(db_conn):
+    writer = PgBinaryWriter(FIELDS, COLUMN_TYPES)
+    payload = writer.get_header() + b''.join(writer.encode_row(row) for row in ROWS) + writer.get_trailer()
+
+    with db_conn.cursor() as cursor:
+        cursor.execute(TABLE_DDL)
+        cursor.copy_expert('COPY pgcopy_round_trip ({}) from stdin with {}'.format(', '.join(FIELDS), COPY_OPTIONS),
+                           io.BytesIO(payload))
+        assert cursor.rowcount == len(ROWS)
+
+        cursor.execute('select {} from pgcopy_round_trip'.format(', '.join(FIELDS)))
+        loaded = [dict(zip(FIELDS, row)) for row in cursor.fetchall()]
+
+    assert loaded == EXPECTED
@@ -0,0 +1,136 @@
+"""
+PostGresLoader stage table rebuild and parallel COPY against the configured database.
+"""
+import io
+
+import pytest
+
+from etl import config, constants
+from etl.common.db import get_postgres
+from etl.common.pgcopy_writer import PgBinaryWriter
+from etl.common.postgres_loader import PostGresLoader, QUARANTINE_TABLE_NAME, QUARANTINE_TABLE_DDL
+
+TABLE_NAME = 'test_stage_loader'
+TABLE_DDL = 'create table {} (id INTEGER, name VARCHAR(20))'.format(TABLE_NAME)
+
+
+class StubTransformer:
+
+    def __init__(self, table_ddl=TABLE_DDL):
+        self.table_ddl = table_ddl
+
+    def get_stage_table_name(self):
+        return TABLE_NAME
+
+    def get_stage_table_ddl(self):
+        return self.table_ddl
+
+
+class StubSource:
+    copy_chunk_options = "csv delimiter '\t'"
+    binary = False
+
+    def get_file_name(self):
+        return 'test_stage_loader.tsv'
+
+
+class StubStreamSource:
+    """
+    Streamed rows, the second row has a NUL character and a name too long for the stage column
+    """
+    ROWS = [{'id': 1, 'name': 'good'}, {'id': 2, 'name': 'bad\x00' * 10}, {'id': 3, 'name': 'good'}]
+
+    def __init__(self, binary):
+        self.binary = binary
+        self.writer = PgBinaryWriter(['id', 'name'], {'id': 'int4', 'name': 'varchar'})
+        self.copy_chunk_options = '(format binary)' if binary else "(format text)"
+
+    def get_file_name(self):
+        return None
+
+    def iter_records(self):
+        for row in self.ROWS:
+            yield self.writer.encode_row(row) if self.binary else '{id}\t{name}\n'.format(**row)
+
+    def make_payload(self, records):
+        if self.binary:
+            return io.BytesIO(self.writer.get_header() + b''.join(records) + self.writer.get_trailer())
+        return io.StringIO(''.join(records))
+
+
+def _query(sql_query):
+    with get_postgres() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(sql_query)
+            result = cursor.fetchall() if cursor.description else None
+        conn.commit()
+    return result
+
+
+@pytest.fixture
+def stage_table(db_conn):
+    _query('drop table if exists {}'.format(TABLE_NAME))
+    yield TABLE_NAME
+    _query('drop table if exists {}'.format(TABLE_NAME))
+
+
+def test_truncate_keeps_a_matching_table(stage_table):
+    PostGresLoader(StubTransformer(), None).rebuild_stage_table()
+    _query("insert into {} values (1, 'a')".format(stage_table))
+    oid = _query("select '{}'::regclass::oid".format(stage_table))
+
+    PostGresLoader(StubTransformer(), None).rebuild_stage_table(truncate=True, unlogged=False)
+
+    assert _query("select '{}'::regclass::oid".format(stage_table)) == oid
+    assert _query('select count(*) from {}'.format(stage_table)) == [(0, )]
+
+
+@pytest.mark.parametrize('table_ddl, unlogged', [
+    ('create table {} (id INTEGER, name VARCHAR(50))'.format(TABLE_NAME), False),
+    (TABLE_DDL, True),
+])
+def test_truncate_recreates_a_changed_table(stage_table, table_ddl, unlogged):
+    PostGresLoader(StubTransformer(), None).rebuild_stage_table()
+
+    PostGresLoader(StubTransformer(table_ddl), None).rebuild_stage_table(truncate=True, unlogged=unlogged)
+
+    persistence, = _query("select relpersistence from pg_class where oid = '{}'::regclass".format(stage_table))[0]
+    name_type, = _query("select format_type(atttypid, atttypmod) from pg_attribute "
+                        "where attrelid = '{}'::regclass and attname = 'name'".format(stage_table))[0]
+    assert persistence == ('u' if unlogged else 'p')
+    assert name_type == ('character varying(50)' if '50' in table_ddl else 'character varying(20)')
+
+
+def test_failed_chunk_truncates_the_stage(stage_table, tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, 'LOCAL_STORAGE', str(tmp_path) + '/')
+    monkeypatch.setattr(config, 'ETL_COPY_QUARANTINE', False)
+    lines = ['{}\tname {}'.format(i, i) for i in range(1000)] + ['not a number\tbad']
+    (tmp_path / StubSource().get_file_name()).write_text('\n'.join(lines) + '\n')
+
+    loader = PostGresLoader(StubTransformer(), StubSource())
+    loader.rebuild_stage_table()
+    with pytest.raises(Exception):
+        loader.load_parallel(4)
+
+    assert _query('select count(*) from {}'.format(stage_table)) == [(0, )]
+
+
+@pytest.mark.parametrize('binary', [True, False])
+def test_quarantine_saves_rows_with_nul(stage_table, monkeypatch, binary):
+    monkeypatch.setattr(config, 'ETL_COPY_QUARANTINE', True)
+    source = StubStreamSource(binary)
+    bad_record = list(source.iter_records())[1]
+    _query(QUARANTINE_TABLE_DDL)
+    _query("delete from {} where table_name = '{}'".format(QUARANTINE_TABLE_NAME, stage_table))
+
+    loader = PostGresLoader(StubTransformer(), source)
+    loader.rebuild_stage_table()
+    loader.load()
+
+    assert _query('select id from {} order by id'.format(stage_table)) == [(1, ), (3, )]
+    raw_line, = _query("select raw_line from {} where table_name = '{}'"
+                       .format(QUARANTINE_TABLE_NAME, stage_table))[0]
+    if binary:
+        assert bytes.fromhex(raw_line) == bad_record
+    else:
+        assert raw_line == bad_record.replace('\x00', '\\x00')
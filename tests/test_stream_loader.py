@@ -0,0 +1,68 @@
+"""
+StreamLoader row and columnar batch serialization.
+"""
+import pytest
+
+from etl.common.stream_loader import StreamLoader, BinaryStreamLoader
+from etl.indeed.indeed_transformer import IndeedTransformer
+
+# Characters str.splitlines() treats as line boundaries
+LINE_BOUNDARIES = ('\r', '\x0b', '\x0c', '\x1c', '\x1d', '\x1e', '\x85', ' ', ' ')
+
+
+class ListExtractor:
+
+    def __init__(self, items):
+        self.items = items
+
+    def extract(self):
+        return iter(self.items)
+
+
+def _get_items():
+    return [{
+        'jobkey': 'key{}'.format(i),
+        'query': 'python',
+        'jobtitle': 'Python{}Developer'.format(boundary),
+        'company': 'Company{}Inc'.format(boundary),
+        'city': 'Charlotte',
+        'state': 'NC',
+        'country': 'US',
+        'latitude': 35.2271,
+        'longitude': -80.8431,
+        'source': 'Indeed',
+        'date': 'Mon, 15 Apr 2019 18:33:51 GMT',
+        'url': 'http://www.indeed.com/viewjob?jk={}'.format(i),
+        'onmousedown': '',
+        'sponsored': False,
+        'expired': False,
+        'indeedApply': True,
+        'formattedLocationFull': 'Charlotte, NC 28202',
+        'snippet': 'snippet{}text'.format(boundary),
+    } for i, boundary in enumerate(LINE_BOUNDARIES)]
+
+
+@pytest.mark.parametrize('loader_class', [StreamLoader, BinaryStreamLoader])
+def test_batch_records_match_row_records(loader_class):
+    items = _get_items()
+    items[0].update(date='not a date', formattedLocationFull=None, latitude=None, sponsored=None)
+    loader = loader_class(ListExtractor(items), IndeedTransformer())
+
+    row_records = list(loader._iter_rows(items))
+    batch_records = list(loader._iter_batch_rows(items))
+
+    assert len(batch_records) == len(items)
+    assert batch_records == row_records
+    assert loader.malformed_rows_count == 0
+
+
+@pytest.mark.parametrize('loader_class', [StreamLoader, BinaryStreamLoader])
+def test_batch_without_jobtitle_fails_like_rows(loader_class):
+    items = _get_items()
+    del items[1]['jobtitle']
+    loader = loader_class(ListExtractor(items), IndeedTransformer())
+
+    with pytest.raises(AttributeError):
+        list(loader._iter_rows(items))
+    with pytest.raises(AttributeError):
+        list(loader._iter_batch_rows(items))